@@ -0,0 +1,25 @@
+"""CDEK account of a shipment
+
+Revision ID: 1c5f8a3e7b94
+Revises: 6a2c9e4b8d31
+Create Date: 2026-03-18 09:41:07.215384
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '1c5f8a3e7b94'
+down_revision: Union[str, None] = '6a2c9e4b8d31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('shipments', sa.Column('cdek_account', sa.String(length=50), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('shipments', 'cdek_account')
@@ -0,0 +1,53 @@
+"""Raw CDEK payload store and shipment polls
+
+Revision ID: 2c6f8e1a9d43
+Revises: 7e3b9a5c1f62
+Create Date: 2026-03-02 12:15:08.604417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '2c6f8e1a9d43'
+down_revision: Union[str, None] = '7e3b9a5c1f62'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('raw_payloads',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('content_hash', sa.String(length=64), nullable=False),
+    sa.Column('codec', sa.String(length=10), nullable=False),
+    sa.Column('raw_size', sa.Integer(), nullable=False),
+    sa.Column('body', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('content_hash')
+    )
+    op.create_table('shipment_polls',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('shipment_id', sa.Integer(), nullable=False),
+    sa.Column('payload_id', sa.Integer(), nullable=False),
+    sa.Column('first_polled_at', sa.DateTime(), nullable=False),
+    sa.Column('last_polled_at', sa.DateTime(), nullable=False),
+    sa.Column('poll_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['payload_id'], ['raw_payloads.id'], ),
+    sa.ForeignKeyConstraint(['shipment_id'], ['shipments.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('uq_shipment_polls_shipment_payload', 'shipment_polls', ['shipment_id', 'payload_id'], unique=True)
+    op.create_index('ix_shipment_polls_payload_id', 'shipment_polls', ['payload_id'], unique=False)
+    # Сырые ответы уже сжаты, сжатие TOAST для них бесполезно
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("ALTER TABLE raw_payloads ALTER COLUMN body SET STORAGE EXTERNAL")
+
+
+def downgrade() -> None:
+    op.drop_index('ix_shipment_polls_payload_id', table_name='shipment_polls')
+    op.drop_index('uq_shipment_polls_shipment_payload', table_name='shipment_polls')
+    op.drop_table('shipment_polls')
+    op.drop_table('raw_payloads')
@@ -0,0 +1,53 @@
+"""Status dedupe and timeline indexes
+
+Revision ID: 3f9c1b7d2a64
+Revises: e701230aade1
+Create Date: 2026-01-12 11:02:17.518204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '3f9c1b7d2a64'
+down_revision: Union[str, None] = 'e701230aade1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Перед созданием уникального индекса удаляем дубликаты статусов,
+    # оставляя самую раннюю запись
+    op.execute(
+        "DELETE FROM shipment_statuses WHERE id NOT IN ("
+        "SELECT MIN(id) FROM shipment_statuses "
+        "GROUP BY shipment_id, status_code, status_datetime)"
+    )
+    op.create_index(
+        'uq_shipment_statuses_dedupe',
+        'shipment_statuses',
+        ['shipment_id', 'status_code', 'status_datetime'],
+        unique=True
+    )
+    op.create_index(
+        'ix_shipment_statuses_shipment_id_status_datetime',
+        'shipment_statuses',
+        ['shipment_id', sa.text('status_datetime DESC')],
+        unique=False,
+        postgresql_include=['status_code']
+    )
+    # Индексы по первичным ключам дублируют PK, а индекс по shipment_id
+    # покрывается префиксом новых составных индексов
+    op.drop_index('ix_shipment_statuses_shipment_id', table_name='shipment_statuses')
+    op.drop_index('ix_shipment_statuses_id', table_name='shipment_statuses')
+    op.drop_index('ix_shipments_id', table_name='shipments')
+
+
+def downgrade() -> None:
+    op.create_index('ix_shipments_id', 'shipments', ['id'], unique=False)
+    op.create_index('ix_shipment_statuses_id', 'shipment_statuses', ['id'], unique=False)
+    op.create_index('ix_shipment_statuses_shipment_id', 'shipment_statuses', ['shipment_id'], unique=False)
+    op.drop_index('ix_shipment_statuses_shipment_id_status_datetime', table_name='shipment_statuses')
+    op.drop_index('uq_shipment_statuses_dedupe', table_name='shipment_statuses')
@@ -0,0 +1,26 @@
+"""Shipment updated_at
+
+Revision ID: 4b8e1f6c2d53
+Revises: 8c3f6d1a9e27
+Create Date: 2026-10-19 10:12:44.508117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '4b8e1f6c2d53'
+down_revision: Union[str, None] = '8c3f6d1a9e27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('shipments', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute("UPDATE shipments SET updated_at = created_at")
+
+
+def downgrade() -> None:
+    op.drop_column('shipments', 'updated_at')
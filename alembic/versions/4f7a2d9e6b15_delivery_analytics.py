@@ -0,0 +1,76 @@
+"""Delivery time facts and precomputed rollups
+
+Revision ID: 4f7a2d9e6b15
+Revises: 9d1e5b7a3c08
+Create Date: 2026-03-12 11:05:41.338207
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '4f7a2d9e6b15'
+down_revision: Union[str, None] = '9d1e5b7a3c08'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+SmallId = sa.SmallInteger().with_variant(sa.Integer(), 'sqlite')
+
+
+def upgrade() -> None:
+    op.create_table('shipment_transit_facts',
+    sa.Column('shipment_id', sa.Integer(), nullable=False),
+    sa.Column('origin_city_id', sa.Integer(), nullable=True),
+    sa.Column('destination_city_id', sa.Integer(), nullable=True),
+    sa.Column('first_status_at', sa.DateTime(), nullable=False),
+    sa.Column('delivered_at', sa.DateTime(), nullable=False),
+    sa.Column('transit_seconds', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('shipment_id')
+    )
+    op.create_index(op.f('ix_shipment_transit_facts_delivered_at'), 'shipment_transit_facts', ['delivered_at'], unique=False)
+    
+    op.create_table('status_stage_facts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('shipment_id', sa.Integer(), nullable=False),
+    sa.Column('status_code_id', SmallId, nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('duration_seconds', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_status_stage_facts_shipment_id'), 'status_stage_facts', ['shipment_id'], unique=False)
+    
+    op.create_table('transit_percentiles',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('dimension', sa.String(length=20), nullable=False),
+    sa.Column('origin_city_id', sa.Integer(), nullable=True),
+    sa.Column('city_id', sa.Integer(), nullable=True),
+    sa.Column('status_code_id', SmallId, nullable=True),
+    sa.Column('shipments', sa.Integer(), nullable=False),
+    sa.Column('p50_seconds', sa.Float(), nullable=False),
+    sa.Column('p90_seconds', sa.Float(), nullable=False),
+    sa.Column('p99_seconds', sa.Float(), nullable=False),
+    sa.Column('computed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_transit_percentiles_dimension'), 'transit_percentiles', ['dimension'], unique=False)
+    
+    op.create_table('daily_shipment_counts',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('in_transit', sa.Integer(), nullable=False),
+    sa.Column('delivered', sa.Integer(), nullable=False),
+    sa.Column('problematic', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('day')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('daily_shipment_counts')
+    op.drop_index(op.f('ix_transit_percentiles_dimension'), table_name='transit_percentiles')
+    op.drop_table('transit_percentiles')
+    op.drop_index(op.f('ix_status_stage_facts_shipment_id'), table_name='status_stage_facts')
+    op.drop_table('status_stage_facts')
+    op.drop_index(op.f('ix_shipment_transit_facts_delivered_at'), table_name='shipment_transit_facts')
+    op.drop_table('shipment_transit_facts')
@@ -0,0 +1,38 @@
+"""Refresh queue columns on shipments
+
+Revision ID: 5b8e2c9f4d17
+Revises: c2d7e4f18a90
+Create Date: 2026-02-11 09:38:26.904512
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '5b8e2c9f4d17'
+down_revision: Union[str, None] = 'c2d7e4f18a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('shipments', sa.Column('next_poll_at', sa.DateTime(), nullable=True))
+    op.add_column('shipments', sa.Column('lease_owner', sa.String(length=100), nullable=True))
+    op.add_column('shipments', sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ix_shipments_next_poll_at',
+        'shipments',
+        ['next_poll_at'],
+        unique=False,
+        postgresql_where=sa.text('is_delivered = false'),
+        sqlite_where=sa.text('is_delivered = 0')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_shipments_next_poll_at', table_name='shipments')
+    op.drop_column('shipments', 'lease_expires_at')
+    op.drop_column('shipments', 'lease_owner')
+    op.drop_column('shipments', 'next_poll_at')
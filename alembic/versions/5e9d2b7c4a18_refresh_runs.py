@@ -0,0 +1,48 @@
+"""Checkpointed refresh runs
+
+Revision ID: 5e9d2b7c4a18
+Revises: 1c5f8a3e7b94
+Create Date: 2026-03-19 16:08:33.540217
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '5e9d2b7c4a18'
+down_revision: Union[str, None] = '1c5f8a3e7b94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('refresh_runs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('owner', sa.String(length=100), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.Column('max_shipment_id', sa.Integer(), nullable=False),
+    sa.Column('last_shipment_id', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('processed', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('succeeded', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('failed', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('new_statuses', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(
+        'ux_refresh_runs_unfinished',
+        'refresh_runs',
+        [sa.text('(finished_at IS NULL)')],
+        unique=True,
+        postgresql_where=sa.text('finished_at IS NULL'),
+        sqlite_where=sa.text('finished_at IS NULL')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ux_refresh_runs_unfinished', table_name='refresh_runs')
+    op.drop_table('refresh_runs')
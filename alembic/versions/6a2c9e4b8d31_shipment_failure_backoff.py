@@ -0,0 +1,60 @@
+"""Failure counters and quarantine for shipments
+
+Revision ID: 6a2c9e4b8d31
+Revises: b3e8d1f5a7c2
+Create Date: 2026-03-16 10:14:52.671930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '6a2c9e4b8d31'
+down_revision: Union[str, None] = 'b3e8d1f5a7c2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('shipments', sa.Column('failure_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('shipments', sa.Column('last_error', sa.String(length=30), nullable=True))
+    op.add_column('shipments', sa.Column('last_error_at', sa.DateTime(), nullable=True))
+    op.add_column('shipments', sa.Column('quarantined_at', sa.DateTime(), nullable=True))
+    
+    # Отправления на карантине не попадают в индекс очереди опроса
+    op.drop_index('ix_shipments_next_poll_at', table_name='shipments')
+    op.create_index(
+        'ix_shipments_next_poll_at',
+        'shipments',
+        ['next_poll_at'],
+        unique=False,
+        postgresql_where=sa.text('is_delivered = false AND quarantined_at IS NULL'),
+        sqlite_where=sa.text('is_delivered = 0 AND quarantined_at IS NULL')
+    )
+    op.create_index(
+        'ix_shipments_quarantined_at',
+        'shipments',
+        ['quarantined_at'],
+        unique=False,
+        postgresql_where=sa.text('quarantined_at IS NOT NULL'),
+        sqlite_where=sa.text('quarantined_at IS NOT NULL')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_shipments_quarantined_at', table_name='shipments')
+    op.drop_index('ix_shipments_next_poll_at', table_name='shipments')
+    op.create_index(
+        'ix_shipments_next_poll_at',
+        'shipments',
+        ['next_poll_at'],
+        unique=False,
+        postgresql_where=sa.text('is_delivered = false'),
+        sqlite_where=sa.text('is_delivered = 0')
+    )
+    op.drop_column('shipments', 'quarantined_at')
+    op.drop_column('shipments', 'last_error_at')
+    op.drop_column('shipments', 'last_error')
+    op.drop_column('shipments', 'failure_count')
@@ -0,0 +1,204 @@
+"""Status code, city and reason lookup tables
+
+Revision ID: 7e3b9a5c1f62
+Revises: d4a6f3b81c25
+Create Date: 2026-02-24 10:31:42.118506
+
+"""
+import re
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '7e3b9a5c1f62'
+down_revision: Union[str, None] = 'd4a6f3b81c25'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+SmallId = sa.SmallInteger().with_variant(sa.Integer(), 'sqlite')
+
+# status_text собирался как "Название (Город) - Причина"
+STATUS_TEXT_RE = re.compile(r'^(?P<name>.*?)(?: \((?P<city>[^()]*)\))?(?: - (?P<reason>.*))?$', re.S)
+
+
+def _parse_status_text(status_text: str) -> Tuple[str, Optional[str], Optional[str]]:
+    match = STATUS_TEXT_RE.match(status_text)
+    return match.group('name'), match.group('city'), match.group('reason')
+
+
+# Строк shipment_statuses на один UPDATE при заполнении ссылок
+FILL_BATCH_SIZE = 50000
+
+
+def _get_or_create(bind, table: str, key_column: str, values: Dict[str, str], cache: Dict[str, int]) -> int:
+    key = values[key_column]
+    if key not in cache:
+        row_id = bind.execute(sa.text(f"SELECT id FROM {table} WHERE {key_column} = :key"), {'key': key}).scalar()
+        if row_id is None:
+            columns = ', '.join(values)
+            params = ', '.join(f':{name}' for name in values)
+            row_id = bind.execute(
+                sa.text(f"INSERT INTO {table} ({columns}) VALUES ({params}) RETURNING id"), values
+            ).scalar_one()
+        cache[key] = row_id
+    return cache[key]
+
+
+def _fill_lookups() -> None:
+    bind = op.get_bind()
+    code_ids: Dict[str, int] = {}
+    city_ids: Dict[str, int] = {}
+    reason_ids: Dict[str, int] = {}
+    
+    pairs = bind.execute(sa.text(
+        "SELECT DISTINCT status_code, status_text FROM shipment_statuses ORDER BY status_code, status_text"
+    )).all()
+    
+    mapping = []
+    for status_code, status_text in pairs:
+        name, city, reason = _parse_status_text(status_text)
+        mapping.append({
+            'status_code': status_code,
+            'status_text': status_text,
+            'code_id': _get_or_create(bind, 'status_codes', 'code', {'code': status_code, 'name': name}, code_ids),
+            'city_id': _get_or_create(bind, 'cities', 'name', {'name': city}, city_ids) if city else None,
+            'reason_id': _get_or_create(bind, 'status_reasons', 'text', {'text': reason}, reason_ids) if reason else None
+        })
+    
+    if not mapping:
+        return
+    
+    # Пары раскладываются во временную таблицу, и статусы обновляются одним
+    # UPDATE ... FROM на диапазон id, а не полным проходом таблицы на каждую пару
+    bind.execute(sa.text(
+        "CREATE TEMPORARY TABLE status_lookup_map ("
+        "status_code VARCHAR(50) NOT NULL, status_text TEXT NOT NULL, "
+        "code_id INTEGER NOT NULL, city_id INTEGER, reason_id INTEGER, "
+        "PRIMARY KEY (status_code, status_text))"
+    ))
+    bind.execute(
+        sa.text(
+            "INSERT INTO status_lookup_map (status_code, status_text, code_id, city_id, reason_id) "
+            "VALUES (:status_code, :status_text, :code_id, :city_id, :reason_id)"
+        ),
+        mapping
+    )
+    
+    min_id, max_id = bind.execute(sa.text("SELECT MIN(id), MAX(id) FROM shipment_statuses")).one()
+    for batch_start in range(min_id, max_id + 1, FILL_BATCH_SIZE):
+        bind.execute(
+            sa.text(
+                "UPDATE shipment_statuses SET "
+                "status_code_id = status_lookup_map.code_id, "
+                "city_id = status_lookup_map.city_id, "
+                "reason_id = status_lookup_map.reason_id "
+                "FROM status_lookup_map "
+                "WHERE shipment_statuses.status_code = status_lookup_map.status_code "
+                "AND shipment_statuses.status_text = status_lookup_map.status_text "
+                "AND shipment_statuses.id >= :start AND shipment_statuses.id < :end"
+            ),
+            {'start': batch_start, 'end': batch_start + FILL_BATCH_SIZE}
+        )
+    
+    bind.execute(sa.text("DROP TABLE status_lookup_map"))
+
+
+def upgrade() -> None:
+    op.create_table('status_codes',
+    sa.Column('id', SmallId, nullable=False),
+    sa.Column('code', sa.String(length=50), nullable=False),
+    sa.Column('name', sa.Text(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('code')
+    )
+    op.create_table('cities',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=255), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    op.create_table('status_reasons',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('code', sa.String(length=50), nullable=True),
+    sa.Column('text', sa.Text(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('text')
+    )
+    
+    op.add_column('shipment_statuses', sa.Column('status_code_id', SmallId, nullable=True))
+    op.add_column('shipment_statuses', sa.Column('city_id', sa.Integer(), nullable=True))
+    op.add_column('shipment_statuses', sa.Column('reason_id', sa.Integer(), nullable=True))
+    
+    _fill_lookups()
+    
+    op.drop_index('ix_shipment_statuses_shipment_id_status_datetime', table_name='shipment_statuses')
+    op.drop_index('uq_shipment_statuses_dedupe', table_name='shipment_statuses')
+    
+    with op.batch_alter_table('shipment_statuses') as batch_op:
+        batch_op.alter_column('status_code_id', existing_type=SmallId, nullable=False)
+        batch_op.create_foreign_key('fk_shipment_statuses_status_code_id', 'status_codes', ['status_code_id'], ['id'])
+        batch_op.create_foreign_key('fk_shipment_statuses_city_id', 'cities', ['city_id'], ['id'])
+        batch_op.create_foreign_key('fk_shipment_statuses_reason_id', 'status_reasons', ['reason_id'], ['id'])
+        batch_op.drop_column('status_text')
+        batch_op.drop_column('status_code')
+    
+    op.create_index(
+        'uq_shipment_statuses_dedupe',
+        'shipment_statuses',
+        ['shipment_id', 'status_code_id', 'status_datetime'],
+        unique=True
+    )
+    op.create_index(
+        'ix_shipment_statuses_shipment_id_status_datetime',
+        'shipment_statuses',
+        ['shipment_id', sa.text('status_datetime DESC')],
+        unique=False,
+        postgresql_include=['status_code_id']
+    )
+
+
+def downgrade() -> None:
+    op.add_column('shipment_statuses', sa.Column('status_code', sa.String(length=50), nullable=True))
+    op.add_column('shipment_statuses', sa.Column('status_text', sa.Text(), nullable=True))
+    
+    op.execute("""
+        UPDATE shipment_statuses SET
+            status_code = (SELECT code FROM status_codes WHERE status_codes.id = shipment_statuses.status_code_id),
+            status_text = (SELECT name FROM status_codes WHERE status_codes.id = shipment_statuses.status_code_id)
+                || COALESCE(' (' || (SELECT name FROM cities WHERE cities.id = shipment_statuses.city_id) || ')', '')
+                || COALESCE(' - ' || (SELECT text FROM status_reasons WHERE status_reasons.id = shipment_statuses.reason_id), '')
+    """)
+    
+    op.drop_index('ix_shipment_statuses_shipment_id_status_datetime', table_name='shipment_statuses')
+    op.drop_index('uq_shipment_statuses_dedupe', table_name='shipment_statuses')
+    
+    with op.batch_alter_table('shipment_statuses') as batch_op:
+        batch_op.alter_column('status_code', existing_type=sa.String(length=50), nullable=False)
+        batch_op.alter_column('status_text', existing_type=sa.Text(), nullable=False)
+        batch_op.drop_constraint('fk_shipment_statuses_reason_id', type_='foreignkey')
+        batch_op.drop_constraint('fk_shipment_statuses_city_id', type_='foreignkey')
+        batch_op.drop_constraint('fk_shipment_statuses_status_code_id', type_='foreignkey')
+        batch_op.drop_column('reason_id')
+        batch_op.drop_column('city_id')
+        batch_op.drop_column('status_code_id')
+    
+    op.create_index(
+        'uq_shipment_statuses_dedupe',
+        'shipment_statuses',
+        ['shipment_id', 'status_code', 'status_datetime'],
+        unique=True
+    )
+    op.create_index(
+        'ix_shipment_statuses_shipment_id_status_datetime',
+        'shipment_statuses',
+        ['shipment_id', sa.text('status_datetime DESC')],
+        unique=False,
+        postgresql_include=['status_code']
+    )
+    
+    op.drop_table('status_reasons')
+    op.drop_table('cities')
+    op.drop_table('status_codes')
@@ -0,0 +1,165 @@
+"""Partition shipment_statuses by status_datetime, archive tables
+
+Revision ID: 8a41d0c5e9b3
+Revises: 3f9c1b7d2a64
+Create Date: 2026-01-20 16:47:05.203911
+
+"""
+from datetime import date, datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '8a41d0c5e9b3'
+down_revision: Union[str, None] = '3f9c1b7d2a64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Сколько месяцев вперед создавать партиции при миграции
+PARTITION_MONTHS_AHEAD = 3
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_statuses() -> None:
+    bind = op.get_bind()
+    
+    op.execute("ALTER TABLE shipment_statuses RENAME TO shipment_statuses_old")
+    op.execute("ALTER TABLE shipment_statuses_old RENAME CONSTRAINT shipment_statuses_pkey TO shipment_statuses_old_pkey")
+    op.execute("DROP INDEX uq_shipment_statuses_dedupe")
+    op.execute("DROP INDEX ix_shipment_statuses_shipment_id_status_datetime")
+    # Последовательность id переносится на новую таблицу, иначе удалится вместе со старой
+    op.execute("ALTER SEQUENCE shipment_statuses_id_seq OWNED BY NONE")
+    
+    op.execute("""
+        CREATE TABLE shipment_statuses (
+            id INTEGER NOT NULL DEFAULT nextval('shipment_statuses_id_seq'),
+            shipment_id INTEGER NOT NULL REFERENCES shipments (id),
+            status_code VARCHAR(50) NOT NULL,
+            status_text TEXT NOT NULL,
+            status_datetime TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            CONSTRAINT shipment_statuses_pkey PRIMARY KEY (id, status_datetime)
+        ) PARTITION BY RANGE (status_datetime)
+    """)
+    
+    oldest = bind.execute(sa.text("SELECT MIN(status_datetime) FROM shipment_statuses_old")).scalar()
+    current_month = datetime.utcnow().date().replace(day=1)
+    month = oldest.date().replace(day=1) if oldest else current_month
+    last_month = _add_months(current_month, PARTITION_MONTHS_AHEAD)
+    
+    while month <= last_month:
+        next_month = _add_months(month, 1)
+        op.execute(
+            f"CREATE TABLE shipment_statuses_{month:%Y_%m} PARTITION OF shipment_statuses "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+        )
+        month = next_month
+    
+    op.execute("CREATE TABLE shipment_statuses_default PARTITION OF shipment_statuses DEFAULT")
+    
+    op.create_index(
+        'uq_shipment_statuses_dedupe',
+        'shipment_statuses',
+        ['shipment_id', 'status_code', 'status_datetime'],
+        unique=True
+    )
+    op.create_index(
+        'ix_shipment_statuses_shipment_id_status_datetime',
+        'shipment_statuses',
+        ['shipment_id', sa.text('status_datetime DESC')],
+        unique=False,
+        postgresql_include=['status_code']
+    )
+    
+    op.execute("""
+        INSERT INTO shipment_statuses (id, shipment_id, status_code, status_text, status_datetime, created_at)
+        SELECT id, shipment_id, status_code, status_text, status_datetime, created_at
+        FROM shipment_statuses_old
+    """)
+    op.execute("DROP TABLE shipment_statuses_old")
+    op.execute("ALTER SEQUENCE shipment_statuses_id_seq OWNED BY shipment_statuses.id")
+
+
+def _unpartition_statuses() -> None:
+    op.execute("ALTER TABLE shipment_statuses RENAME TO shipment_statuses_partitioned")
+    op.execute("ALTER TABLE shipment_statuses_partitioned RENAME CONSTRAINT shipment_statuses_pkey TO shipment_statuses_partitioned_pkey")
+    op.execute("DROP INDEX uq_shipment_statuses_dedupe")
+    op.execute("DROP INDEX ix_shipment_statuses_shipment_id_status_datetime")
+    op.execute("ALTER SEQUENCE shipment_statuses_id_seq OWNED BY NONE")
+    
+    op.execute("""
+        CREATE TABLE shipment_statuses (
+            id INTEGER NOT NULL DEFAULT nextval('shipment_statuses_id_seq'),
+            shipment_id INTEGER NOT NULL REFERENCES shipments (id),
+            status_code VARCHAR(50) NOT NULL,
+            status_text TEXT NOT NULL,
+            status_datetime TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            CONSTRAINT shipment_statuses_pkey PRIMARY KEY (id)
+        )
+    """)
+    op.execute("""
+        INSERT INTO shipment_statuses (id, shipment_id, status_code, status_text, status_datetime, created_at)
+        SELECT id, shipment_id, status_code, status_text, status_datetime, created_at
+        FROM shipment_statuses_partitioned
+    """)
+    op.execute("DROP TABLE shipment_statuses_partitioned CASCADE")
+    op.execute("ALTER SEQUENCE shipment_statuses_id_seq OWNED BY shipment_statuses.id")
+    
+    op.create_index(
+        'uq_shipment_statuses_dedupe',
+        'shipment_statuses',
+        ['shipment_id', 'status_code', 'status_datetime'],
+        unique=True
+    )
+    op.create_index(
+        'ix_shipment_statuses_shipment_id_status_datetime',
+        'shipment_statuses',
+        ['shipment_id', sa.text('status_datetime DESC')],
+        unique=False,
+        postgresql_include=['status_code']
+    )
+
+
+def upgrade() -> None:
+    # Секционирование доступно только в PostgreSQL, на других СУБД таблица остается обычной
+    if op.get_bind().dialect.name == 'postgresql':
+        _partition_statuses()
+    
+    op.create_table('shipments_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tracking_code', sa.String(length=100), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('delivered_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_shipments_archive_tracking_code', 'shipments_archive', ['tracking_code'], unique=False)
+    op.create_table('shipment_statuses_archive',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('shipment_id', sa.Integer(), nullable=False),
+    sa.Column('status_code', sa.String(length=50), nullable=False),
+    sa.Column('status_text', sa.Text(), nullable=False),
+    sa.Column('status_datetime', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['shipment_id'], ['shipments_archive.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_shipment_statuses_archive_shipment_id', 'shipment_statuses_archive', ['shipment_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_shipment_statuses_archive_shipment_id', table_name='shipment_statuses_archive')
+    op.drop_table('shipment_statuses_archive')
+    op.drop_index('ix_shipments_archive_tracking_code', table_name='shipments_archive')
+    op.drop_table('shipments_archive')
+    
+    if op.get_bind().dialect.name == 'postgresql':
+        _unpartition_statuses()
@@ -0,0 +1,57 @@
+"""Outbox for status change notifications
+
+Revision ID: 8c3f6d1a9e27
+Revises: 5e9d2b7c4a18
+Create Date: 2026-03-23 11:52:40.618925
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '8c3f6d1a9e27'
+down_revision: Union[str, None] = '5e9d2b7c4a18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('outbox_events',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('shipment_id', sa.Integer(), nullable=False),
+    sa.Column('event_type', sa.String(length=50), nullable=False),
+    sa.Column('payload', sa.LargeBinary(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('outbox_deliveries',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.Integer(), nullable=False),
+    sa.Column('destination', sa.String(length=50), nullable=False),
+    sa.Column('shipment_id', sa.Integer(), nullable=False),
+    sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('last_error', sa.String(length=30), nullable=True),
+    sa.Column('delivered_at', sa.DateTime(), nullable=True),
+    sa.Column('failed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['event_id'], ['outbox_events.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_outbox_deliveries_event_id'), 'outbox_deliveries', ['event_id'], unique=False)
+    op.create_index(
+        'ix_outbox_deliveries_pending',
+        'outbox_deliveries',
+        ['destination', 'id'],
+        unique=False,
+        postgresql_where=sa.text('delivered_at IS NULL AND failed_at IS NULL'),
+        sqlite_where=sa.text('delivered_at IS NULL AND failed_at IS NULL')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_outbox_deliveries_pending', table_name='outbox_deliveries')
+    op.drop_index(op.f('ix_outbox_deliveries_event_id'), table_name='outbox_deliveries')
+    op.drop_table('outbox_deliveries')
+    op.drop_table('outbox_events')
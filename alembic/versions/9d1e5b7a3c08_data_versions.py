@@ -0,0 +1,34 @@
+"""Data version counter for ETags
+
+Revision ID: 9d1e5b7a3c08
+Revises: 2c6f8e1a9d43
+Create Date: 2026-03-10 09:48:27.912655
+
+"""
+from datetime import datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = '9d1e5b7a3c08'
+down_revision: Union[str, None] = '2c6f8e1a9d43'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    data_versions = op.create_table('data_versions',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(data_versions, [
+        {'name': 'shipments', 'version': 1, 'updated_at': datetime.utcnow()}
+    ])
+
+
+def downgrade() -> None:
+    op.drop_table('data_versions')
@@ -0,0 +1,53 @@
+"""Prefix and trigram indexes for tracking code search
+
+Revision ID: b3e8d1f5a7c2
+Revises: 4f7a2d9e6b15
+Create Date: 2026-03-13 15:22:09.504183
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'b3e8d1f5a7c2'
+down_revision: Union[str, None] = '4f7a2d9e6b15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Индексы нужны только PostgreSQL; в других СУБД поиск идет по индексу в памяти
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    
+    # CONCURRENTLY не блокирует запись в shipments, но выполняется вне транзакции
+    with op.get_context().autocommit_block():
+        op.create_index(
+            'ix_shipments_tracking_code_pattern',
+            'shipments',
+            ['tracking_code'],
+            unique=False,
+            postgresql_ops={'tracking_code': 'text_pattern_ops'},
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            'ix_shipments_tracking_code_trgm',
+            'shipments',
+            ['tracking_code'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={'tracking_code': 'gin_trgm_ops'},
+            postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    
+    op.drop_index('ix_shipments_tracking_code_trgm', table_name='shipments')
+    op.drop_index('ix_shipments_tracking_code_pattern', table_name='shipments')
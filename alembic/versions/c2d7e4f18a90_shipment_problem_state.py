@@ -0,0 +1,79 @@
+"""Stored shipment state and problem flag
+
+Revision ID: c2d7e4f18a90
+Revises: 8a41d0c5e9b3
+Create Date: 2026-02-03 10:15:42.771093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'c2d7e4f18a90'
+down_revision: Union[str, None] = '8a41d0c5e9b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Коды доставки на момент миграции; флаги проблемных отправлений
+# выставит периодическая проверка при первом запуске приложения
+DELIVERED_STATUS_CODES = ('DELIVERED', 'RECEIVED_AT_DELIVERY_OFFICE')
+
+
+def upgrade() -> None:
+    op.add_column('shipments', sa.Column('first_status_at', sa.DateTime(), nullable=True))
+    op.add_column('shipments', sa.Column('last_status_at', sa.DateTime(), nullable=True))
+    op.add_column('shipments', sa.Column('is_delivered', sa.Boolean(), server_default=sa.false(), nullable=False))
+    op.add_column('shipments', sa.Column('is_problematic', sa.Boolean(), server_default=sa.false(), nullable=False))
+    op.add_column('shipments', sa.Column('problem_since', sa.DateTime(), nullable=True))
+    
+    op.execute("""
+        UPDATE shipments SET
+            first_status_at = (
+                SELECT MIN(s.status_datetime) FROM shipment_statuses s WHERE s.shipment_id = shipments.id
+            ),
+            last_status_at = (
+                SELECT MAX(s.status_datetime) FROM shipment_statuses s WHERE s.shipment_id = shipments.id
+            )
+    """)
+    op.get_bind().execute(
+        sa.text("""
+            UPDATE shipments SET is_delivered = :delivered
+            WHERE (
+                SELECT s.status_code FROM shipment_statuses s
+                WHERE s.shipment_id = shipments.id
+                ORDER BY s.status_datetime DESC
+                LIMIT 1
+            ) IN :codes
+        """).bindparams(sa.bindparam('codes', expanding=True)),
+        {'delivered': True, 'codes': list(DELIVERED_STATUS_CODES)}
+    )
+    
+    op.create_index(
+        'ix_shipments_problem_sweep',
+        'shipments',
+        ['first_status_at'],
+        unique=False,
+        postgresql_where=sa.text('is_delivered = false AND is_problematic = false'),
+        sqlite_where=sa.text('is_delivered = 0 AND is_problematic = 0')
+    )
+    op.create_index(
+        'ix_shipments_problem_since',
+        'shipments',
+        ['problem_since'],
+        unique=False,
+        postgresql_where=sa.text('is_problematic = true'),
+        sqlite_where=sa.text('is_problematic = 1')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_shipments_problem_since', table_name='shipments')
+    op.drop_index('ix_shipments_problem_sweep', table_name='shipments')
+    op.drop_column('shipments', 'problem_since')
+    op.drop_column('shipments', 'is_problematic')
+    op.drop_column('shipments', 'is_delivered')
+    op.drop_column('shipments', 'last_status_at')
+    op.drop_column('shipments', 'first_status_at')
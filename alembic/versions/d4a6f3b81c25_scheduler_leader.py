@@ -0,0 +1,33 @@
+"""Scheduler leader heartbeat table
+
+Revision ID: d4a6f3b81c25
+Revises: 5b8e2c9f4d17
+Create Date: 2026-02-18 14:06:51.330278
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = 'd4a6f3b81c25'
+down_revision: Union[str, None] = '5b8e2c9f4d17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('scheduler_leader',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('holder_id', sa.String(length=100), nullable=False),
+    sa.Column('hostname', sa.String(length=255), nullable=False),
+    sa.Column('pid', sa.Integer(), nullable=False),
+    sa.Column('elected_at', sa.DateTime(), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('scheduler_leader')
@@ -0,0 +1,375 @@
+"""
+Аналитика сроков доставки
+
+Факты по каждому отправлению (время в пути, длительность этапов)
+обновляются при загрузке статусов в той же транзакции. Перцентили по
+маршрутам, городам и этапам и дневные счетчики пересчитываются
+периодически (задача лидера планировщика или python -m app.analytics)
+в таблицы transit_percentiles и daily_shipment_counts, откуда их читают
+эндпоинты /api/analytics/*.
+
+В PostgreSQL перцентили считает percentile_cont, в остальных СУБД -
+NumPy по выгрузке фактов.
+"""
+import argparse
+import logging
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from sqlalchemy import select, insert, update, delete, func, and_, false, true
+from sqlalchemy.orm import Session
+from app.cache import cache
+from app.config import settings
+from app.lookups import lookups
+from app import replica, services
+from app.models import (
+    Shipment,
+    ShipmentStatus,
+    ShipmentTransitFact,
+    StatusStageFact,
+    TransitPercentile,
+    DailyShipmentCount
+)
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = (0.5, 0.9, 0.99)
+
+# Версия пересчитанных перцентилей в data_versions: кэш эндпоинтов аналитики
+# привязан к ней и не зависит от загрузки статусов
+ANALYTICS_DATA_VERSION = "analytics"
+
+
+def refresh_shipment_facts(db: Session, shipment: Shipment) -> None:
+    """
+    Пересчитать факты отправления по его статусам. Вызывается после
+    refresh_shipment_state, до commit.
+    """
+    statuses = db.execute(
+        select(ShipmentStatus.status_code_id, ShipmentStatus.city_id, ShipmentStatus.status_datetime)
+        .where(ShipmentStatus.shipment_id == shipment.id)
+        .order_by(ShipmentStatus.status_datetime)
+    ).all()
+    
+    db.execute(delete(StatusStageFact).where(StatusStageFact.shipment_id == shipment.id))
+    db.execute(delete(ShipmentTransitFact).where(ShipmentTransitFact.shipment_id == shipment.id))
+    
+    if not statuses:
+        return
+    
+    stages = [
+        {
+            "shipment_id": shipment.id,
+            "status_code_id": current.status_code_id,
+            "started_at": current.status_datetime,
+            "duration_seconds": (following.status_datetime - current.status_datetime).total_seconds()
+        }
+        for current, following in zip(statuses, statuses[1:])
+    ]
+    if stages:
+        db.execute(insert(StatusStageFact), stages)
+    
+    if shipment.is_delivered:
+        cities = [status.city_id for status in statuses if status.city_id is not None]
+        first_status_at = statuses[0].status_datetime
+        delivered_at = statuses[-1].status_datetime
+        
+        db.execute(insert(ShipmentTransitFact).values(
+            shipment_id=shipment.id,
+            origin_city_id=cities[0] if cities else None,
+            destination_city_id=cities[-1] if cities else None,
+            first_status_at=first_status_at,
+            delivered_at=delivered_at,
+            transit_seconds=(delivered_at - first_status_at).total_seconds()
+        ))
+
+
+def grouped_percentiles(
+    keys: np.ndarray,
+    values: np.ndarray,
+    percentiles: Sequence[float] = PERCENTILES
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Перцентили values по группам keys (матрица n x k) без цикла по группам.
+    Интерполяция линейная, как у percentile_cont. Возвращает
+    (ключи групп, размеры групп, матрицу перцентилей групп x percentiles).
+    """
+    if len(values) == 0:
+        return keys[:0], np.zeros(0, dtype=np.int64), np.zeros((0, len(percentiles)))
+    
+    # Сортировка по ключам группы, внутри группы - по значению
+    order = np.lexsort((values,) + tuple(keys.T[::-1]))
+    keys = keys[order]
+    values = values[order]
+    
+    is_start = np.ones(len(values), dtype=bool)
+    is_start[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+    starts = np.flatnonzero(is_start)
+    counts = np.diff(np.append(starts, len(values)))
+    
+    result = np.empty((len(starts), len(percentiles)))
+    for column, q in enumerate(percentiles):
+        position = starts + q * (counts - 1)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.minimum(lower + 1, starts + counts - 1)
+        fraction = position - lower
+        result[:, column] = values[lower] + (values[upper] - values[lower]) * fraction
+    
+    return keys[starts], counts, result
+
+
+def _percentiles_sql(db: Session, group_columns: List, value_column) -> List[Tuple]:
+    stmt = (
+        select(
+            *group_columns,
+            func.count(),
+            *[func.percentile_cont(q).within_group(value_column) for q in PERCENTILES]
+        )
+        .group_by(*group_columns)
+    )
+    return [tuple(row) for row in db.execute(stmt)]
+
+
+def _percentiles_numpy(db: Session, group_columns: List, value_column) -> List[Tuple]:
+    rows = db.execute(select(*group_columns, value_column)).all()
+    if not rows:
+        return []
+    
+    data = np.array(
+        [[-1 if value is None else value for value in row] for row in rows],
+        dtype=np.float64
+    )
+    keys = data[:, :-1].astype(np.int64)
+    group_keys, counts, values = grouped_percentiles(keys, data[:, -1])
+    
+    return [
+        (*[None if key == -1 else int(key) for key in group_key], int(count), *map(float, percentiles))
+        for group_key, count, percentiles in zip(group_keys, counts, values)
+    ]
+
+
+def compute_percentiles(db: Session, group_columns: List, value_column) -> List[Tuple]:
+    """Строки (ключи группы..., число, p50, p90, p99)"""
+    if db.get_bind().dialect.name == "postgresql":
+        return _percentiles_sql(db, group_columns, value_column)
+    return _percentiles_numpy(db, group_columns, value_column)
+
+
+def refresh_percentiles(db: Session) -> Dict[str, int]:
+    now = datetime.utcnow()
+    dimensions = {
+        "route": (
+            ["origin_city_id", "city_id"],
+            [ShipmentTransitFact.origin_city_id, ShipmentTransitFact.destination_city_id],
+            ShipmentTransitFact.transit_seconds
+        ),
+        "city": (
+            ["city_id"],
+            [ShipmentTransitFact.destination_city_id],
+            ShipmentTransitFact.transit_seconds
+        ),
+        "stage": (
+            ["status_code_id"],
+            [StatusStageFact.status_code_id],
+            StatusStageFact.duration_seconds
+        ),
+    }
+    
+    counts = {}
+    for dimension, (key_names, group_columns, value_column) in dimensions.items():
+        rows = compute_percentiles(db, group_columns, value_column)
+        
+        db.execute(delete(TransitPercentile).where(TransitPercentile.dimension == dimension))
+        if rows:
+            db.execute(insert(TransitPercentile), [
+                {
+                    "dimension": dimension,
+                    **dict(zip(key_names, row[:len(key_names)])),
+                    "shipments": row[len(key_names)],
+                    "p50_seconds": row[-3],
+                    "p90_seconds": row[-2],
+                    "p99_seconds": row[-1],
+                    "computed_at": now
+                }
+                for row in rows
+            ])
+        counts[dimension] = len(rows)
+    
+    return counts
+
+
+def refresh_daily_counts(db: Session, day: Optional[date] = None) -> None:
+    """
+    Счетчики за день: сколько отправлений в пути и проблемных на момент
+    пересчета и сколько доставлено за этот день
+    """
+    day = day or datetime.utcnow().date()
+    day_start = datetime.combine(day, datetime.min.time())
+    
+    in_transit, problematic = db.execute(
+        select(
+            func.count().filter(and_(Shipment.first_status_at.is_not(None), Shipment.is_delivered == false())),
+            func.count().filter(Shipment.is_problematic == true())
+        )
+    ).one()
+    delivered = db.scalar(
+        select(func.count()).where(
+            ShipmentTransitFact.delivered_at >= day_start,
+            ShipmentTransitFact.delivered_at < day_start + timedelta(days=1)
+        )
+    )
+    
+    values = {
+        "in_transit": in_transit,
+        "delivered": delivered,
+        "problematic": problematic,
+        "updated_at": datetime.utcnow()
+    }
+    updated = db.execute(
+        update(DailyShipmentCount).where(DailyShipmentCount.day == day).values(**values)
+    ).rowcount
+    if not updated:
+        db.execute(insert(DailyShipmentCount).values(day=day, **values))
+
+
+def refresh_analytics(db: Session) -> Dict[str, int]:
+    counts = refresh_percentiles(db)
+    refresh_daily_counts(db)
+    services.bump_data_version(db, ANALYTICS_DATA_VERSION)
+    db.commit()
+    return counts
+
+
+def rebuild_facts(db: Session, batch_size: int = 500) -> int:
+    """Заполнить факты для всех отправлений, например после миграции"""
+    last_id = 0
+    rebuilt = 0
+    
+    while True:
+        shipments = db.scalars(
+            select(Shipment).where(Shipment.id > last_id).order_by(Shipment.id).limit(batch_size)
+        ).all()
+        if not shipments:
+            break
+        
+        for shipment in shipments:
+            refresh_shipment_facts(db, shipment)
+        db.commit()
+        
+        last_id = shipments[-1].id
+        rebuilt += len(shipments)
+        logger.info(f"   Факты пересчитаны: {rebuilt}")
+    
+    return rebuilt
+
+
+def _hours(seconds: float) -> float:
+    return round(seconds / 3600, 2)
+
+
+def _percentile_data(row: TransitPercentile) -> Dict[str, Any]:
+    return {
+        "shipments": row.shipments,
+        "p50_hours": _hours(row.p50_seconds),
+        "p90_hours": _hours(row.p90_seconds),
+        "p99_hours": _hours(row.p99_seconds)
+    }
+
+
+def _load_percentiles(db: Session, dimension: str) -> List[TransitPercentile]:
+    return db.scalars(
+        select(TransitPercentile)
+        .where(TransitPercentile.dimension == dimension)
+        .order_by(TransitPercentile.shipments.desc())
+    ).all()
+
+
+def get_route_percentiles(db: Session) -> List[Dict[str, Any]]:
+    def compute():
+        return [
+            {
+                "origin_city": lookups.city_name(db, row.origin_city_id),
+                "destination_city": lookups.city_name(db, row.city_id),
+                **_percentile_data(row)
+            }
+            for row in _load_percentiles(db, "route")
+        ]
+    return cache.get_or_set(
+        "analytics:routes",
+        compute,
+        services.get_data_version(db, ANALYTICS_DATA_VERSION),
+        store=lambda: replica.cacheable(db)
+    )
+
+
+def get_city_percentiles(db: Session) -> List[Dict[str, Any]]:
+    def compute():
+        return [
+            {"city": lookups.city_name(db, row.city_id), **_percentile_data(row)}
+            for row in _load_percentiles(db, "city")
+        ]
+    return cache.get_or_set(
+        "analytics:cities",
+        compute,
+        services.get_data_version(db, ANALYTICS_DATA_VERSION),
+        store=lambda: replica.cacheable(db)
+    )
+
+
+def get_stage_percentiles(db: Session) -> List[Dict[str, Any]]:
+    def compute():
+        return [
+            {
+                "status_code": lookups.code(db, row.status_code_id),
+                "status_name": lookups.status_name(db, row.status_code_id),
+                **_percentile_data(row)
+            }
+            for row in _load_percentiles(db, "stage")
+        ]
+    return cache.get_or_set(
+        "analytics:stages",
+        compute,
+        services.get_data_version(db, ANALYTICS_DATA_VERSION),
+        store=lambda: replica.cacheable(db)
+    )
+
+
+def get_daily_counts(db: Session, days: int = 30) -> List[Dict[str, Any]]:
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = db.scalars(
+        select(DailyShipmentCount).where(DailyShipmentCount.day >= since).order_by(DailyShipmentCount.day)
+    ).all()
+    
+    return [
+        {
+            "day": row.day.isoformat(),
+            "in_transit": row.in_transit,
+            "delivered": row.delivered,
+            "problematic": row.problematic
+        }
+        for row in rows
+    ]
+
+
+def main():
+    from app.database import SessionLocal
+    from app.logging_config import setup_logging
+    
+    parser = argparse.ArgumentParser(description="Пересчет аналитики сроков доставки")
+    parser.add_argument("--rebuild-facts", action="store_true", help="Сначала пересчитать факты всех отправлений")
+    args = parser.parse_args()
+    
+    setup_logging(log_level=settings.log_level)
+    
+    db = SessionLocal()
+    try:
+        if args.rebuild_facts:
+            logger.info(f"✅ Факты пересчитаны для {rebuild_facts(db)} отправлений")
+        counts = refresh_analytics(db)
+        logger.info(f"📈 Аналитика пересчитана: {counts}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Обслуживание горячих таблиц: партиции shipment_statuses и архив доставленных отправлений
+
+Партиции на следующие месяцы создает и лидер планировщика (раз в
+partition_maintenance_interval_seconds). Архив - вручную или по расписанию:
+    python -m app.archive --days 30
+"""
+import argparse
+import logging
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Optional
+from sqlalchemy import select, insert, delete, desc, text, literal, true, func, DateTime
+from sqlalchemy.orm import Session
+from app.config import settings
+from app import services
+from app.models import (
+    Shipment,
+    ShipmentStatus,
+    StatusCode,
+    City,
+    StatusReason,
+    ShipmentPoll,
+    RawPayload,
+    ArchivedShipment,
+    ArchivedShipmentStatus
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PARTITION = "shipment_statuses_default"
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _is_partitioned(db: Session) -> bool:
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    
+    return db.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = 'shipment_statuses'::regclass)"
+    )).scalar()
+
+
+def ensure_status_partitions(db: Session, months_ahead: Optional[int] = None) -> List[str]:
+    """Создать недостающие месячные партиции shipment_statuses на months_ahead месяцев вперед"""
+    if not _is_partitioned(db):
+        return []
+    
+    if months_ahead is None:
+        months_ahead = settings.partition_months_ahead
+    
+    current_month = datetime.utcnow().date().replace(day=1)
+    created = []
+    
+    for offset in range(months_ahead + 1):
+        month = _add_months(current_month, offset)
+        name = f"shipment_statuses_{month:%Y_%m}"
+        
+        exists = db.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar()
+        if exists:
+            continue
+        
+        moved = _create_month_partition(db, name, month, _add_months(month, 1))
+        # Каждая партиция - своя транзакция: блокировка таблицы не держится на весь проход
+        db.commit()
+        created.append(name)
+        logger.info(f"🧩 Создана партиция {name}" + (f", перенесено из default: {moved}" if moved else ""))
+    
+    return created
+
+
+def _create_month_partition(db: Session, name: str, month: date, next_month: date) -> int:
+    """
+    Создать партицию месяца. Если строки этого месяца уже попали в DEFAULT
+    (партиции заранее не хватило), CREATE ... PARTITION OF для него падает:
+    DEFAULT отсоединяется, строки месяца переносятся в новую партицию, и DEFAULT
+    присоединяется обратно. Возвращает число перенесенных строк.
+    """
+    bounds = {"start": month, "end": next_month}
+    create = text(
+        f"CREATE TABLE {name} PARTITION OF shipment_statuses "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+    )
+    
+    has_default = db.execute(text(f"SELECT to_regclass('{DEFAULT_PARTITION}') IS NOT NULL")).scalar()
+    if not has_default or not db.execute(
+        text(
+            f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+            "WHERE status_datetime >= :start AND status_datetime < :end)"
+        ),
+        bounds
+    ).scalar():
+        db.execute(create)
+        return 0
+    
+    columns = ", ".join(column.name for column in ShipmentStatus.__table__.columns)
+    db.execute(text(f"ALTER TABLE shipment_statuses DETACH PARTITION {DEFAULT_PARTITION}"))
+    db.execute(create)
+    moved = db.execute(
+        text(
+            f"INSERT INTO shipment_statuses ({columns}) SELECT {columns} FROM {DEFAULT_PARTITION} "
+            "WHERE status_datetime >= :start AND status_datetime < :end"
+        ),
+        bounds
+    ).rowcount
+    db.execute(
+        text(f"DELETE FROM {DEFAULT_PARTITION} WHERE status_datetime >= :start AND status_datetime < :end"),
+        bounds
+    )
+    db.execute(text(f"ALTER TABLE shipment_statuses ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    return moved
+
+
+def _archivable_shipment_ids(db: Session, cutoff: datetime, limit: int) -> List[int]:
+    stmt = (
+        select(Shipment.id)
+        .where(Shipment.is_delivered == true(), Shipment.last_status_at < cutoff)
+        .order_by(Shipment.id)
+        .limit(limit)
+    )
+    return list(db.scalars(stmt))
+
+
+def _status_text_expression():
+    """Текст статуса из справочников, в том же виде, что и format_status_text"""
+    return (
+        StatusCode.name
+        + func.coalesce(" (" + City.name + ")", "")
+        + func.coalesce(" - " + StatusReason.text, "")
+    )
+
+
+def _delete_polls(db: Session, shipment_ids: List[int]) -> None:
+    """Сырые ответы архивных отправлений больше не нужны, если на них не ссылаются другие отправления"""
+    payload_ids = list(db.scalars(
+        select(ShipmentPoll.payload_id).where(ShipmentPoll.shipment_id.in_(shipment_ids)).distinct()
+    ))
+    db.execute(delete(ShipmentPoll).where(ShipmentPoll.shipment_id.in_(shipment_ids)))
+    
+    if payload_ids:
+        still_used = select(ShipmentPoll.payload_id).where(ShipmentPoll.payload_id == RawPayload.id).exists()
+        db.execute(
+            delete(RawPayload)
+            .where(RawPayload.id.in_(payload_ids), ~still_used)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def archive_delivered_shipments(
+    db: Session,
+    older_than_days: Optional[int] = None,
+    batch_size: Optional[int] = None
+) -> int:
+    """
+    Перенести отправления, доставленные более older_than_days дней назад,
+    вместе со статусами в архивные таблицы. Каждая пачка переносится
+    в отдельной транзакции.
+    """
+    if older_than_days is None:
+        older_than_days = settings.archive_after_days
+    if batch_size is None:
+        batch_size = settings.archive_batch_size
+    
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    archived = 0
+    
+    logger.info(f"🗄️ Архивация отправлений, доставленных до {cutoff.isoformat()}")
+    
+    while True:
+        shipment_ids = _archivable_shipment_ids(db, cutoff, batch_size)
+        if not shipment_ids:
+            break
+        
+        db.execute(insert(ArchivedShipment).from_select(
+            ["id", "tracking_code", "created_at", "delivered_at", "archived_at"],
+            select(
+                Shipment.id,
+                Shipment.tracking_code,
+                Shipment.created_at,
+                Shipment.last_status_at,
+                literal(datetime.utcnow(), DateTime)
+            ).where(Shipment.id.in_(shipment_ids))
+        ))
+        db.execute(insert(ArchivedShipmentStatus).from_select(
+            ["id", "shipment_id", "status_code", "status_text", "status_datetime", "created_at"],
+            select(
+                ShipmentStatus.id,
+                ShipmentStatus.shipment_id,
+                StatusCode.code,
+                _status_text_expression(),
+                ShipmentStatus.status_datetime,
+                ShipmentStatus.created_at
+            )
+            .join(StatusCode, StatusCode.id == ShipmentStatus.status_code_id)
+            .outerjoin(City, City.id == ShipmentStatus.city_id)
+            .outerjoin(StatusReason, StatusReason.id == ShipmentStatus.reason_id)
+            .where(ShipmentStatus.shipment_id.in_(shipment_ids))
+        ))
+        db.execute(delete(ShipmentStatus).where(ShipmentStatus.shipment_id.in_(shipment_ids)))
+        _delete_polls(db, shipment_ids)
+        db.execute(delete(Shipment).where(Shipment.id.in_(shipment_ids)))
+        services.bump_data_version(db)
+        db.commit()
+        
+        archived += len(shipment_ids)
+        logger.info(f"   Перенесено в архив: {archived}")
+    
+    logger.info(f"✅ Архивация завершена, перенесено отправлений: {archived}")
+    return archived
+
+
+def get_archived_shipment(db: Session, tracking_code: str) -> Optional[Dict[str, Any]]:
+    shipment = db.query(ArchivedShipment).filter(
+        ArchivedShipment.tracking_code == tracking_code
+    ).order_by(desc(ArchivedShipment.archived_at)).first()
+    
+    if not shipment:
+        return None
+    
+    return {
+        "id": shipment.id,
+        "tracking_code": shipment.tracking_code,
+        "created_at": shipment.created_at.isoformat(),
+        "delivered_at": shipment.delivered_at.isoformat() if shipment.delivered_at else None,
+        "archived_at": shipment.archived_at.isoformat(),
+        "statuses": [
+            {
+                "status_code": status.status_code,
+                "status_text": status.status_text,
+                "status_datetime": status.status_datetime.isoformat()
+            }
+            for status in shipment.statuses
+        ]
+    }
+
+
+def main():
+    from app.database import SessionLocal
+    from app.logging_config import setup_logging
+    
+    parser = argparse.ArgumentParser(description="Архивация доставленных отправлений")
+    parser.add_argument("--days", type=int, default=None, help="Архивировать доставленные более N дней назад")
+    parser.add_argument("--batch-size", type=int, default=None)
+    args = parser.parse_args()
+    
+    setup_logging(log_level=settings.log_level)
+    
+    db = SessionLocal()
+    try:
+        ensure_status_partitions(db)
+        archive_delivered_shipments(db, older_than_days=args.days, batch_size=args.batch_size)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
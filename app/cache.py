@@ -0,0 +1,226 @@
+"""
+Кэш статистики и списка отправлений
+
+Ключи привязаны к версии данных из data_versions, которую каждое изменение
+увеличивает в своей транзакции. Вызывающий код читает версию из БД и
+передает ее в кэш, поэтому после изменения в любом процессе (воркер,
+проход обновления, другой веб-процесс) прежние значения перестают
+находиться, даже если у каждого процесса свой кэш в памяти.
+
+Значения отдельных объектов (карточка отправления) от общей версии не зависят:
+они привязаны к отметке изменения объекта в БД (updated_at), поэтому
+изменение объекта в любом процессе делает закэшированное значение
+ненаходимым. В памяти они хранятся в отдельном LRU (CACHE_MAX_ITEMS).
+"""
+import json
+import logging
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+    
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        ...
+
+
+class NullBackend(CacheBackend):
+    """Кэширование отключено"""
+    
+    def get(self, key: str) -> Optional[Any]:
+        return None
+    
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    """LRU-кэш в памяти процесса с ограничением времени жизни записей"""
+    
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+
+class RedisBackend(CacheBackend):
+    """Общий кэш для нескольких процессов (Redis или совместимый сервер)"""
+    
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Для CACHE_BACKEND=redis установите пакет redis: pip install redis")
+        
+        self._client = redis.Redis.from_url(url)
+    
+    def get(self, key: str) -> Optional[Any]:
+        raw = self._client.get(key)
+        return json.loads(raw) if raw is not None else None
+    
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        self._client.set(key, json.dumps(value, ensure_ascii=False), ex=ttl)
+
+
+class Cache:
+    def __init__(
+        self,
+        backend: Optional[CacheBackend] = None,
+        ttl: Optional[int] = None,
+        prefix: str = "dm"
+    ):
+        # Без явного бэкенда он создается по настройкам при первом обращении
+        self._backend = backend
+        self._item_backend = None
+        self._ttl = ttl
+        self.prefix = prefix
+    
+    @property
+    def backend(self) -> CacheBackend:
+        if self._backend is None:
+            self._backend = create_backend()
+        return self._backend
+    
+    @property
+    def item_backend(self) -> CacheBackend:
+        """Отдельный LRU для карточек объектов; общий кэш (Redis) используется как есть"""
+        if self._item_backend is None:
+            if isinstance(self.backend, MemoryBackend):
+                self._item_backend = MemoryBackend(max_entries=settings.cache_max_items)
+            else:
+                self._item_backend = self.backend
+        return self._item_backend
+    
+    @property
+    def ttl(self) -> int:
+        return self._ttl if self._ttl is not None else settings.cache_ttl_seconds
+    
+    def _key(self, name: str, version: int) -> str:
+        return f"{self.prefix}:{name}:v{version}"
+    
+    def _item_key(self, name: str, stamp: str) -> str:
+        return f"{self.prefix}:item:{name}:{stamp}"
+    
+    def get(self, name: str, version: int) -> Optional[Any]:
+        """Значение для версии данных без вычисления; None, если его нет"""
+        try:
+            return self.backend.get(self._key(name, version))
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка чтения кэша {name}: {e}")
+            return None
+    
+    def get_or_set(
+        self,
+        name: str,
+        factory: Callable[[], Any],
+        version: int,
+        store: Optional[Callable[[], bool]] = None
+    ) -> Any:
+        """
+        version - версия данных, прочитанная из БД до вычисления: значение, вычисленное
+        позже, не старше нее. store - проверка после вычисления, можно ли сохранить
+        значение (например, прочитанное с реплики)
+        """
+        try:
+            key = self._key(name, version)
+            value = self.backend.get(key)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка чтения кэша {name}: {e}")
+            return factory()
+        
+        if value is not None:
+            return value
+        
+        value = factory()
+        
+        try:
+            if store is None or store():
+                self.backend.set(key, value, self.ttl)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка записи в кэш {key}: {e}")
+        
+        return value
+    
+    def get_or_set_item(
+        self,
+        name: str,
+        stamp: str,
+        factory: Callable[[], Any],
+        store: Optional[Callable[[], bool]] = None
+    ) -> Any:
+        """
+        Значение отдельного объекта: переживает смену версии данных. stamp - отметка
+        изменения объекта, прочитанная до вычисления: значение, вычисленное позже,
+        не старше нее
+        """
+        try:
+            key = self._item_key(name, stamp)
+            value = self.item_backend.get(key)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка чтения кэша {name}: {e}")
+            return factory()
+        
+        if value is not None:
+            return value
+        
+        value = factory()
+        
+        try:
+            if value is not None and (store is None or store()):
+                self.item_backend.set(key, value, self.ttl)
+        except Exception as e:
+            logger.warning(f"⚠️ Ошибка записи в кэш {key}: {e}")
+        
+        return value
+
+
+def create_backend() -> CacheBackend:
+    backend_name = settings.cache_backend.lower()
+    
+    if backend_name == "redis":
+        if not settings.redis_url:
+            raise RuntimeError("Для CACHE_BACKEND=redis необходимо указать REDIS_URL")
+        backend = RedisBackend(settings.redis_url)
+    elif backend_name == "memory":
+        backend = MemoryBackend(max_entries=settings.cache_max_entries)
+    elif backend_name == "none":
+        backend = NullBackend()
+    else:
+        raise RuntimeError(f"Неизвестный CACHE_BACKEND: {settings.cache_backend}")
+    
+    logger.info(f"Кэш: {backend_name}, TTL={settings.cache_ttl_seconds}s")
+    return backend
+
+
+cache = Cache()
@@ -1,31 +1,130 @@
+import asyncio
 import httpx
 import logging
 import json
+import msgspec
+import orjson
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, List
-from app.config import settings
+from typing import Dict, Optional, List
+from app.config import settings, CDEKAccountSettings
+from app.cdek_schema import CDEKOrder, StatusEvent, decode_order
 
 logger = logging.getLogger(__name__)
 
+# Аккаунт из CDEK_CLIENT_ID / CDEK_CLIENT_SECRET
+DEFAULT_ACCOUNT = "default"
 
-class CDEKClient:
-    def __init__(self):
-        self.base_url = settings.cdek_api_url
-        self.client_id = settings.cdek_client_id
-        self.client_secret = settings.cdek_client_secret
+
+class CDEKError(Exception):
+    """Ошибка запроса к СДЭК. permanent - повтор запроса не поможет"""
+    category = "error"
+    permanent = False
+
+
+class CDEKOrderNotFound(CDEKError):
+    category = "not_found"
+    permanent = True
+
+
+class CDEKOrderForbidden(CDEKError):
+    """v2_entity_forbidden: заказ другого аккаунта или другой среды API"""
+    category = "forbidden"
+    permanent = True
+
+
+class CDEKInvalidTrackingCode(CDEKError):
+    """Прочие ответы 400: например, неверный формат номера"""
+    category = "invalid"
+    permanent = True
+
+
+def error_category(error: Exception) -> str:
+    """Категория ошибки опроса для shipments.last_error"""
+    if isinstance(error, CDEKError):
+        return error.category
+    if isinstance(error, httpx.HTTPStatusError):
+        status_code = error.response.status_code
+        if status_code == 429:
+            return "rate_limited"
+        if status_code in (401, 403):
+            return "auth"
+        if status_code >= 500:
+            return "server_error"
+        return f"http_{status_code}"
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.TransportError):
+        return "network"
+    return "error"
+
+
+def is_permanent_error(error: Exception) -> bool:
+    return isinstance(error, CDEKError) and error.permanent
+
+
+class RateLimiter:
+    """
+    Не больше rate запросов в секунду с запасом burst (token bucket).
+    Ограничивает запросы одного процесса.
+    """
+    
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst or max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+    
+    def wait_time(self) -> float:
+        """Через сколько секунд освободится место для следующего запроса"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+    
+    def load(self) -> float:
+        """Доля занятого запаса: 0 - лимит не расходовался, больше 1 - запросы ждут в очереди"""
+        self._refill()
+        return 1 - self._tokens / self.capacity
+    
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        self._refill()
+        # Место занимается сразу, а ожидающие запросы встают в очередь за уже занятыми
+        self._tokens -= 1
+        if self._tokens < 0:
+            await asyncio.sleep(-self._tokens / self.rate)
+
+
+class CDEKAccount:
+    """Учетные данные одного договора СДЭК со своим токеном и лимитом запросов"""
+    
+    def __init__(self, name: str, client_id: str, client_secret: str, rate_limit_per_second: float):
+        self.name = name
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.limiter = RateLimiter(rate_limit_per_second)
         self._token: Optional[str] = None
         self._token_expires_at: Optional[datetime] = None
     
-    async def _get_token(self) -> str:
+    async def get_token(self, base_url: str) -> str:
         if self._token and self._token_expires_at and datetime.utcnow() < self._token_expires_at:
-            logger.debug("Используется кэшированный токен")
+            logger.debug(f"Используется кэшированный токен аккаунта {self.name}")
             return self._token
         
-        logger.info("Запрос нового токена авторизации")
+        logger.info(f"Запрос нового токена авторизации для аккаунта {self.name}")
         
         try:
             async with httpx.AsyncClient() as client:
-                url = f"{self.base_url}/oauth/token"
+                url = f"{base_url}/oauth/token"
                 params = {
                     "grant_type": "client_credentials",
                     "client_id": self.client_id,
@@ -47,9 +146,9 @@ class CDEKClient:
                 logger.debug(f"Статус ответа: {response.status_code}")
                 
                 response.raise_for_status()
-                data = response.json()
+                data = orjson.loads(response.content)
                 
-                logger.info(f"✅ Токен получен успешно, expires_in: {data.get('expires_in')}s")
+                logger.info(f"✅ Токен аккаунта {self.name} получен успешно, expires_in: {data.get('expires_in')}s")
                 logger.debug(f"Ответ API: {json.dumps(data, indent=2, ensure_ascii=False)}")
                 
                 self._token = data["access_token"]
@@ -58,18 +157,143 @@ class CDEKClient:
                 
                 return self._token
         except httpx.HTTPStatusError as e:
-            logger.error(f"❌ Ошибка HTTP при получении токена: {e.response.status_code}")
+            logger.error(f"❌ Ошибка HTTP при получении токена аккаунта {self.name}: {e.response.status_code}")
             logger.error(f"Ответ сервера: {e.response.text}")
             raise
         except Exception as e:
-            logger.error(f"❌ Неожиданная ошибка при получении токена: {e}")
+            logger.error(f"❌ Неожиданная ошибка при получении токена аккаунта {self.name}: {e}")
             raise
+
+
+def _accounts_from_settings() -> List[CDEKAccount]:
+    configured = [
+        CDEKAccountSettings(
+            name=DEFAULT_ACCOUNT,
+            client_id=settings.cdek_client_id,
+            client_secret=settings.cdek_client_secret
+        ),
+        *settings.cdek_accounts
+    ]
+    return [
+        CDEKAccount(
+            account.name,
+            account.client_id,
+            account.client_secret,
+            account.rate_limit_per_second or settings.cdek_rate_limit_per_second
+        )
+        for account in configured
+    ]
+
+
+@dataclass(slots=True)
+class FetchedOrder:
+    payload: bytes
+    # Аккаунт, которому доступен заказ
+    account: str
+
+
+# Сколько ответов «не найден» (заказ, аккаунт) помнить в процессе
+ACCOUNT_MISSES_MAX_ENTRIES = 10000
+
+
+class CDEKClient:
+    def __init__(self):
+        self._accounts: Optional[Dict[str, CDEKAccount]] = None
+        self._next_account = 0
+        # (трек-номер, аккаунт) -> (истекает в, ошибка) для заказов без известного аккаунта
+        self._account_misses: "OrderedDict[tuple, tuple]" = OrderedDict()
+    
+    # Учетные данные читаются из настроек при первом запросе, а не при импорте
+    @property
+    def base_url(self) -> str:
+        return settings.cdek_api_url
+    
+    @property
+    def accounts(self) -> Dict[str, CDEKAccount]:
+        if self._accounts is None:
+            self._accounts = {account.name: account for account in _accounts_from_settings()}
+        return self._accounts
+    
+    def _candidate_accounts(self, account_name: Optional[str]) -> List[CDEKAccount]:
+        """
+        Аккаунт отправления, если он известен. Иначе - все аккаунты: первым тот,
+        у которого раньше освободится лимит, затем меньше израсходован запас,
+        при равенстве - по очереди
+        """
+        if account_name is not None:
+            if account_name in self.accounts:
+                return [self.accounts[account_name]]
+            logger.warning(f"⚠️ Аккаунт {account_name} не настроен, заказ ищется во всех аккаунтах")
+        
+        accounts = list(self.accounts.values())
+        start = self._next_account % len(accounts)
+        self._next_account += 1
+        rotated = accounts[start:] + accounts[:start]
+        return sorted(rotated, key=lambda account: (account.limiter.wait_time(), account.limiter.load()))
+    
+    def _recent_miss(self, tracking_code: str, account: CDEKAccount) -> Optional[CDEKError]:
+        """Ошибка, с которой аккаунт недавно не вернул заказ, или None"""
+        key = (tracking_code, account.name)
+        miss = self._account_misses.get(key)
+        if miss is None:
+            return None
+        
+        expires_at, error = miss
+        if expires_at < time.monotonic():
+            del self._account_misses[key]
+            return None
+        return error
+    
+    def _remember_miss(self, tracking_code: str, account: CDEKAccount, error: CDEKError) -> None:
+        key = (tracking_code, account.name)
+        self._account_misses[key] = (time.monotonic() + settings.cdek_account_miss_ttl_seconds, error)
+        self._account_misses.move_to_end(key)
+        while len(self._account_misses) > ACCOUNT_MISSES_MAX_ENTRIES:
+            self._account_misses.popitem(last=False)
+    
+    async def fetch_order(self, tracking_code: str, account_name: Optional[str] = None) -> FetchedOrder:
+        """
+        Тело ответа /orders и аккаунт, через который заказ получен. Заказ без
+        известного аккаунта ищется по очереди во всех аккаунтах, пока один из
+        них не вернет его; если не вернул ни один - ошибка последнего аккаунта.
+        Аккаунты, недавно не нашедшие этот заказ, повторно не спрашиваются
+        """
+        known_account = account_name is not None and account_name in self.accounts
+        candidates = self._candidate_accounts(account_name)
+        
+        if not known_account:
+            misses = {account.name: self._recent_miss(tracking_code, account) for account in candidates}
+            untried = [account for account in candidates if misses[account.name] is None]
+            if not untried:
+                logger.info(f"🔀 Заказ {tracking_code} недавно не найден ни в одном аккаунте, запрос не отправляется")
+                error = misses[candidates[-1].name]
+                raise type(error)(*error.args)
+            candidates = untried
+        
+        for attempt, account in enumerate(candidates, 1):
+            try:
+                payload = await self._fetch_order_payload(account, tracking_code)
+                return FetchedOrder(payload=payload, account=account.name)
+            except (CDEKOrderNotFound, CDEKOrderForbidden) as e:
+                if not known_account:
+                    self._remember_miss(tracking_code, account, e)
+                if attempt == len(candidates):
+                    raise
+                logger.info(f"🔀 Заказ {tracking_code} недоступен аккаунту {account.name}, пробуем следующий")
+    
+    async def fetch_order_payload(self, tracking_code: str, account_name: Optional[str] = None) -> bytes:
+        return (await self.fetch_order(tracking_code, account_name)).payload
     
-    async def get_tracking_info(self, tracking_code: str) -> Optional[Dict[str, Any]]:
-        logger.info(f"📦 Запрос информации о заказе: {tracking_code}")
+    async def _fetch_order_payload(self, account: CDEKAccount, tracking_code: str) -> bytes:
+        """
+        Тело ответа /orders без разбора. Заказ, который не найден или недоступен
+        этому аккаунту, - CDEKOrderNotFound / CDEKOrderForbidden
+        """
+        logger.info(f"📦 Запрос информации о заказе: {tracking_code} (аккаунт {account.name})")
         
         try:
-            token = await self._get_token()
+            token = await account.get_token(self.base_url)
+            await account.limiter.acquire()
             
             async with httpx.AsyncClient() as client:
                 url = f"{self.base_url}/orders"
@@ -89,10 +313,10 @@ class CDEKClient:
                 
                 if response.status_code == 404:
                     logger.warning(f"⚠️ Заказ {tracking_code} не найден (404)")
-                    return None
+                    raise CDEKOrderNotFound(f"Заказ {tracking_code} не найден")
                 
                 if response.status_code == 400:
-                    error_data = response.json()
+                    error_data = orjson.loads(response.content)
                     logger.warning(f"⚠️ Ошибка 400 для заказа {tracking_code}")
                     logger.warning(f"Детали: {json.dumps(error_data, indent=2, ensure_ascii=False)}")
                     
@@ -105,43 +329,18 @@ class CDEKClient:
                             f"  2. Используется тестовый API для продакшн заказа (или наоборот)\n"
                             f"  3. Неверный формат трек-номера"
                         )
-                    return None
+                        raise CDEKOrderForbidden(f"Заказ {tracking_code} недоступен этому аккаунту")
+                    
+                    raise CDEKInvalidTrackingCode(f"Заказ {tracking_code} не принят API: {error_data}")
                 
                 response.raise_for_status()
-                data = response.json()
-                
-                logger.info(f"Полный ответ API:\n{json.dumps(data, indent=2, ensure_ascii=False)}")
                 
-                if not data.get("entity"):
-                    logger.warning(f"⚠️ Пустой ответ для заказа {tracking_code}")
-                    logger.warning(f"Структура ответа: {list(data.keys())}")
-                    return None
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Полный ответ API:\n{response.text}")
                 
-                entity = data["entity"]
-                
-                # API может вернуть либо список заказов, либо один объект
-                if isinstance(entity, dict):
-                    # Один заказ (при поиске по im_number или uuid)
-                    order = entity
-                    logger.debug(f"Получен один заказ (dict)")
-                elif isinstance(entity, list):
-                    # Массив заказов (при поиске по cdek_number)
-                    if not entity:
-                        logger.warning(f"⚠️ Пустой список заказов для {tracking_code}")
-                        logger.warning(f"Полный ответ: {json.dumps(data, indent=2, ensure_ascii=False)}")
-                        return None
-                    order = entity[0]
-                    logger.debug(f"Получен массив заказов, взят первый")
-                else:
-                    logger.error(f"❌ Неожиданный тип entity: {type(entity)}")
-                    logger.error(f"Содержимое entity: {entity}")
-                    return None
-                logger.info(f"✅ Информация о заказе {tracking_code} получена")
-                logger.info(f"   UUID: {order.get('uuid')}")
-                logger.info(f"   Номер СДЭК: {order.get('cdek_number', 'не присвоен')}")
-                logger.info(f"   Номер ИМ: {order.get('number', 'нет')}")
-                logger.info(f"   Статусов: {len(order.get('statuses', []))}")
-                return order
+                return response.content
+        except CDEKError:
+            raise
         except httpx.HTTPStatusError as e:
             logger.error(f"❌ Ошибка HTTP при запросе заказа {tracking_code}: {e.response.status_code}")
             logger.error(f"Ответ сервера: {e.response.text}")
@@ -153,41 +352,52 @@ class CDEKClient:
             logger.error(f"Traceback:\n{traceback.format_exc()}")
             raise
     
-    async def get_order_statuses(self, tracking_code: str) -> List[Dict[str, Any]]:
+    def parse_order(self, tracking_code: str, payload: bytes) -> Optional[CDEKOrder]:
+        try:
+            order = decode_order(payload)
+        except msgspec.ValidationError as e:
+            logger.error(f"❌ Неожиданная структура ответа для заказа {tracking_code}: {e}")
+            return None
+        
+        if order is None:
+            logger.warning(f"⚠️ Пустой ответ для заказа {tracking_code}")
+            return None
+        
+        logger.info(
+            f"✅ Информация о заказе {tracking_code} получена: "
+            f"UUID={order.uuid}, номер СДЭК={order.cdek_number or 'не присвоен'}, "
+            f"номер ИМ={order.number or 'нет'}, статусов={len(order.statuses)}"
+        )
+        return order
+    
+    async def get_tracking_info(self, tracking_code: str) -> Optional[CDEKOrder]:
+        try:
+            payload = await self.fetch_order_payload(tracking_code)
+        except CDEKError:
+            return None
+        return self.parse_order(tracking_code, payload)
+    
+    async def get_order_statuses(self, tracking_code: str) -> List[StatusEvent]:
         logger.info(f"📊 Получение статусов для заказа: {tracking_code}")
         
         order_info = await self.get_tracking_info(tracking_code)
-        
+        return self.order_statuses(tracking_code, order_info)
+    
+    def order_statuses(self, tracking_code: str, order_info: Optional[CDEKOrder]) -> List[StatusEvent]:
         if not order_info:
             logger.warning(f"⚠️ Не удалось получить информацию о заказе {tracking_code}")
             return []
         
-        statuses = order_info.get("statuses", [])
+        statuses = order_info.statuses
         logger.info(f"Найдено статусов: {len(statuses)}")
         
-        result = []
-        for idx, status in enumerate(statuses, 1):
-            status_data = {
-                "code": status.get("code", ""),
-                "name": status.get("name", ""),
-                "datetime": status.get("date_time", ""),
-                "city": status.get("city", ""),
-                "reason_code": status.get("reason_code"),
-                "reason": status.get("reason")
-            }
-            result.append(status_data)
-            
-            logger.debug(f"Статус #{idx}:")
-            logger.debug(f"  Код: {status_data['code']}")
-            logger.debug(f"  Название: {status_data['name']}")
-            logger.debug(f"  Время: {status_data['datetime']}")
-            logger.debug(f"  Город: {status_data['city']}")
-            if status_data['reason']:
-                logger.debug(f"  Причина: {status_data['reason']}")
-        
-        logger.info(f"✅ Обработано статусов: {len(result)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            for idx, status in enumerate(statuses, 1):
+                logger.debug(f"Статус #{idx}: {status.code} | {status.name} | {status.date_time} | {status.city}")
+                if status.reason:
+                    logger.debug(f"  Причина: {status.reason}")
         
-        return result
+        return statuses
 
 
 cdek_client = CDEKClient()
@@ -0,0 +1,87 @@
+"""
+Типизированные структуры ответа API СДЭК
+
+Декодируются только поля, которые использует сервис; остальное содержимое
+ответа пропускается декодером без создания промежуточных словарей.
+"""
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import List, Optional, Union
+import msgspec
+
+
+@lru_cache(maxsize=8192)
+def parse_status_datetime(value: str) -> Optional[datetime]:
+    """
+    Время статуса СДЭК (ISO 8601 со смещением: +0000, +03:00 или Z)
+    в наивное UTC-время, как оно хранится в БД. Одинаковые строки времени
+    повторяются между опросами, поэтому результат кэшируется.
+    """
+    if not value:
+        return None
+    
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    return parsed
+
+
+def format_status_text(name: str, city: Optional[str], reason: Optional[str]) -> str:
+    """Текст статуса для отображения: «Название (Город) - Причина»"""
+    text = name
+    if city:
+        text += f" ({city})"
+    if reason:
+        text += f" - {reason}"
+    return text
+
+
+class StatusEvent(msgspec.Struct, gc=False):
+    """Статус заказа; декодируется напрямую из ответа СДЭК и передается до записи в БД"""
+    code: str = ""
+    name: str = ""
+    date_time: str = ""
+    city: Optional[str] = None
+    reason_code: Optional[str] = None
+    reason: Optional[str] = None
+    
+    @property
+    def timestamp(self) -> Optional[datetime]:
+        return parse_status_datetime(self.date_time)
+    
+    @property
+    def text(self) -> str:
+        return format_status_text(self.name, self.city, self.reason)
+
+
+class CDEKOrder(msgspec.Struct):
+    uuid: Optional[str] = None
+    cdek_number: Optional[str] = None
+    number: Optional[str] = None
+    statuses: List[StatusEvent] = []
+
+
+class CDEKOrderResponse(msgspec.Struct):
+    # По cdek_number API возвращает список заказов, по uuid и im_number - один заказ
+    entity: Union[CDEKOrder, List[CDEKOrder], None] = None
+
+
+order_response_decoder = msgspec.json.Decoder(CDEKOrderResponse)
+
+
+def decode_order(content: bytes) -> Optional[CDEKOrder]:
+    """
+    Заказ из тела ответа /orders (первый, если API вернуло список).
+    Используется и при опросе, и при переобработке сохраненных ответов.
+    Некорректная структура ответа - msgspec.ValidationError.
+    """
+    entity = order_response_decoder.decode(content).entity
+    
+    if isinstance(entity, list):
+        return entity[0] if entity else None
+    return entity
@@ -1,14 +1,169 @@
+from functools import lru_cache
+from typing import Optional, List
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 
+class CDEKAccountSettings(BaseModel):
+    name: str
+    client_id: str
+    client_secret: str
+    # None - общий cdek_rate_limit_per_second
+    rate_limit_per_second: Optional[float] = None
+
+
+class NotificationEndpointSettings(BaseModel):
+    name: str
+    url: str
+    # Передается в заголовке Authorization: Bearer <token>
+    token: Optional[str] = None
+    # Сколько пачек отправлять этому получателю одновременно
+    max_concurrency: int = 2
+
+
 class Settings(BaseSettings):
+    # Аккаунт СДЭК с именем default
     cdek_client_id: str
     cdek_client_secret: str
     cdek_api_url: str
     database_url: str
     
+    # Реплика для чтения (страницы, списки, поиск, карточки, аналитика). Если она отстает
+    # больше чем на replica_max_lag_seconds или недоступна, чтения идут в основную БД;
+    # клиент, который только что что-то изменил, читает из основной БД read_your_writes секунд
+    database_replica_url: Optional[str] = None
+    replica_max_lag_seconds: float = 10.0
+    replica_lag_check_seconds: int = 5
+    replica_read_your_writes_seconds: int = 10
+    
+    # Аккаунты других договоров СДЭК, JSON-список в CDEK_ACCOUNTS:
+    # [{"name": "...", "client_id": "...", "client_secret": "...", "rate_limit_per_second": 5}].
+    # У каждого аккаунта свой токен и свой лимит запросов в секунду. Лимит считается
+    # в каждом процессе отдельно: при N процессах задавайте лимит договора / N
+    cdek_accounts: List[CDEKAccountSettings] = []
+    cdek_rate_limit_per_second: float = 5.0
+    # Сколько помнить, что заказ без аккаунта не найден в аккаунте (не спрашивать его повторно)
+    cdek_account_miss_ttl_seconds: int = 900
+    
+    # Правило проблемного отправления: не доставлено и с первого статуса прошло больше N дней
+    problem_threshold_days: int = 3
+    delivered_status_codes: List[str] = ["DELIVERED", "RECEIVED_AT_DELIVERY_OFFICE"]
+    problem_sweep_interval_seconds: int = 600
+    
+    # Пересчет перцентилей сроков доставки и дневных счетчиков
+    analytics_refresh_interval_seconds: int = 900
+    
+    # Выбор лидера для периодических задач (PostgreSQL advisory lock)
+    leader_lock_key: int = 724310
+    leader_heartbeat_seconds: int = 10
+    
+    # Воркеры обновления статусов (python -m app.worker)
+    refresh_interval_seconds: int = 1800
+    worker_batch_size: int = 20
+    worker_lease_seconds: int = 300
+    worker_idle_sleep_seconds: int = 10
+    # Ошибки опроса: пауза после временной ошибки удваивается от base до max;
+    # после N ошибок подряд, последняя из которых постоянная (не найден, чужой аккаунт),
+    # отправление уходит на карантин до ручного снятия
+    failure_backoff_base_seconds: int = 60
+    failure_backoff_max_seconds: int = 21600
+    quarantine_after_failures: int = 3
+    # Полный проход по всем отправлениям (POST /update-statuses, python -m app.refresh_runs):
+    # пачка между контрольными точками, одновременных запросов к СДЭК и аренда прохода
+    refresh_run_batch_size: int = 50
+    refresh_run_concurrency: int = 5
+    refresh_run_lease_seconds: int = 300
+    # Срочное обновление по запросу (POST /api/shipments/.../refresh)
+    priority_lease_seconds: int = 60
+    priority_refresh_max_codes: int = 50
+    # Одновременных срочных опросов в процессе. Соединение с БД на время запроса к СДЭК
+    # не держится, поэтому лимит не связан с пулом; по умолчанию весь запрос
+    # (priority_refresh_max_codes) укладывается в один запрос к СДЭК
+    priority_refresh_concurrency: int = 50
+    
+    # Уведомления о новых статусах (outbox): получатели - JSON-список в NOTIFICATION_ENDPOINTS
+    # [{"name": "...", "url": "...", "token": "...", "max_concurrency": 2}].
+    # Неудачная отправка повторяется с паузой от base до max, после max_attempts - отбрасывается
+    notification_endpoints: List[NotificationEndpointSettings] = []
+    notification_batch_size: int = 100
+    notification_dispatch_interval_seconds: int = 5
+    notification_timeout_seconds: float = 10.0
+    notification_backoff_base_seconds: int = 10
+    notification_backoff_max_seconds: int = 3600
+    notification_max_attempts: int = 12
+    # Сколько дней хранить отправленные и отброшенные уведомления
+    notification_retention_days: int = 7
+    
+    # Доставленные отправления старше N дней переносятся в архивные таблицы
+    archive_after_days: int = 30
+    archive_batch_size: int = 500
+    # На сколько месяцев вперед заранее создавать партиции shipment_statuses
+    partition_months_ahead: int = 3
+    # Как часто лидер планировщика проверяет партиции
+    partition_maintenance_interval_seconds: int = 21600
+    
+    # На сколько строк data_versions разложена версия данных: записи в разных
+    # транзакциях увеличивают разные строки и не ждут друг друга
+    data_version_shards: int = 16
+    
+    # Кэш статистики и списка отправлений: memory, redis или none
+    cache_backend: str = "memory"
+    cache_ttl_seconds: int = 300
+    cache_max_entries: int = 2048
+    # Карточки отправлений (по записи на отправление) хранятся в отдельном LRU,
+    # чтобы просмотр списков и статистики их не вытеснял
+    cache_max_items: int = 10000
+    redis_url: Optional[str] = None
+    
+    # Поиск по трек-номеру: сколько результатов отдавать и как часто индекс в памяти
+    # (без PostgreSQL) проверяет появление новых отправлений
+    search_default_limit: int = 20
+    search_index_check_seconds: int = 5
+    
+    # Сырые ответы СДЭК для переобработки без запросов к API: zstd (пакет zstandard) или gzip
+    store_raw_payloads: bool = True
+    payload_codec: str = "zstd"
+    
+    # Production-сервер (python run.py): gunicorn + uvicorn-воркеры
+    web_host: str = "0.0.0.0"
+    web_port: int = 8000
+    web_workers: Optional[int] = None
+    web_max_requests: int = 10000
+    web_max_requests_jitter: int = 1000
+    web_timeout_seconds: int = 60
+    web_graceful_timeout_seconds: int = 30
+    web_keepalive_seconds: int = 5
+    log_level: str = "INFO"
+    # Сжатие ответов: меньшие ответы отдаются как есть; brotli - если установлен пакет brotli
+    compression_minimum_size: int = 1024
+    gzip_level: int = 6
+    brotli_quality: int = 5
+    # Кэш скомпилированных Jinja-шаблонов
+    template_cache_dir: str = ".cache/jinja"
+    
+    # Диагностика: запросы к БД дольше slow_query_ms пишутся в лог с параметрами,
+    # HTTP-запрос, сделавший больше request_query_warn_count запросов к БД, - тоже (признак N+1)
+    slow_query_ms: float = 200.0
+    request_query_warn_count: int = 50
+    # Профилирование одного запроса (заголовок X-Profile: 1 или ?profile=1) - только если включено
+    profiling_enabled: bool = False
+    profile_dir: str = ".cache/profiles"
+    profile_keep: int = 20
+    
     class Config:
         env_file = ".env"
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    return Settings()
+
+
+class LazySettings:
+    """Настройки читаются из окружения при первом обращении, а не при импорте модуля"""
+    
+    def __getattr__(self, name: str):
+        return getattr(get_settings(), name)
+
+
+settings = LazySettings()
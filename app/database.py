@@ -1,14 +1,45 @@
+from functools import lru_cache
+from typing import Optional
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from app.config import settings
+from app.profiling import instrument_engine
 
-engine = create_engine(settings.database_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@lru_cache(maxsize=1)
+def get_engine() -> Engine:
+    """Движок создается при первом обращении, чтобы импорт приложения не открывал соединений"""
+    return instrument_engine(create_engine(settings.database_url))
+
+
+@lru_cache(maxsize=1)
+def get_replica_engine() -> Optional[Engine]:
+    """Движок реплики для чтения; None, если DATABASE_REPLICA_URL не задан"""
+    if not settings.database_replica_url:
+        return None
+    return instrument_engine(create_engine(settings.database_replica_url, pool_pre_ping=True))
+
+
+class LazySessionMaker(sessionmaker):
+    def __call__(self, **local_kw) -> Session:
+        local_kw.setdefault("bind", get_engine())
+        return super().__call__(**local_kw)
+
+
+SessionLocal = LazySessionMaker(autocommit=False, autoflush=False)
 
 Base = declarative_base()
 
 
+def __getattr__(name: str):
+    # Совместимость со скриптами, импортирующими app.database.engine
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,49 @@
+"""
+Условные запросы для эндпоинтов чтения
+
+ETag строится из версии данных (data_versions), которая увеличивается при
+каждом изменении отправлений. Пока данные не менялись, клиент с тем же
+If-None-Match получает 304 без тела, а ответ даже не собирается.
+"""
+from typing import Dict
+from fastapi import Request, Response
+
+# Суффиксы, которые CompressionMiddleware добавляет к ETag сжатых ответов
+ENCODING_SUFFIXES = ("-gzip", "-br")
+
+
+def make_etag(*parts) -> str:
+    return '"' + "-".join(str(part) for part in parts) + '"'
+
+
+def _normalize(tag: str) -> str:
+    tag = tag.strip()
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    tag = tag.strip('"')
+    
+    for suffix in ENCODING_SUFFIXES:
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)]
+    return tag
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    
+    if if_none_match.strip() == "*":
+        return True
+    
+    expected = _normalize(etag)
+    return any(_normalize(tag) == expected for tag in if_none_match.split(","))
+
+
+def cache_headers(etag: str) -> Dict[str, str]:
+    # no-cache: клиент хранит ответ, но перед использованием проверяет его по ETag
+    return {"ETag": etag, "Cache-Control": "no-cache"}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag))
@@ -0,0 +1,225 @@
+"""
+Выбор лидера среди процессов приложения
+
+При запуске uvicorn --workers N периодические задачи должен выполнять
+только один процесс. Лидером становится процесс, получивший advisory lock
+PostgreSQL на выделенном соединении. Блокировка живет, пока живо соединение:
+если лидер падает, PostgreSQL снимает ее, и при следующем heartbeat
+лидерство забирает другой процесс.
+
+Без PostgreSQL (SQLite) лидерство - аренда строки scheduler_leader: лидер
+продлевает heartbeat_at, а строку с heartbeat старше трех интервалов
+забирает другой процесс.
+"""
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any
+from sqlalchemy import select, update, insert, delete, text, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import get_engine
+from app.models import SchedulerLeader
+
+logger = logging.getLogger(__name__)
+
+LEADER_NAME = "scheduler"
+# Лидер считается живым, пока heartbeat не старше стольких интервалов
+LEASE_HEARTBEATS = 3
+
+
+class LeaderElector:
+    def __init__(self, lock_key: Optional[int] = None, heartbeat_seconds: Optional[int] = None):
+        self.lock_key = lock_key if lock_key is not None else settings.leader_lock_key
+        self.heartbeat_seconds = heartbeat_seconds or settings.leader_heartbeat_seconds
+        self.hostname = socket.gethostname()
+        self.pid = os.getpid()
+        self.identity = f"{self.hostname}:{self.pid}"
+        self.is_leader = False
+        self.elected_at: Optional[datetime] = None
+        self._conn: Optional[Connection] = None
+    
+    def _connect(self) -> Connection:
+        if self._conn is None:
+            self._conn = get_engine().connect().execution_options(isolation_level="AUTOCOMMIT")
+        return self._conn
+    
+    def _drop_connection(self) -> None:
+        if self._conn is not None:
+            try:
+                # Соединение закрывается, а не возвращается в пул: сессионная
+                # блокировка переживает сброс соединения при возврате
+                self._conn.invalidate()
+            except Exception:
+                pass
+        self._conn = None
+    
+    def _holds_lock(self, conn: Connection) -> bool:
+        # Ключ bigint хранится в pg_locks двумя половинами: classid - старшая, objid - младшая
+        return bool(conn.execute(
+            text(
+                "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' "
+                "AND pid = pg_backend_pid() AND granted AND objsubid = 1 "
+                "AND classid::bigint = :classid AND objid::bigint = :objid)"
+            ),
+            {"classid": (self.lock_key >> 32) & 0xFFFFFFFF, "objid": self.lock_key & 0xFFFFFFFF}
+        ).scalar())
+    
+    def _become_leader(self) -> None:
+        self.is_leader = True
+        self.elected_at = datetime.utcnow()
+        logger.info(f"👑 Процесс {self.identity} стал лидером планировщика")
+    
+    def _lose_leadership(self, reason: str) -> None:
+        if self.is_leader:
+            logger.warning(f"⚠️ Процесс {self.identity} потерял лидерство: {reason}")
+        self.is_leader = False
+        self.elected_at = None
+    
+    def _write_heartbeat(self, conn: Connection) -> None:
+        now = datetime.utcnow()
+        values = {
+            "holder_id": self.identity,
+            "hostname": self.hostname,
+            "pid": self.pid,
+            "elected_at": self.elected_at,
+            "heartbeat_at": now
+        }
+        
+        updated = conn.execute(
+            update(SchedulerLeader).where(SchedulerLeader.name == LEADER_NAME).values(**values)
+        ).rowcount
+        if not updated:
+            conn.execute(insert(SchedulerLeader).values(name=LEADER_NAME, **values))
+    
+    def _tick_lease(self) -> bool:
+        now = datetime.utcnow()
+        lease_expired = now - timedelta(seconds=self.heartbeat_seconds * LEASE_HEARTBEATS)
+        elected_at = self.elected_at or now
+        values = {
+            "holder_id": self.identity,
+            "hostname": self.hostname,
+            "pid": self.pid,
+            "elected_at": elected_at,
+            "heartbeat_at": now
+        }
+        
+        try:
+            with get_engine().begin() as conn:
+                taken = conn.execute(
+                    update(SchedulerLeader)
+                    .where(
+                        SchedulerLeader.name == LEADER_NAME,
+                        or_(SchedulerLeader.holder_id == self.identity, SchedulerLeader.heartbeat_at < lease_expired)
+                    )
+                    .values(**values)
+                ).rowcount
+                if not taken and conn.scalar(
+                    select(SchedulerLeader.name).where(SchedulerLeader.name == LEADER_NAME)
+                ) is None:
+                    conn.execute(insert(SchedulerLeader).values(name=LEADER_NAME, **values))
+                    taken = 1
+        except IntegrityError:
+            # Строку одновременно создал другой процесс
+            taken = 0
+        
+        if taken and not self.is_leader:
+            self._become_leader()
+            # Время избрания - как записано в строке аренды
+            self.elected_at = elected_at
+        elif not taken:
+            self._lose_leadership("аренду забрал другой процесс")
+        return self.is_leader
+    
+    def tick(self) -> bool:
+        """Один heartbeat: попытаться стать лидером или подтвердить лидерство"""
+        if get_engine().dialect.name != "postgresql":
+            return self._tick_lease()
+        
+        try:
+            conn = self._connect()
+            
+            if not self.is_leader:
+                acquired = conn.execute(
+                    text("SELECT pg_try_advisory_lock(:key)"), {"key": self.lock_key}
+                ).scalar()
+                if acquired:
+                    self._become_leader()
+            elif not self._holds_lock(conn):
+                self._lose_leadership("advisory lock не удерживается")
+                self._drop_connection()
+                return False
+            
+            if self.is_leader:
+                self._write_heartbeat(conn)
+        except Exception as e:
+            # Блокировка могла быть уже взята: снимаем ее и закрываем соединение
+            self._lose_leadership(str(e))
+            self._unlock()
+            self._drop_connection()
+        
+        return self.is_leader
+    
+    def _unlock(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.lock_key})
+        except Exception:
+            pass
+    
+    def resign(self) -> None:
+        if get_engine().dialect.name != "postgresql":
+            if self.is_leader:
+                try:
+                    with get_engine().begin() as conn:
+                        conn.execute(
+                            delete(SchedulerLeader)
+                            .where(SchedulerLeader.name == LEADER_NAME, SchedulerLeader.holder_id == self.identity)
+                        )
+                except Exception:
+                    pass
+        else:
+            self._unlock()
+        self._lose_leadership("остановка процесса")
+        self._drop_connection()
+    
+    async def run(self) -> None:
+        try:
+            while True:
+                try:
+                    await asyncio.to_thread(self.tick)
+                except Exception as e:
+                    logger.error(f"❌ Ошибка heartbeat лидера: {e}")
+                await asyncio.sleep(self.heartbeat_seconds)
+        finally:
+            await asyncio.to_thread(self.resign)
+
+
+def get_leader_status(db: Session, elector: LeaderElector) -> Dict[str, Any]:
+    leader = db.execute(select(SchedulerLeader).where(SchedulerLeader.name == LEADER_NAME)).scalar_one_or_none()
+    
+    leader_data = None
+    if leader:
+        heartbeat_age = (datetime.utcnow() - leader.heartbeat_at).total_seconds()
+        leader_data = {
+            "holder_id": leader.holder_id,
+            "hostname": leader.hostname,
+            "pid": leader.pid,
+            "elected_at": leader.elected_at.isoformat() if leader.elected_at else None,
+            "heartbeat_at": leader.heartbeat_at.isoformat(),
+            "heartbeat_age_seconds": round(heartbeat_age, 1),
+            "alive": heartbeat_age < elector.heartbeat_seconds * LEASE_HEARTBEATS
+        }
+    
+    return {
+        "this_process": {
+            "id": elector.identity,
+            "is_leader": elector.is_leader
+        },
+        "leader": leader_data
+    }
@@ -0,0 +1,139 @@
+"""
+Справочники статусов, городов и причин
+
+Строки shipment_statuses ссылаются на справочники короткими целочисленными
+ключами. Справочники небольшие, поэтому процесс держит их в памяти целиком
+и обращается к БД только при встрече нового значения.
+"""
+import threading
+from typing import Dict, Optional, Tuple
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.models import StatusCode, City, StatusReason
+from app.cdek_schema import format_status_text
+
+
+class StatusLookups:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._code_ids: Dict[str, int] = {}
+        self._codes: Dict[int, Tuple[str, str]] = {}
+        self._city_ids: Dict[str, int] = {}
+        self._cities: Dict[int, str] = {}
+        self._reason_ids: Dict[str, int] = {}
+        self._reasons: Dict[int, str] = {}
+    
+    def reload(self, db: Session) -> None:
+        codes = db.execute(select(StatusCode.id, StatusCode.code, StatusCode.name)).all()
+        cities = db.execute(select(City.id, City.name)).all()
+        reasons = db.execute(select(StatusReason.id, StatusReason.text)).all()
+        
+        with self._lock:
+            self._codes = {row.id: (row.code, row.name) for row in codes}
+            self._code_ids = {row.code: row.id for row in codes}
+            self._cities = {row.id: row.name for row in cities}
+            self._city_ids = {row.name: row.id for row in cities}
+            self._reasons = {row.id: row.text for row in reasons}
+            self._reason_ids = {row.text: row.id for row in reasons}
+    
+    def _get_or_create(self, db: Session, model, key_column, key: str, values: dict) -> int:
+        """
+        Новое значение справочника записывается в отдельной короткой транзакции,
+        чтобы не зависеть от транзакции загрузки статусов
+        """
+        if db.get_bind().dialect.name == "sqlite":
+            # SQLite допускает одного писателя: второе соединение ждало бы транзакцию сессии
+            with db.begin_nested():
+                row_id = db.execute(select(model.id).where(key_column == key)).scalar()
+                if row_id is None:
+                    row_id = db.execute(insert(model).values(**values).returning(model.id)).scalar_one()
+            return row_id
+        
+        with db.get_bind().connect() as conn:
+            row_id = conn.execute(select(model.id).where(key_column == key)).scalar()
+            if row_id is None:
+                try:
+                    row_id = conn.execute(insert(model).values(**values).returning(model.id)).scalar_one()
+                    conn.commit()
+                except IntegrityError:
+                    # Значение только что добавил другой процесс
+                    conn.rollback()
+                    row_id = conn.execute(select(model.id).where(key_column == key)).scalar_one()
+        return row_id
+    
+    def status_code_id(self, db: Session, code: str, name: str) -> int:
+        code_id = self._code_ids.get(code)
+        if code_id is None:
+            code_id = self._get_or_create(db, StatusCode, StatusCode.code, code, {"code": code, "name": name})
+            with self._lock:
+                self._code_ids[code] = code_id
+                self._codes[code_id] = (code, name)
+        return code_id
+    
+    def city_id(self, db: Session, name: Optional[str]) -> Optional[int]:
+        if not name:
+            return None
+        
+        city_id = self._city_ids.get(name)
+        if city_id is None:
+            city_id = self._get_or_create(db, City, City.name, name, {"name": name})
+            with self._lock:
+                self._city_ids[name] = city_id
+                self._cities[city_id] = name
+        return city_id
+    
+    def reason_id(self, db: Session, code: Optional[str], text: Optional[str]) -> Optional[int]:
+        if not text:
+            return None
+        
+        reason_id = self._reason_ids.get(text)
+        if reason_id is None:
+            reason_id = self._get_or_create(
+                db, StatusReason, StatusReason.text, text, {"code": code, "text": text}
+            )
+            with self._lock:
+                self._reason_ids[text] = reason_id
+                self._reasons[reason_id] = text
+        return reason_id
+    
+    def _ensure_loaded(self, db: Session, code_id: int, city_id: Optional[int], reason_id: Optional[int]) -> None:
+        # Значение могло появиться в другом процессе
+        if (
+            code_id not in self._codes
+            or (city_id is not None and city_id not in self._cities)
+            or (reason_id is not None and reason_id not in self._reasons)
+        ):
+            self.reload(db)
+    
+    def code(self, db: Session, code_id: int) -> str:
+        self._ensure_loaded(db, code_id, None, None)
+        return self._codes[code_id][0]
+    
+    def status_name(self, db: Session, code_id: int) -> str:
+        self._ensure_loaded(db, code_id, None, None)
+        return self._codes[code_id][1]
+    
+    def city_name(self, db: Session, city_id: Optional[int]) -> Optional[str]:
+        if city_id is None:
+            return None
+        if city_id not in self._cities:
+            self.reload(db)
+        return self._cities.get(city_id)
+    
+    def status_text(
+        self,
+        db: Session,
+        code_id: int,
+        city_id: Optional[int],
+        reason_id: Optional[int]
+    ) -> str:
+        self._ensure_loaded(db, code_id, city_id, reason_id)
+        return format_status_text(
+            self._codes[code_id][1],
+            self._cities.get(city_id) if city_id is not None else None,
+            self._reasons.get(reason_id) if reason_id is not None else None
+        )
+
+
+lookups = StatusLookups()
@@ -1,81 +1,287 @@
-from fastapi import FastAPI, Depends, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Depends, Request, Response, HTTPException, Query
+from fastapi.responses import FileResponse, HTMLResponse, ORJSONResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
+from jinja2 import FileSystemBytecodeCache
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
+from typing import Dict, Any, Iterator, List, Optional
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from pathlib import Path
+import hashlib
 import logging
-from app.database import get_db
-from app import services
+from app.database import get_db, SessionLocal
+from app import services, archive, scheduler, leader, http_cache, analytics, search
+from app.priority import priority_refresher
+from app.refresh_runs import refresh_runner, RefreshRunBusy
+from app.compression import CompressionMiddleware
+from app.replica import ReadYourWritesMiddleware, get_read_db, replica_monitor
+from app.profiling import ProfilingMiddleware, profile_path
+from app.config import settings
 from app.logging_config import setup_logging
 
-setup_logging(log_level="INFO", log_file="logs/app.log")
-
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="CDEK Delivery Monitoring")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Импорт app.main ничего не настраивает: при preload в gunicorn
+    # логи, настройки и соединения с БД создаются уже в процессе-воркере
+    setup_logging(log_level=settings.log_level, log_file="logs/app.log")
+    logger.info("🚀 Приложение CDEK Delivery Monitoring запущено")
+    
+    # Скомпилированные шаблоны переживают перезапуск воркеров
+    cache_dir = Path(settings.template_cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(str(cache_dir))
+    
+    tasks = scheduler.start_scheduler()
+    yield
+    await scheduler.stop_scheduler(tasks)
+
+
+app = FastAPI(
+    title="CDEK Delivery Monitoring",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(ProfilingMiddleware)
 
 templates = Jinja2Templates(directory="app/templates")
 
-logger.info("🚀 Приложение CDEK Delivery Monitoring запущено")
 
+# Сколько фрагментов шаблона собирать в один кусок потокового ответа
+TEMPLATE_STREAM_BUFFER = 500
 
-@app.get("/", response_class=HTMLResponse)
-async def root(request: Request, db: Session = Depends(get_db)):
-    statistics = services.get_shipments_statistics(db)
-    shipments = services.get_shipments_with_details(db)
-    
-    return templates.TemplateResponse(
-        "shipments.html",
-        {
-            "request": request,
-            "statistics": statistics,
-            "shipments": shipments
-        }
+
+def _stream_shipments(source: Session, version: int) -> Iterator[Dict[str, Any]]:
+    # Своя сессия к той же БД (основной или реплике): строки читаются, пока страница отправляется клиенту
+    db = SessionLocal(bind=source.get_bind(), info=dict(source.info))
+    try:
+        yield from services.iter_shipments_with_details(db, version)
+    finally:
+        db.close()
+
+
+@lru_cache(maxsize=None)
+def _template_fingerprint(name: str) -> str:
+    # Новая версия шаблона после деплоя меняет ETag страницы
+    source, _, _ = templates.env.loader.get_source(templates.env, name)
+    return hashlib.sha1(source.encode()).hexdigest()[:8]
+
+
+def render_shipments_page(request: Request, db: Session) -> Response:
+    """Страница отправлений отдается по мере рендеринга таблицы, а не одной строкой"""
+    # ETag и тело ответа строятся по одной и той же версии данных
+    version = services.get_data_version(db)
+    etag = http_cache.make_etag(version, _template_fingerprint("shipments.html"))
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag)
+    
+    statistics = services.get_shipments_statistics(db, version)
+    
+    stream = templates.get_template("shipments.html").stream(
+        request=request,
+        statistics=statistics,
+        shipments=_stream_shipments(db, version)
     )
+    stream.enable_buffering(TEMPLATE_STREAM_BUFFER)
+    
+    return StreamingResponse(stream, media_type="text/html; charset=utf-8", headers=http_cache.cache_headers(etag))
+
+
+@app.get("/", response_class=HTMLResponse)
+async def root(request: Request, db: Session = Depends(get_read_db)):
+    return render_shipments_page(request, db)
 
 
 @app.get("/shipments", response_class=HTMLResponse)
-async def shipments_page(request: Request, db: Session = Depends(get_db)):
-    statistics = services.get_shipments_statistics(db)
-    shipments = services.get_shipments_with_details(db)
-    
-    return templates.TemplateResponse(
-        "shipments.html",
-        {
-            "request": request,
-            "statistics": statistics,
-            "shipments": shipments
-        }
-    )
+async def shipments_page(request: Request, db: Session = Depends(get_read_db)):
+    return render_shipments_page(request, db)
+
+
+@app.get("/shipments/{tracking_code}", response_class=HTMLResponse)
+async def shipment_page(request: Request, tracking_code: str, db: Session = Depends(get_read_db)):
+    shipment = services.get_shipment_detail(db, tracking_code)
+    
+    if not shipment:
+        raise HTTPException(status_code=404, detail="Отправление не найдено")
+    
+    return templates.TemplateResponse("shipment_detail.html", {"request": request, "shipment": shipment})
+
+
+# Большие списки отдаются готовым ORJSONResponse, минуя jsonable_encoder
+@app.get("/api/shipments", response_class=ORJSONResponse)
+async def api_shipments(request: Request, db: Session = Depends(get_read_db)):
+    version = services.get_data_version(db)
+    etag = http_cache.make_etag(version)
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag)
+    
+    return ORJSONResponse(services.get_shipments_with_details(db, version), headers=http_cache.cache_headers(etag))
+
 
+@app.get("/api/shipments/search", response_class=ORJSONResponse)
+async def api_search_shipments(
+    q: str = Query(..., min_length=3, max_length=100),
+    limit: Optional[int] = Query(None, ge=1, le=100),
+    db: Session = Depends(get_read_db)
+):
+    return ORJSONResponse(search.search_shipments(db, q, limit))
 
-@app.get("/api/shipments")
-async def api_shipments(db: Session = Depends(get_db)) -> List[Dict[str, Any]]:
-    return services.get_shipments_with_details(db)
+
+@app.get("/api/shipments/problematic", response_class=ORJSONResponse)
+async def api_problematic_shipments(request: Request, db: Session = Depends(get_read_db)):
+    version = services.get_data_version(db)
+    etag = http_cache.make_etag(version)
+    if http_cache.etag_matches(request, etag):
+        return http_cache.not_modified(etag)
+    
+    return ORJSONResponse(services.get_problematic_shipments(db, version), headers=http_cache.cache_headers(etag))
+
+
+@app.get("/api/shipments/quarantined", response_class=ORJSONResponse)
+async def api_quarantined_shipments(db: Session = Depends(get_read_db)):
+    return ORJSONResponse(services.get_quarantined_shipments(db))
+
+
+# Маршрут с параметром объявлен после /api/shipments/search, /problematic и /quarantined
+@app.get("/api/shipments/{tracking_code}", response_class=ORJSONResponse)
+async def api_shipment_detail(tracking_code: str, db: Session = Depends(get_read_db)):
+    shipment = services.get_shipment_detail(db, tracking_code)
+    
+    if not shipment:
+        raise HTTPException(status_code=404, detail="Отправление не найдено")
+    
+    return ORJSONResponse(shipment)
 
 
-@app.post("/update-statuses")
-async def update_statuses(db: Session = Depends(get_db)) -> Dict[str, Any]:
+# Перцентили читаются из предрасчитанных таблиц, пересчет - задача планировщика
+@app.get("/api/analytics/routes", response_class=ORJSONResponse)
+async def api_analytics_routes(db: Session = Depends(get_read_db)):
+    return ORJSONResponse(analytics.get_route_percentiles(db))
+
+
+@app.get("/api/analytics/cities", response_class=ORJSONResponse)
+async def api_analytics_cities(db: Session = Depends(get_read_db)):
+    return ORJSONResponse(analytics.get_city_percentiles(db))
+
+
+@app.get("/api/analytics/stages", response_class=ORJSONResponse)
+async def api_analytics_stages(db: Session = Depends(get_read_db)):
+    return ORJSONResponse(analytics.get_stage_percentiles(db))
+
+
+@app.get("/api/analytics/daily", response_class=ORJSONResponse)
+async def api_analytics_daily(days: int = Query(30, ge=1, le=366), db: Session = Depends(get_read_db)):
+    return ORJSONResponse(analytics.get_daily_counts(db, days))
+
+
+@app.get("/api/archive/{tracking_code}")
+async def api_archived_shipment(tracking_code: str, db: Session = Depends(get_read_db)) -> Dict[str, Any]:
+    shipment = archive.get_archived_shipment(db, tracking_code)
+    
+    if not shipment:
+        raise HTTPException(status_code=404, detail="Отправление не найдено в архиве")
+    
+    return shipment
+
+
+@app.post("/update-statuses", response_class=ORJSONResponse)
+async def update_statuses():
     logger.info("🔄 Запрос на обновление статусов всех отправлений")
     
-    results = await services.update_all_shipments_statuses(db)
+    try:
+        run = await refresh_runner.run()
+    except RefreshRunBusy:
+        raise HTTPException(status_code=409, detail="Обновление всех отправлений уже выполняет другой процесс")
+    
+    logger.info(
+        f"✅ Обновление {'завершено' if run['completed'] else 'прервано'}: успешно={run['succeeded']}, "
+        f"ошибок={run['failed']}, новых статусов={run['new_statuses']}"
+    )
+    
+    # Счетчики - за весь проход, включая его часть до перезапуска; details - за этот запрос
+    return ORJSONResponse({
+        "success": True,
+        "run_id": run["run_id"],
+        "resumed": run["resumed"],
+        "completed": run["completed"],
+        "total_shipments": run["processed"],
+        "updated_successfully": run["succeeded"],
+        "failed": run["failed"],
+        "total_new_statuses": run["new_statuses"],
+        "details": run["results"]
+    })
+
+
+class RefreshRequest(BaseModel):
+    tracking_codes: List[str]
+
+
+# Срочное обновление вне очереди воркеров: ответ после одного запроса к СДЭК
+@app.post("/api/shipments/refresh", response_class=ORJSONResponse)
+async def refresh_shipments(body: RefreshRequest):
+    if not body.tracking_codes:
+        raise HTTPException(status_code=422, detail="Не указаны трек-номера")
+    if len(body.tracking_codes) > settings.priority_refresh_max_codes:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Не больше {settings.priority_refresh_max_codes} трек-номеров за запрос"
+        )
+    
+    return ORJSONResponse(await priority_refresher.refresh_many(body.tracking_codes))
+
+
+@app.post("/api/shipments/{tracking_code}/refresh", response_class=ORJSONResponse)
+async def refresh_shipment(tracking_code: str):
+    result = await priority_refresher.refresh(tracking_code)
     
-    success_count = sum(1 for r in results if r.get("success"))
-    failed_count = len(results) - success_count
-    total_new_statuses = sum(r.get("new_statuses", 0) for r in results if r.get("success"))
+    if result.get("error") == "not_found":
+        raise HTTPException(status_code=404, detail="Отправление не найдено")
     
-    logger.info(f"✅ Обновление завершено: успешно={success_count}, ошибок={failed_count}, новых статусов={total_new_statuses}")
+    return ORJSONResponse(result)
+
+
+@app.post("/api/shipments/{tracking_code}/release", response_class=ORJSONResponse)
+async def release_quarantined_shipment(tracking_code: str, db: Session = Depends(get_db)):
+    if not services.release_quarantine(db, tracking_code):
+        raise HTTPException(status_code=404, detail="Отправление не найдено на карантине")
     
+    return ORJSONResponse({"success": True, "tracking_code": tracking_code})
+
+
+@app.get("/scheduler/status")
+async def scheduler_status(db: Session = Depends(get_db)) -> Dict[str, Any]:
+    if scheduler.elector is None:
+        raise HTTPException(status_code=503, detail="Планировщик не запущен")
+    
+    return leader.get_leader_status(db, scheduler.elector)
+
+
+@app.get("/replica/status")
+async def replica_status() -> Dict[str, Any]:
+    lag = replica_monitor.lag_seconds()
     return {
-        "success": True,
-        "total_shipments": len(results),
-        "updated_successfully": success_count,
-        "failed": failed_count,
-        "total_new_statuses": total_new_statuses,
-        "details": results
+        "configured": replica_monitor.configured,
+        "lag_seconds": round(lag, 3) if lag is not None and lag != float("inf") else None,
+        "max_lag_seconds": settings.replica_max_lag_seconds,
+        "reads_from": "replica" if replica_monitor.use_replica() else "primary"
     }
 
 
+@app.get("/debug/profiles/{profile_id}")
+async def download_profile(profile_id: str):
+    """Профиль запроса, снятый с X-Profile: 1 (формат pstats)"""
+    path = profile_path(profile_id) if settings.profiling_enabled else None
+    if path is None:
+        raise HTTPException(status_code=404, detail="Профиль не найден")
+    
+    return FileResponse(path, media_type="application/octet-stream", filename=path.name)
+
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
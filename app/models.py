@@ -1,27 +1,365 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import (
+    Column, Integer, BigInteger, SmallInteger, String, Date, DateTime, Float, ForeignKey, Text, Index, Boolean,
+    LargeBinary, false, true, text
+)
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
+from app.cdek_schema import format_status_text
 
 
 class Shipment(Base):
     __tablename__ = "shipments"
     
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     tracking_code = Column(String(100), unique=True, nullable=False, index=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
+    # Сохраненное состояние, пересчитывается при загрузке статусов и периодической проверкой
+    first_status_at = Column(DateTime, nullable=True)
+    last_status_at = Column(DateTime, nullable=True)
+    is_delivered = Column(Boolean, default=False, server_default=false(), nullable=False)
+    is_problematic = Column(Boolean, default=False, server_default=false(), nullable=False)
+    problem_since = Column(DateTime, nullable=True)
+    
+    # Очередь обновления: когда опрашивать снова и какой воркер держит аренду
+    next_poll_at = Column(DateTime, nullable=True)
+    lease_owner = Column(String(100), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    
+    # Ошибки опроса подряд: временные откладывают опрос с растущей паузой,
+    # постоянные (не найден, чужой аккаунт) - выводят из опроса до ручного снятия
+    failure_count = Column(Integer, default=0, server_default="0", nullable=False)
+    last_error = Column(String(30), nullable=True)
+    last_error_at = Column(DateTime, nullable=True)
+    quarantined_at = Column(DateTime, nullable=True)
+    
+    # Аккаунт СДЭК, через который заказ был получен; None - еще не найден ни в одном
+    cdek_account = Column(String(50), nullable=True)
+    
+    # Время последнего изменения строки или истории статусов: карточка отправления
+    # в кэше привязана к нему, поэтому изменение из любого процесса делает ее неактуальной
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=True)
+    
     statuses = relationship("ShipmentStatus", back_populates="shipment", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        # Кандидаты для периодической проверки проблемных отправлений
+        Index(
+            "ix_shipments_problem_sweep",
+            first_status_at,
+            postgresql_where=(is_delivered == false()) & (is_problematic == false()),
+            sqlite_where=(is_delivered == false()) & (is_problematic == false())
+        ),
+        # Выборка отправлений, которые пора опрашивать
+        Index(
+            "ix_shipments_next_poll_at",
+            next_poll_at,
+            postgresql_where=(is_delivered == false()) & quarantined_at.is_(None),
+            sqlite_where=(is_delivered == false()) & quarantined_at.is_(None)
+        ),
+        Index(
+            "ix_shipments_quarantined_at",
+            quarantined_at,
+            postgresql_where=quarantined_at.is_not(None),
+            sqlite_where=quarantined_at.is_not(None)
+        ),
+        Index(
+            "ix_shipments_problem_since",
+            problem_since,
+            postgresql_where=(is_problematic == true()),
+            sqlite_where=(is_problematic == true())
+        ),
+        # Поиск по трек-номеру: префикс (LIKE 'abc%') и триграммы (pg_trgm);
+        # в SQLite поиск идет по индексу в памяти (app/search.py)
+        Index(
+            "ix_shipments_tracking_code_pattern",
+            tracking_code,
+            postgresql_ops={"tracking_code": "text_pattern_ops"}
+        ).ddl_if(dialect="postgresql"),
+        Index(
+            "ix_shipments_tracking_code_trgm",
+            tracking_code,
+            postgresql_using="gin",
+            postgresql_ops={"tracking_code": "gin_trgm_ops"}
+        ).ddl_if(dialect="postgresql"),
+    )
+
+
+# SQLite автоинкрементирует только INTEGER PRIMARY KEY
+SmallId = SmallInteger().with_variant(Integer(), "sqlite")
+
+
+class StatusCode(Base):
+    __tablename__ = "status_codes"
+    
+    id = Column(SmallId, primary_key=True)
+    code = Column(String(50), unique=True, nullable=False)
+    name = Column(Text, nullable=False)
+
+
+class City(Base):
+    __tablename__ = "cities"
+    
+    id = Column(Integer, primary_key=True)
+    name = Column(String(255), unique=True, nullable=False)
+
+
+class StatusReason(Base):
+    __tablename__ = "status_reasons"
+    
+    id = Column(Integer, primary_key=True)
+    code = Column(String(50), nullable=True)
+    text = Column(Text, unique=True, nullable=False)
 
 
 class ShipmentStatus(Base):
     __tablename__ = "shipment_statuses"
     
-    id = Column(Integer, primary_key=True, index=True)
-    shipment_id = Column(Integer, ForeignKey("shipments.id"), nullable=False, index=True)
-    status_code = Column(String(50), nullable=False)
-    status_text = Column(Text, nullable=False)
+    id = Column(Integer, primary_key=True)
+    shipment_id = Column(Integer, ForeignKey("shipments.id"), nullable=False)
+    status_code_id = Column(SmallId, ForeignKey("status_codes.id"), nullable=False)
+    city_id = Column(Integer, ForeignKey("cities.id"), nullable=True)
+    reason_id = Column(Integer, ForeignKey("status_reasons.id"), nullable=True)
     status_datetime = Column(DateTime, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     shipment = relationship("Shipment", back_populates="statuses")
+    status = relationship("StatusCode", lazy="joined")
+    city = relationship("City", lazy="joined")
+    reason = relationship("StatusReason", lazy="joined")
+    
+    __table_args__ = (
+        Index(
+            "uq_shipment_statuses_dedupe",
+            "shipment_id", "status_code_id", "status_datetime",
+            unique=True
+        ),
+        Index(
+            "ix_shipment_statuses_shipment_id_status_datetime",
+            "shipment_id", status_datetime.desc(),
+            postgresql_include=["status_code_id"]
+        ),
+    )
+    
+    @property
+    def status_code(self) -> str:
+        return self.status.code
+    
+    @property
+    def status_text(self) -> str:
+        return format_status_text(
+            self.status.name,
+            self.city.name if self.city else None,
+            self.reason.text if self.reason else None
+        )
+
+
+class RawPayload(Base):
+    """Сжатый ответ СДЭК; одинаковые ответы хранятся один раз по хэшу содержимого"""
+    __tablename__ = "raw_payloads"
+    
+    id = Column(Integer, primary_key=True)
+    content_hash = Column(String(64), unique=True, nullable=False)
+    codec = Column(String(10), nullable=False)
+    raw_size = Column(Integer, nullable=False)
+    body = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ShipmentPoll(Base):
+    """Какие ответы получены по отправлению: повторный опрос с тем же ответом обновляет last_polled_at"""
+    __tablename__ = "shipment_polls"
+    
+    id = Column(Integer, primary_key=True)
+    shipment_id = Column(Integer, ForeignKey("shipments.id"), nullable=False)
+    payload_id = Column(Integer, ForeignKey("raw_payloads.id"), nullable=False, index=True)
+    first_polled_at = Column(DateTime, nullable=False)
+    last_polled_at = Column(DateTime, nullable=False)
+    poll_count = Column(Integer, default=1, nullable=False)
+    
+    __table_args__ = (
+        Index("uq_shipment_polls_shipment_payload", "shipment_id", "payload_id", unique=True),
+    )
+
+
+class DataVersion(Base):
+    """Счетчик изменений данных; из него строятся ETag ответов"""
+    __tablename__ = "data_versions"
+    
+    name = Column(String(50), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class ShipmentTransitFact(Base):
+    """
+    Время в пути доставленного отправления. Обновляется при загрузке статусов;
+    без внешнего ключа, чтобы история оставалась после архивации отправления.
+    """
+    __tablename__ = "shipment_transit_facts"
+    
+    shipment_id = Column(Integer, primary_key=True)
+    origin_city_id = Column(Integer, nullable=True)
+    destination_city_id = Column(Integer, nullable=True)
+    first_status_at = Column(DateTime, nullable=False)
+    delivered_at = Column(DateTime, nullable=False, index=True)
+    transit_seconds = Column(Float, nullable=False)
+
+
+class StatusStageFact(Base):
+    """Сколько отправление пробыло в статусе до следующего статуса"""
+    __tablename__ = "status_stage_facts"
+    
+    id = Column(Integer, primary_key=True)
+    shipment_id = Column(Integer, nullable=False, index=True)
+    status_code_id = Column(SmallId, nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    duration_seconds = Column(Float, nullable=False)
+
+
+class TransitPercentile(Base):
+    """Предрассчитанные перцентили: dimension = route, city или stage"""
+    __tablename__ = "transit_percentiles"
+    
+    id = Column(Integer, primary_key=True)
+    dimension = Column(String(20), nullable=False, index=True)
+    origin_city_id = Column(Integer, nullable=True)
+    city_id = Column(Integer, nullable=True)
+    status_code_id = Column(SmallId, nullable=True)
+    shipments = Column(Integer, nullable=False)
+    p50_seconds = Column(Float, nullable=False)
+    p90_seconds = Column(Float, nullable=False)
+    p99_seconds = Column(Float, nullable=False)
+    computed_at = Column(DateTime, nullable=False)
+
+
+class DailyShipmentCount(Base):
+    __tablename__ = "daily_shipment_counts"
+    
+    day = Column(Date, primary_key=True)
+    in_transit = Column(Integer, nullable=False)
+    delivered = Column(Integer, nullable=False)
+    problematic = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class SchedulerLeader(Base):
+    __tablename__ = "scheduler_leader"
+    
+    name = Column(String(50), primary_key=True)
+    holder_id = Column(String(100), nullable=False)
+    hostname = Column(String(255), nullable=False)
+    pid = Column(Integer, nullable=False)
+    elected_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=False)
+
+
+class OutboxEvent(Base):
+    """
+    Событие об изменении отправления для рассылки получателям. Пишется в той же
+    транзакции, что и изменение, поэтому не теряется и не опережает его
+    """
+    __tablename__ = "outbox_events"
+    
+    id = Column(Integer, primary_key=True)
+    # Без внешнего ключа: отправление могут перенести в архив раньше, чем событие разослано
+    shipment_id = Column(Integer, nullable=False)
+    event_type = Column(String(50), nullable=False)
+    # JSON события
+    payload = Column(LargeBinary, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class OutboxDelivery(Base):
+    """Отправка события одному получателю"""
+    __tablename__ = "outbox_deliveries"
+    
+    id = Column(Integer, primary_key=True)
+    event_id = Column(Integer, ForeignKey("outbox_events.id", ondelete="CASCADE"), nullable=False, index=True)
+    destination = Column(String(50), nullable=False)
+    # Копия из события: порядок отправки соблюдается в пределах отправления
+    shipment_id = Column(Integer, nullable=False)
+    attempts = Column(Integer, default=0, server_default="0", nullable=False)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(String(30), nullable=True)
+    delivered_at = Column(DateTime, nullable=True)
+    # Попытки исчерпаны
+    failed_at = Column(DateTime, nullable=True)
+    
+    __table_args__ = (
+        # Очередь получателя в порядке записи событий
+        Index(
+            "ix_outbox_deliveries_pending",
+            destination,
+            id,
+            postgresql_where=delivered_at.is_(None) & failed_at.is_(None),
+            sqlite_where=delivered_at.is_(None) & failed_at.is_(None)
+        ),
+    )
+
+
+class RefreshRun(Base):
+    """
+    Проход обновления всех отправлений: курсор и счетчики, чтобы прерванный
+    проход продолжился с места остановки
+    """
+    __tablename__ = "refresh_runs"
+    
+    id = Column(Integer, primary_key=True)
+    # running, interrupted или completed
+    status = Column(String(20), nullable=False)
+    # Процесс, который ведет проход, и его последняя отметка
+    owner = Column(String(100), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)
+    started_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    
+    # Проход идет по id до max_shipment_id, отправления, добавленные позже, - в следующий проход
+    max_shipment_id = Column(Integer, nullable=False)
+    last_shipment_id = Column(Integer, default=0, server_default="0", nullable=False)
+    
+    processed = Column(Integer, default=0, server_default="0", nullable=False)
+    succeeded = Column(Integer, default=0, server_default="0", nullable=False)
+    failed = Column(Integer, default=0, server_default="0", nullable=False)
+    new_statuses = Column(Integer, default=0, server_default="0", nullable=False)
+    
+    __table_args__ = (
+        # Незавершенный проход может быть только один
+        Index(
+            "ux_refresh_runs_unfinished",
+            text("(finished_at IS NULL)"),
+            unique=True,
+            postgresql_where=finished_at.is_(None),
+            sqlite_where=finished_at.is_(None)
+        ),
+    )
+
+
+class ArchivedShipment(Base):
+    __tablename__ = "shipments_archive"
+    
+    id = Column(Integer, primary_key=True)
+    tracking_code = Column(String(100), nullable=False, index=True)
+    created_at = Column(DateTime, nullable=False)
+    delivered_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    
+    statuses = relationship(
+        "ArchivedShipmentStatus",
+        back_populates="shipment",
+        order_by="ArchivedShipmentStatus.status_datetime"
+    )
+
+
+class ArchivedShipmentStatus(Base):
+    __tablename__ = "shipment_statuses_archive"
+    
+    id = Column(Integer, primary_key=True)
+    shipment_id = Column(Integer, ForeignKey("shipments_archive.id"), nullable=False, index=True)
+    status_code = Column(String(50), nullable=False)
+    status_text = Column(Text, nullable=False)
+    status_datetime = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    
+    shipment = relationship("ArchivedShipment", back_populates="statuses")
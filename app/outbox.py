@@ -0,0 +1,283 @@
+"""
+Уведомления получателей о новых статусах (transactional outbox)
+
+Загрузка статусов в той же транзакции пишет событие в outbox_events и по
+строке outbox_deliveries на каждого получателя из NOTIFICATION_ENDPOINTS.
+Рассылает события лидер планировщика: по каждому получателю берется
+очередь неотправленных событий, события одного отправления попадают в одну
+пачку в порядке записи (больше notification_batch_size - в подряд идущие
+пачки), пачки уходят POST-запросом {"events": [...]} одновременно, но не
+больше max_concurrency на получателя; продолжение событий отправления
+уходит только после успешной отправки предыдущей пачки.
+
+Неудачная пачка повторяется с растущей паузой; пока более раннее событие
+отправления ждет повтора, следующие события этого отправления не
+отправляются. Доставка - не меньше одного раза: получатель должен
+пропускать повторы по id события.
+"""
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import httpx
+import orjson
+from sqlalchemy import select, insert, update, delete, func, exists
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Session
+from app.config import settings, NotificationEndpointSettings
+from app.database import SessionLocal
+from app.lookups import lookups
+from app.models import Shipment, ShipmentStatus, OutboxEvent, OutboxDelivery
+from app.cdek_client import error_category
+
+logger = logging.getLogger(__name__)
+
+STATUSES_ADDED = "shipment.statuses_added"
+
+# Как часто удалять старые отправленные события
+PRUNE_INTERVAL_SECONDS = 3600
+
+
+def record_statuses_added(db: Session, shipment: Shipment, new_statuses: List[ShipmentStatus]) -> None:
+    """
+    Записать событие о новых статусах отправления. Вызывается после
+    refresh_shipment_state, до commit
+    """
+    destinations = [endpoint.name for endpoint in settings.notification_endpoints]
+    if not destinations or not new_statuses:
+        return
+    
+    now = datetime.utcnow()
+    payload = {
+        "type": STATUSES_ADDED,
+        "tracking_code": shipment.tracking_code,
+        "delivered": shipment.is_delivered,
+        "problem": shipment.is_problematic,
+        "statuses": [
+            {
+                "status_code": lookups.code(db, status.status_code_id),
+                "status_text": lookups.status_text(db, status.status_code_id, status.city_id, status.reason_id),
+                "city": lookups.city_name(db, status.city_id),
+                "status_datetime": status.status_datetime.isoformat()
+            }
+            for status in sorted(new_statuses, key=lambda status: status.status_datetime)
+        ]
+    }
+    
+    event_id = db.scalar(
+        insert(OutboxEvent)
+        .values(shipment_id=shipment.id, event_type=STATUSES_ADDED, payload=orjson.dumps(payload), created_at=now)
+        .returning(OutboxEvent.id)
+    )
+    db.execute(insert(OutboxDelivery), [
+        {"event_id": event_id, "destination": destination, "shipment_id": shipment.id, "next_attempt_at": now}
+        for destination in destinations
+    ])
+
+
+def notification_backoff(attempts: int) -> timedelta:
+    seconds = settings.notification_backoff_base_seconds * 2 ** (attempts - 1)
+    return timedelta(seconds=min(seconds, settings.notification_backoff_max_seconds))
+
+
+def due_batches(db: Session, destination: str, batch_size: int, max_events: int) -> List[List[Row]]:
+    """
+    Пачки событий, которые пора отправить получателю, не больше batch_size
+    событий. События отправления идут в порядке записи одной пачкой, а если
+    в пачку не помещаются - подряд идущими пачками (см. continues_previous),
+    и не идут вовсе, пока его более раннее событие ждет повтора
+    """
+    now = datetime.utcnow()
+    rows = db.execute(
+        select(
+            OutboxDelivery.id,
+            OutboxDelivery.shipment_id,
+            OutboxDelivery.attempts,
+            OutboxDelivery.next_attempt_at,
+            OutboxEvent.id.label("event_id"),
+            OutboxEvent.payload,
+            OutboxEvent.created_at
+        )
+        .join(OutboxEvent, OutboxEvent.id == OutboxDelivery.event_id)
+        .where(
+            OutboxDelivery.destination == destination,
+            OutboxDelivery.delivered_at.is_(None),
+            OutboxDelivery.failed_at.is_(None)
+        )
+        .order_by(OutboxDelivery.id)
+        .limit(max_events)
+    ).all()
+    
+    blocked = set()
+    by_shipment: Dict[int, List[Row]] = defaultdict(list)
+    for row in rows:
+        if row.shipment_id in blocked:
+            continue
+        if row.next_attempt_at > now:
+            blocked.add(row.shipment_id)
+            by_shipment.pop(row.shipment_id, None)
+            continue
+        by_shipment[row.shipment_id].append(row)
+    
+    batches = []
+    current = []
+    for events in by_shipment.values():
+        # События, которые помещаются в пачку, не разрываются между пачками
+        if current and len(current) + len(events) > batch_size and len(events) <= batch_size:
+            batches.append(current)
+            current = []
+        for row in events:
+            if len(current) == batch_size:
+                batches.append(current)
+                current = []
+            current.append(row)
+    if current:
+        batches.append(current)
+    
+    return batches
+
+
+def continues_previous(previous: List[Row], batch: List[Row]) -> bool:
+    """Пачка продолжает события отправления из предыдущей и отправляется только после нее"""
+    return previous[-1].shipment_id == batch[0].shipment_id
+
+
+def _request_body(batch: List[Row]) -> bytes:
+    return orjson.dumps({
+        "events": [
+            {"id": row.event_id, "created_at": row.created_at.isoformat(), **orjson.loads(row.payload)}
+            for row in batch
+        ]
+    })
+
+
+def mark_delivered(db: Session, batch: List[Row]) -> None:
+    db.execute(
+        update(OutboxDelivery)
+        .where(OutboxDelivery.id.in_([row.id for row in batch]))
+        .values(delivered_at=datetime.utcnow(), attempts=OutboxDelivery.attempts + 1, last_error=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def mark_failed(db: Session, destination: str, batch: List[Row], error: str) -> None:
+    """Отложить повтор пачки; события, исчерпавшие попытки, отбрасываются"""
+    now = datetime.utcnow()
+    values = []
+    dropped = 0
+    
+    for row in batch:
+        attempts = row.attempts + 1
+        item = {"id": row.id, "attempts": attempts, "last_error": error}
+        if attempts >= settings.notification_max_attempts:
+            item["failed_at"] = now
+            dropped += 1
+        else:
+            item["next_attempt_at"] = now + notification_backoff(attempts)
+        values.append(item)
+    
+    # executemany по первичному ключу; у строк разный набор полей, поэтому по группам
+    for keys in {tuple(item) for item in values}:
+        db.execute(update(OutboxDelivery), [item for item in values if tuple(item) == keys])
+    db.commit()
+    
+    if dropped:
+        logger.error(f"❌ Уведомления для {destination}: {dropped} событий отброшено после всех попыток ({error})")
+
+
+def prune_outbox(db: Session, retention_days: Optional[int] = None) -> int:
+    """Удалить отправленные и отброшенные уведомления старше retention_days"""
+    retention_days = retention_days or settings.notification_retention_days
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    
+    deleted = db.execute(
+        delete(OutboxDelivery)
+        .where(func.coalesce(OutboxDelivery.delivered_at, OutboxDelivery.failed_at) < cutoff)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.execute(
+        delete(OutboxEvent)
+        .where(~exists().where(OutboxDelivery.event_id == OutboxEvent.id))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return deleted
+
+
+class OutboxDispatcher:
+    def __init__(self):
+        self._pruned_at: Optional[float] = None
+    
+    async def dispatch(self) -> Dict[str, int]:
+        """Один проход по всем получателям: {получатель: отправлено событий}"""
+        endpoints = settings.notification_endpoints
+        sent = await asyncio.gather(*(self._dispatch_endpoint(endpoint) for endpoint in endpoints))
+        
+        if self._pruned_at is None or time.monotonic() - self._pruned_at >= PRUNE_INTERVAL_SECONDS:
+            db = SessionLocal()
+            try:
+                pruned = prune_outbox(db)
+                if pruned:
+                    logger.info(f"🧹 Удалено старых уведомлений: {pruned}")
+            finally:
+                db.close()
+            self._pruned_at = time.monotonic()
+        
+        return {endpoint.name: count for endpoint, count in zip(endpoints, sent)}
+    
+    async def _dispatch_endpoint(self, endpoint: NotificationEndpointSettings) -> int:
+        batch_size = settings.notification_batch_size
+        
+        db = SessionLocal()
+        try:
+            batches = due_batches(db, endpoint.name, batch_size, batch_size * endpoint.max_concurrency)
+            db.rollback()
+            if not batches:
+                return 0
+            
+            headers = {"Content-Type": "application/json"}
+            if endpoint.token:
+                headers["Authorization"] = f"Bearer {endpoint.token}"
+            
+            semaphore = asyncio.Semaphore(endpoint.max_concurrency)
+            
+            async with httpx.AsyncClient(timeout=settings.notification_timeout_seconds) as client:
+                delivered = [asyncio.get_running_loop().create_future() for _ in batches]
+                
+                async def send(index: int, batch: List[Row]) -> int:
+                    count = 0
+                    try:
+                        # Более поздние события отправления не обгоняют более ранние: если
+                        # их пачка не отправлена, эти ждут следующего прохода
+                        if index and continues_previous(batches[index - 1], batch):
+                            if not await delivered[index - 1]:
+                                return 0
+                        
+                        async with semaphore:
+                            try:
+                                response = await client.post(endpoint.url, content=_request_body(batch), headers=headers)
+                                response.raise_for_status()
+                            except Exception as e:
+                                logger.warning(f"⚠️ Уведомления для {endpoint.name} не отправлены: {e}")
+                                mark_failed(db, endpoint.name, batch, error_category(e))
+                                return 0
+                        
+                        mark_delivered(db, batch)
+                        count = len(batch)
+                        return count
+                    finally:
+                        delivered[index].set_result(count > 0)
+                
+                sent = sum(await asyncio.gather(*(send(index, batch) for index, batch in enumerate(batches))))
+            
+            if sent:
+                logger.info(f"📨 {endpoint.name}: отправлено событий {sent}")
+            return sent
+        finally:
+            db.close()
+
+
+outbox_dispatcher = OutboxDispatcher()
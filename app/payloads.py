@@ -0,0 +1,149 @@
+"""
+Хранилище сырых ответов СДЭК
+
+Каждый ответ /orders сохраняется сжатым (zstd или gzip) и один раз на
+одинаковое содержимое: ключом служит sha256 несжатого тела. Связь с
+отправлением хранится в shipment_polls, поэтому повторный опрос без
+изменений добавляет только счетчик.
+"""
+import gzip
+import hashlib
+import logging
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy import select, insert, bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import RawPayload, ShipmentPoll
+
+logger = logging.getLogger(__name__)
+
+ZSTD_LEVEL = 9
+GZIP_LEVEL = 6
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+@lru_cache(maxsize=1)
+def default_codec() -> str:
+    codec = settings.payload_codec.lower()
+    
+    if codec == "zstd" and _zstd() is None:
+        logger.warning("⚠️ Пакет zstandard не установлен, сырые ответы сжимаются gzip")
+        return "gzip"
+    if codec not in ("zstd", "gzip"):
+        raise RuntimeError(f"Неизвестный PAYLOAD_CODEC: {settings.payload_codec}")
+    
+    return codec
+
+
+def compress(content: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return _zstd().ZstdCompressor(level=ZSTD_LEVEL).compress(content)
+    return gzip.compress(content, compresslevel=GZIP_LEVEL)
+
+
+def decompress(body: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        zstandard = _zstd()
+        if zstandard is None:
+            raise RuntimeError("Для чтения ответов, сжатых zstd, установите пакет zstandard: pip install zstandard")
+        return zstandard.ZstdDecompressor().decompress(body)
+    return gzip.decompress(body)
+
+
+def content_hash(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
+
+def _insert_payload(db: Session, digest: str, content: bytes, codec: str) -> int:
+    try:
+        with db.begin_nested():
+            payload_id = db.execute(
+                insert(RawPayload).values(
+                    content_hash=digest,
+                    codec=codec,
+                    raw_size=len(content),
+                    body=compress(content, codec),
+                    created_at=datetime.utcnow()
+                ).returning(RawPayload.id)
+            ).scalar_one()
+    except IntegrityError:
+        # Такой же ответ только что сохранил другой воркер
+        payload_id = db.scalar(select(RawPayload.id).where(RawPayload.content_hash == digest))
+    
+    return payload_id
+
+
+def record_poll(db: Session, shipment_id: int, content: bytes, codec: Optional[str] = None) -> int:
+    """Сохранить ответ опроса отправления и вернуть id сохраненного ответа"""
+    payload_id = record_polls(db, [(shipment_id, content)], codec)[0]
+    db.commit()
+    return payload_id
+
+
+def record_polls(db: Session, polls: List[Tuple[int, bytes]], codec: Optional[str] = None) -> List[int]:
+    """
+    Сохранить ответы опроса пачки отправлений (shipment_id, ответ) без commit:
+    известные ответы и связи с отправлениями ищутся одним запросом на пачку.
+    Возвращает id сохраненных ответов в порядке polls
+    """
+    if not polls:
+        return []
+    
+    now = datetime.utcnow()
+    codec = codec or default_codec()
+    digests = [content_hash(content) for _, content in polls]
+    
+    payload_ids: Dict[str, int] = {
+        digest: payload_id
+        for digest, payload_id in db.execute(
+            select(RawPayload.content_hash, RawPayload.id).where(RawPayload.content_hash.in_(set(digests)))
+        )
+    }
+    for digest, (_, content) in zip(digests, polls):
+        if digest not in payload_ids:
+            payload_ids[digest] = _insert_payload(db, digest, content, codec)
+    
+    pairs = [(shipment_id, payload_ids[digest]) for (shipment_id, _), digest in zip(polls, digests)]
+    known = set(db.execute(
+        select(ShipmentPoll.shipment_id, ShipmentPoll.payload_id)
+        .where(
+            ShipmentPoll.shipment_id.in_({shipment_id for shipment_id, _ in pairs}),
+            ShipmentPoll.payload_id.in_({payload_id for _, payload_id in pairs})
+        )
+    ).tuples())
+    
+    repeated = [{"poll_shipment_id": s, "poll_payload_id": p} for s, p in pairs if (s, p) in known]
+    if repeated:
+        polls_table = ShipmentPoll.__table__
+        db.execute(
+            polls_table.update()
+            .where(
+                polls_table.c.shipment_id == bindparam("poll_shipment_id"),
+                polls_table.c.payload_id == bindparam("poll_payload_id")
+            )
+            .values(last_polled_at=now, poll_count=polls_table.c.poll_count + 1),
+            repeated
+        )
+    
+    new = [
+        {"shipment_id": s, "payload_id": p, "first_polled_at": now, "last_polled_at": now, "poll_count": 1}
+        for s, p in pairs if (s, p) not in known
+    ]
+    if new:
+        db.execute(insert(ShipmentPoll), new)
+    
+    return [payload_id for _, payload_id in pairs]
+
+
+def load_payload(payload: RawPayload) -> bytes:
+    return decompress(payload.body, payload.codec)
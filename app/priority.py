@@ -0,0 +1,159 @@
+"""
+Срочное обновление отдельных отправлений по запросу
+
+Запрос не ждет очереди воркеров: отправление сразу забирается под аренду
+с владельцем priority:<узел>:<pid> (в том числе у фонового воркера, который
+его еще не начал опрашивать) и опрашивается в СДЭК в текущем запросе.
+
+Повторный запрос того же трек-номера присоединяется к уже идущему опросу:
+в процессе - к той же задаче asyncio, в другом процессе - ждет снятия
+его срочной аренды и возвращает результат из БД.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from sqlalchemy import select, update, or_, not_
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal
+from app.models import Shipment
+from app.worker import default_worker_id, release
+from app import services
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_OWNER_PREFIX = "priority:"
+
+# Как часто проверять аренду, взятую срочным обновлением в другом процессе
+JOIN_POLL_SECONDS = 0.1
+
+
+def priority_owner() -> str:
+    # pid берется при вызове: при preload в gunicorn модуль импортируется еще в мастере
+    return f"{PRIORITY_OWNER_PREFIX}{default_worker_id()}"
+
+
+def claim_priority(db: Session, tracking_code: str, owner: str, lease_seconds: int) -> Optional[int]:
+    """
+    Взять аренду отправления вне очереди. Не получится, только если его уже
+    срочно обновляет другой процесс; None - аренда не взята или отправления нет.
+    """
+    now = datetime.utcnow()
+    shipment_id = db.scalar(
+        update(Shipment)
+        .where(
+            Shipment.tracking_code == tracking_code,
+            or_(
+                Shipment.lease_owner.is_(None),
+                Shipment.lease_expires_at < now,
+                not_(Shipment.lease_owner.startswith(PRIORITY_OWNER_PREFIX))
+            )
+        )
+        .values(lease_owner=owner, lease_expires_at=now + timedelta(seconds=lease_seconds))
+        .returning(Shipment.id)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return shipment_id
+
+
+async def _wait_for_priority_lease(db: Session, tracking_code: str, timeout: float) -> None:
+    deadline = asyncio.get_running_loop().time() + timeout
+    
+    while asyncio.get_running_loop().time() < deadline:
+        owner, expires_at = db.execute(
+            select(Shipment.lease_owner, Shipment.lease_expires_at)
+            .where(Shipment.tracking_code == tracking_code)
+        ).one()
+        db.rollback()
+        
+        if (
+            owner is None
+            or not owner.startswith(PRIORITY_OWNER_PREFIX)
+            or expires_at < datetime.utcnow()
+        ):
+            return
+        
+        await asyncio.sleep(JOIN_POLL_SECONDS)
+
+
+class PriorityRefresher:
+    def __init__(self):
+        # Идущие в этом процессе срочные обновления по трек-номеру
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Создается при первом опросе: импорт модуля не читает настройки
+        self._semaphore: Optional[asyncio.Semaphore] = None
+    
+    def _limit(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.priority_refresh_concurrency)
+        return self._semaphore
+    
+    async def refresh(self, tracking_code: str) -> Dict[str, Any]:
+        task = self._inflight.get(tracking_code)
+        if task is None:
+            task = asyncio.ensure_future(self._refresh(tracking_code))
+            self._inflight[tracking_code] = task
+            task.add_done_callback(lambda _: self._inflight.pop(tracking_code, None))
+        else:
+            logger.info(f"🔗 {tracking_code}: присоединение к идущему обновлению")
+        
+        # Отмена одного ожидающего запроса не отменяет общий опрос
+        return await asyncio.shield(task)
+    
+    async def refresh_many(self, tracking_codes: List[str]) -> List[Dict[str, Any]]:
+        """
+        Трек-номера опрашиваются одновременно, не больше priority_refresh_concurrency
+        сразу (по умолчанию - все трек-номера запроса), ответ - за время самого долгого опроса
+        """
+        tracking_codes = list(dict.fromkeys(tracking_codes))
+        return list(await asyncio.gather(*(self.refresh(code) for code in tracking_codes)))
+    
+    async def _refresh(self, tracking_code: str) -> Dict[str, Any]:
+        owner = priority_owner()
+        lease_seconds = settings.priority_lease_seconds
+        
+        db = SessionLocal()
+        try:
+            async with self._limit():
+                shipment_id = claim_priority(db, tracking_code, owner, lease_seconds)
+                if shipment_id is not None:
+                    return await self._poll(db, tracking_code, owner, shipment_id)
+            
+            if services.get_shipment_by_tracking_code(db, tracking_code) is None:
+                db.rollback()
+                return {"success": False, "tracking_code": tracking_code, "error": "not_found"}
+            
+            # Отправление срочно обновляет другой процесс: ждем его результат, не занимая место в лимите
+            logger.info(f"🔗 {tracking_code}: обновляется другим процессом, ожидание")
+            await _wait_for_priority_lease(db, tracking_code, lease_seconds)
+            return {
+                "success": True,
+                "tracking_code": tracking_code,
+                "joined": True,
+                "shipment": services.get_shipment_detail(db, tracking_code)
+            }
+        finally:
+            db.close()
+    
+    @staticmethod
+    async def _poll(db: Session, tracking_code: str, owner: str, shipment_id: int) -> Dict[str, Any]:
+        logger.info(f"⚡ Срочное обновление {tracking_code}")
+        result = None
+        try:
+            result = await services.update_shipment_statuses(db, tracking_code)
+        finally:
+            # Ошибка загрузки могла оставить транзакцию сессии прерванной
+            db.rollback()
+            next_poll_at = None
+            if result is not None and result["success"]:
+                next_poll_at = datetime.utcnow() + timedelta(seconds=settings.refresh_interval_seconds)
+            release(db, owner, [shipment_id], next_poll_at)
+        
+        result["joined"] = False
+        result["shipment"] = services.get_shipment_detail(db, tracking_code)
+        return result
+
+
+priority_refresher = PriorityRefresher()
@@ -0,0 +1,191 @@
+"""
+Диагностика медленных страниц
+
+- Запросы к БД дольше slow_query_ms пишутся в лог (app.sql) с параметрами
+- Каждому HTTP-запросу считаются запросы к БД и их время; если запросов
+  больше request_query_warn_count, в лог пишутся самые частые - так видны
+  N+1, например ленивая загрузка shipment.statuses в цикле
+- При profiling_enabled запрос с заголовком X-Profile: 1 или параметром
+  ?profile=1 выполняется под cProfile; профиль сохраняется в profile_dir,
+  его id приходит в заголовке X-Profile-Id, скачать - GET /debug/profiles/<id>
+  (открывается pstats, snakeviz и т.п.)
+
+cProfile видит поток цикла событий: под профиль попадают и другие запросы,
+идущие одновременно, а синхронный код в пуле потоков - нет. Одновременно
+профилируется только один запрос.
+"""
+import cProfile
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qs
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+sql_logger = logging.getLogger("app.sql")
+
+PROFILE_HEADER = "x-profile"
+PROFILE_QUERY_PARAM = "profile"
+PROFILE_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+# Длина запроса и параметров в логе
+MAX_LOGGED_STATEMENT = 2000
+MAX_LOGGED_PARAMS = 500
+# Сколько самых частых запросов показывать в предупреждении о числе запросов
+TOP_STATEMENTS = 3
+
+
+class QueryStats:
+    __slots__ = ("count", "seconds", "statements")
+    
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements: Counter = Counter()
+    
+    def add(self, statement: str, seconds: float) -> None:
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+
+# Счетчик текущего HTTP-запроса; объект общий, поэтому его видят и зависимости в пуле потоков
+_request_stats: ContextVar[Optional[QueryStats]] = ContextVar("request_query_stats", default=None)
+
+
+def _truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Одно значение, а не стек: after_cursor_execute не вызывается для упавшего
+    # запроса, и его отметку просто перезапишет следующий
+    conn.info["query_started_at"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info.pop("query_started_at", None)
+    if started_at is None:
+        return
+    seconds = time.perf_counter() - started_at
+    
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.add(statement, seconds)
+    
+    if seconds * 1000 >= settings.slow_query_ms:
+        sql_logger.warning(
+            f"🐢 Медленный запрос {seconds * 1000:.0f} ms: "
+            f"{_truncate(' '.join(statement.split()), MAX_LOGGED_STATEMENT)} "
+            f"| параметры: {_truncate(repr(parameters), MAX_LOGGED_PARAMS)}"
+        )
+
+
+def instrument_engine(engine: Engine) -> Engine:
+    """Подключить замер времени запросов к движку"""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    return engine
+
+
+def _profile_requested(scope: Scope) -> bool:
+    if not settings.profiling_enabled:
+        return False
+    if Headers(scope=scope).get(PROFILE_HEADER, "") in ("1", "true"):
+        return True
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    return query.get(PROFILE_QUERY_PARAM, [""])[-1] in ("1", "true")
+
+
+def profile_path(profile_id: str) -> Optional[Path]:
+    """Файл сохраненного профиля; None - id некорректен или профиля нет"""
+    if not PROFILE_ID_RE.match(profile_id):
+        return None
+    path = Path(settings.profile_dir) / f"{profile_id}.prof"
+    return path if path.is_file() else None
+
+
+def _prune_profiles(directory: Path) -> None:
+    profiles = sorted(directory.glob("*.prof"), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in profiles[settings.profile_keep:]:
+        path.unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    """Счетчик запросов к БД на HTTP-запрос и профилирование по запросу клиента"""
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._profile_lock = threading.Lock()
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        stats = QueryStats()
+        token = _request_stats.set(stats)
+        started_at = time.perf_counter()
+        try:
+            if _profile_requested(scope) and self._profile_lock.acquire(blocking=False):
+                try:
+                    await self._profiled(scope, receive, send, stats)
+                finally:
+                    self._profile_lock.release()
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            _request_stats.reset(token)
+            self._log_stats(scope, stats, time.perf_counter() - started_at)
+    
+    async def _profiled(self, scope: Scope, receive: Receive, send: Send, stats: QueryStats) -> None:
+        profile_id = uuid.uuid4().hex
+        
+        async def send_with_profile_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(raw=message["headers"])
+                headers["X-Profile-Id"] = profile_id
+            await send(message)
+        
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profiler.disable()
+            directory = Path(settings.profile_dir)
+            directory.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(directory / f"{profile_id}.prof"))
+            _prune_profiles(directory)
+            logger.info(
+                f"🔬 Профиль {scope['method']} {scope['path']}: {profile_id} "
+                f"(запросов к БД {stats.count}, {stats.seconds * 1000:.0f} ms)"
+            )
+    
+    @staticmethod
+    def _log_stats(scope: Scope, stats: QueryStats, seconds: float) -> None:
+        if stats.count <= settings.request_query_warn_count:
+            logger.debug(
+                f"{scope['method']} {scope['path']}: {seconds * 1000:.0f} ms, "
+                f"запросов к БД {stats.count} ({stats.seconds * 1000:.0f} ms)"
+            )
+            return
+        
+        top = "; ".join(
+            f"{count}x {_truncate(' '.join(statement.split()), 200)}"
+            for statement, count in stats.statements.most_common(TOP_STATEMENTS)
+        )
+        logger.warning(
+            f"🔁 {scope['method']} {scope['path']}: {stats.count} запросов к БД "
+            f"({stats.seconds * 1000:.0f} ms из {seconds * 1000:.0f} ms), чаще всего: {top}"
+        )
@@ -0,0 +1,346 @@
+"""
+Полное обновление статусов всех отправлений с контрольными точками
+
+Проход идет по отправлениям в порядке id до max_shipment_id, взятого при
+старте, пачками по refresh_run_batch_size. После каждой пачки в refresh_runs
+записываются курсор (последний обработанный id) и счетчики, поэтому
+прерванный проход - процесс перезапущен или упал - следующий запуск
+продолжает с курсора, а не с первого отправления.
+
+Пачка забирается как у воркеров (app.worker): FOR UPDATE SKIP LOCKED
+и аренда на отправления. Отправления под чужой арендой (их уже опрашивает
+воркер или срочное обновление) и в паузе после ошибки опроса пропускаются.
+
+Запросы пачки к СДЭК идут одновременно и без обращений к БД, а результаты
+всей пачки записываются одной транзакцией (services.store_polled_batch).
+Запросы к БД выполняются в потоке, вне цикла событий веб-процесса.
+
+Незавершенный проход ведет один процесс (owner, heartbeat_at), проход
+упавшего процесса можно продолжить после refresh_run_lease_seconds.
+При остановке процесса новые запросы к СДЭК не начинаются, начатые
+дожидаются, и их результаты вместе с курсором записываются до выхода.
+
+Запуск:
+    python -m app.refresh_runs
+"""
+import argparse
+import asyncio
+import logging
+import signal
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, update, func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal
+from app.models import Shipment, RefreshRun
+from app.worker import default_worker_id, release, take_leases
+from app.cdek_client import cdek_client
+from app.services import PolledShipment
+from app import services
+
+logger = logging.getLogger(__name__)
+
+
+class RefreshRunBusy(Exception):
+    """Незавершенный проход ведет другой процесс"""
+
+
+def claim_run(db: Session, owner: str, lease_seconds: int) -> Tuple[RefreshRun, bool]:
+    """Продолжить незавершенный проход или начать новый; (проход, продолжен ли)"""
+    now = datetime.utcnow()
+    run = db.scalars(select(RefreshRun).where(RefreshRun.finished_at.is_(None))).first()
+    
+    if run is None:
+        run = RefreshRun(
+            status="running",
+            owner=owner,
+            heartbeat_at=now,
+            started_at=now,
+            max_shipment_id=db.scalar(select(func.max(Shipment.id))) or 0
+        )
+        db.add(run)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Проход одновременно начал другой процесс
+            db.rollback()
+            raise RefreshRunBusy()
+        return run, False
+    
+    taken = db.execute(
+        update(RefreshRun)
+        .where(
+            RefreshRun.id == run.id,
+            or_(RefreshRun.owner.is_(None), RefreshRun.heartbeat_at < now - timedelta(seconds=lease_seconds))
+        )
+        .values(status="running", owner=owner, heartbeat_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    
+    if not taken:
+        raise RefreshRunBusy()
+    
+    db.refresh(run)
+    return run, True
+
+
+def claim_run_batch(
+    db: Session,
+    owner: str,
+    cursor: int,
+    max_shipment_id: int,
+    batch_size: int,
+    lease_seconds: int
+) -> List[PolledShipment]:
+    """Следующая пачка прохода после курсора: без чужой аренды и паузы после ошибки"""
+    now = datetime.utcnow()
+    
+    stmt = (
+        select(Shipment.id, Shipment.tracking_code, Shipment.cdek_account, Shipment.failure_count)
+        .where(
+            Shipment.id > cursor,
+            Shipment.id <= max_shipment_id,
+            Shipment.quarantined_at.is_(None),
+            or_(Shipment.failure_count == 0, Shipment.next_poll_at.is_(None), Shipment.next_poll_at <= now),
+            or_(Shipment.lease_expires_at.is_(None), Shipment.lease_expires_at < now)
+        )
+        .order_by(Shipment.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    candidates = [PolledShipment(*row) for row in db.execute(stmt)]
+    leased = take_leases(db, owner, [item.id for item in candidates], now, lease_seconds)
+    
+    # Транзакция не держится открытой, пока идут запросы к СДЭК
+    db.commit()
+    return [item for item in candidates if item.id in leased]
+
+
+def checkpoint(db: Session, run_id: int, owner: str, last_shipment_id: int, results: List[Dict[str, Any]]) -> bool:
+    """Записать курсор и счетчики пачки; False - проход забрал другой процесс"""
+    succeeded = sum(1 for result in results if result["success"])
+    
+    updated = db.execute(
+        update(RefreshRun)
+        .where(RefreshRun.id == run_id, RefreshRun.owner == owner)
+        .values(
+            last_shipment_id=last_shipment_id,
+            processed=RefreshRun.processed + len(results),
+            succeeded=RefreshRun.succeeded + succeeded,
+            failed=RefreshRun.failed + len(results) - succeeded,
+            new_statuses=RefreshRun.new_statuses + sum(result.get("new_statuses", 0) for result in results),
+            heartbeat_at=datetime.utcnow()
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
+    return bool(updated)
+
+
+def finish_run(db: Session, run_id: int, owner: str, status: str) -> None:
+    """Отпустить проход: completed - завершен, interrupted - его продолжит следующий запуск"""
+    values = {"status": status, "owner": None}
+    if status == "completed":
+        values["finished_at"] = datetime.utcnow()
+    
+    db.execute(
+        update(RefreshRun)
+        .where(RefreshRun.id == run_id, RefreshRun.owner == owner)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+class RefreshRunner:
+    def __init__(
+        self,
+        owner: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        lease_seconds: Optional[int] = None
+    ):
+        # Незаданные параметры берутся из настроек при запуске: импорт модуля их не читает
+        self.owner = owner
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._lease_seconds = lease_seconds
+        self._stopping = asyncio.Event()
+    
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size or settings.refresh_run_batch_size
+    
+    @property
+    def concurrency(self) -> int:
+        return self._concurrency or settings.refresh_run_concurrency
+    
+    @property
+    def lease_seconds(self) -> int:
+        return self._lease_seconds or settings.refresh_run_lease_seconds
+    
+    def stop(self) -> None:
+        if not self._stopping.is_set():
+            logger.info("🛑 Проход обновления завершает начатые запросы и сохраняет курсор")
+        self._stopping.set()
+    
+    async def _fetch_batch(self, batch: List[PolledShipment]) -> List[PolledShipment]:
+        """
+        Запросы к СДЭК по пачке, без обращений к БД. Возвращает опрошенное начало
+        пачки: после остановки новые запросы не начинаются, а курсор не должен
+        перескочить неопрошенное отправление
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def fetch(item: PolledShipment) -> Optional[PolledShipment]:
+            async with semaphore:
+                if self._stopping.is_set():
+                    return None
+                try:
+                    item.fetched = await cdek_client.fetch_order(item.tracking_code, item.cdek_account)
+                except Exception as e:
+                    item.error = e
+                return item
+        
+        fetched = await asyncio.gather(*(fetch(item) for item in batch))
+        
+        done = []
+        for item in fetched:
+            if item is None:
+                break
+            done.append(item)
+        return done
+    
+    @staticmethod
+    def _store_batch(
+        db: Session,
+        run_id: int,
+        owner: str,
+        batch: List[PolledShipment],
+        polled: List[PolledShipment]
+    ) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        Записать результаты пачки, снять аренду и сохранить курсор; выполняется
+        в потоке, вне цикла событий. (результаты, проход по-прежнему наш)
+        """
+        results = []
+        try:
+            results = services.store_polled_batch(db, polled)
+        finally:
+            db.rollback()
+            # После успешного опроса следующий - через refresh_interval_seconds; ошибку
+            # store_polled_batch уже отложил паузой, неопрошенные остаются как были
+            succeeded = {item.id for item, result in zip(polled, results) if result["success"]}
+            release(db, owner, list(succeeded), datetime.utcnow() + timedelta(seconds=settings.refresh_interval_seconds))
+            release(db, owner, [item.id for item in batch if item.id not in succeeded], None)
+        
+        if not polled:
+            return results, True
+        return results, checkpoint(db, run_id, owner, polled[-1].id, results)
+    
+    async def run(self) -> Dict[str, Any]:
+        """Пройти по всем отправлениям, продолжив незавершенный проход, если он есть"""
+        # pid берется при вызове: при preload в gunicorn модуль импортируется еще в мастере
+        owner = self.owner or f"run:{default_worker_id()}"
+        
+        # Сессия используется последовательно, но каждый запрос к БД - в потоке,
+        # чтобы не останавливать цикл событий, обслуживающий HTTP-запросы
+        db = SessionLocal()
+        try:
+            run, resumed = await asyncio.to_thread(claim_run, db, owner, self.lease_seconds)
+            run_id = run.id
+            cursor = run.last_shipment_id
+            max_shipment_id = run.max_shipment_id
+            
+            if resumed:
+                logger.info(f"▶️ Продолжение прохода #{run_id} с отправления id>{cursor} (до {max_shipment_id})")
+            else:
+                logger.info(f"🔄 Проход #{run_id}: отправления до id {max_shipment_id}")
+            
+            results = []
+            status = "interrupted"
+            try:
+                while not self._stopping.is_set():
+                    batch = await asyncio.to_thread(
+                        claim_run_batch, db, owner, cursor, max_shipment_id, self.batch_size, self.lease_seconds
+                    )
+                    
+                    if not batch:
+                        status = "completed"
+                        break
+                    
+                    polled = []
+                    try:
+                        polled = await self._fetch_batch(batch)
+                    finally:
+                        done, still_owner = await asyncio.to_thread(
+                            self._store_batch, db, run_id, owner, batch, polled
+                        )
+                    if not polled:
+                        continue
+                    
+                    cursor = polled[-1].id
+                    if not still_owner:
+                        logger.warning(f"⚠️ Проход #{run_id} продолжает другой процесс, остановка")
+                        status = None
+                        break
+                    results.extend(done)
+            finally:
+                if status is not None:
+                    await asyncio.to_thread(finish_run, db, run_id, owner, status)
+            
+            run = await asyncio.to_thread(db.get, RefreshRun, run_id)
+            summary = {
+                "run_id": run_id,
+                "resumed": resumed,
+                "completed": run.status == "completed",
+                "processed": run.processed,
+                "succeeded": run.succeeded,
+                "failed": run.failed,
+                "new_statuses": run.new_statuses,
+                "results": results
+            }
+            
+            if summary["completed"]:
+                logger.info(f"✅ Проход #{run_id} завершен: обработано {run.processed}, ошибок {run.failed}")
+            else:
+                logger.info(f"⏸️ Проход #{run_id} прерван на отправлении id {cursor}")
+            
+            return summary
+        finally:
+            db.close()
+
+
+# Проход по запросу POST /update-statuses; останавливается вместе с веб-процессом
+refresh_runner = RefreshRunner()
+
+
+def main():
+    from app.logging_config import setup_logging
+    
+    parser = argparse.ArgumentParser(description="Обновление статусов всех отправлений с продолжением после остановки")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=None, help="Одновременных запросов к СДЭК")
+    args = parser.parse_args()
+    
+    setup_logging(log_level=settings.log_level)
+    
+    runner = RefreshRunner(batch_size=args.batch_size, concurrency=args.concurrency)
+    
+    async def run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, runner.stop)
+        try:
+            await runner.run()
+        except RefreshRunBusy:
+            logger.warning("⚠️ Проход уже ведет другой процесс")
+    
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
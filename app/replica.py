@@ -0,0 +1,188 @@
+"""
+Чтение с реплики БД
+
+Если задан DATABASE_REPLICA_URL, эндпоинты чтения (страницы, списки, поиск,
+карточки, аналитика) получают сессию реплики через get_read_db, а запись,
+воркеры и периодические задачи работают с основной БД.
+
+Отставание реплики измеряется по data_versions: запись увеличивает версию
+данных в той же транзакции, поэтому совпадение версий значит, что реплика
+догнала основную БД. Иначе отставание - возраст самого старого изменения
+основной БД, которого реплика не видит, по updated_at шардов версии в основной
+БД: после простоя оно не включает время, когда изменений не было.
+Проверка идет не чаще replica_lag_check_seconds;
+если отставание больше replica_max_lag_seconds или реплика недоступна,
+чтения идут в основную БД.
+
+После запроса на изменение (POST и т.п.) клиент получает cookie и
+replica_read_your_writes_seconds читает из основной БД, чтобы сразу видеть
+свои изменения.
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from fastapi import Request
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from app.config import settings
+from app.database import SessionLocal, get_replica_engine
+from app.models import DataVersion
+
+logger = logging.getLogger(__name__)
+
+READ_PRIMARY_COOKIE = "read_primary_until"
+UNSAFE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+
+def _data_versions(db: Session) -> Dict[str, Tuple[int, datetime]]:
+    rows = db.execute(select(DataVersion.name, DataVersion.version, DataVersion.updated_at)).all()
+    return {row.name: (row.version, row.updated_at) for row in rows}
+
+
+def measure_lag(primary: Session, replica: Session) -> float:
+    """
+    Секунды, на которые данные реплики старше основной БД; 0 - реплика догнала.
+    Шард, версия которого на реплике меньше, последний раз изменен в основной
+    БД в updated_at, и реплика этого изменения еще не видит
+    """
+    replica_versions = _data_versions(replica)
+    now = datetime.utcnow()
+    lag = 0.0
+    
+    for name, (version, updated_at) in _data_versions(primary).items():
+        replica_version, _ = replica_versions.get(name, (0, None))
+        if replica_version >= version:
+            continue
+        lag = max(lag, (now - updated_at).total_seconds())
+    
+    return lag
+
+
+class ReplicaMonitor:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at: Optional[float] = None
+        self._lag: Optional[float] = None
+        self._use_replica: Optional[bool] = None
+    
+    @property
+    def configured(self) -> bool:
+        return get_replica_engine() is not None
+    
+    def _is_stale(self) -> bool:
+        return (
+            self._checked_at is None
+            or time.monotonic() - self._checked_at >= settings.replica_lag_check_seconds
+        )
+    
+    def lag_seconds(self) -> Optional[float]:
+        """Отставание по последней проверке; None - реплика не настроена или недоступна"""
+        if not self.configured:
+            return None
+        
+        if self._is_stale():
+            with self._lock:
+                if self._is_stale():
+                    self._lag = self._measure()
+                    self._checked_at = time.monotonic()
+                    self._log_switch()
+        
+        return self._lag
+    
+    def _measure(self) -> Optional[float]:
+        primary = SessionLocal()
+        replica = SessionLocal(bind=get_replica_engine())
+        try:
+            return measure_lag(primary, replica)
+        except Exception as e:
+            logger.warning(f"⚠️ Реплика БД недоступна: {e}")
+            return None
+        finally:
+            replica.close()
+            primary.close()
+    
+    def _log_switch(self) -> None:
+        use_replica = self._lag is not None and self._lag <= settings.replica_max_lag_seconds
+        if use_replica != self._use_replica:
+            if use_replica:
+                logger.info(f"📗 Чтение с реплики БД, отставание {self._lag:.1f}s")
+            elif self._lag is not None:
+                logger.warning(f"📕 Реплика БД отстает на {self._lag:.1f}s, чтение из основной БД")
+        self._use_replica = use_replica
+    
+    def use_replica(self) -> bool:
+        lag = self.lag_seconds()
+        return lag is not None and lag <= settings.replica_max_lag_seconds
+    
+    def caught_up(self, db: Session) -> bool:
+        """Сессия реплики видит все изменения основной БД"""
+        primary = SessionLocal()
+        try:
+            return measure_lag(primary, db) == 0
+        finally:
+            primary.close()
+
+
+replica_monitor = ReplicaMonitor()
+
+
+def is_replica(db: Session) -> bool:
+    return db.info.get("replica", False)
+
+
+def cacheable(db: Session) -> bool:
+    """
+    Можно ли класть в общий кэш данные, прочитанные сессией: прочитанное
+    с отстающей реплики попало бы в кэш поколения, которое уже его сменило
+    """
+    return not is_replica(db) or replica_monitor.caught_up(db)
+
+
+def _reads_primary(request: Request) -> bool:
+    until = request.cookies.get(READ_PRIMARY_COOKIE)
+    if until is None:
+        return False
+    try:
+        return float(until) > time.time()
+    except ValueError:
+        return False
+
+
+def get_read_db(request: Request):
+    """Сессия для эндпоинтов чтения: реплика, если она настроена и не отстает, иначе основная БД"""
+    if not _reads_primary(request) and replica_monitor.use_replica():
+        db = SessionLocal(bind=get_replica_engine(), info={"replica": True})
+    else:
+        db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class ReadYourWritesMiddleware:
+    """Клиенту, который что-то изменил, - cookie на чтение из основной БД"""
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] not in UNSAFE_METHODS or not replica_monitor.configured:
+            await self.app(scope, receive, send)
+            return
+        
+        async def send_with_cookie(message: Message) -> None:
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                seconds = settings.replica_read_your_writes_seconds
+                headers = MutableHeaders(raw=message["headers"])
+                headers.append(
+                    "Set-Cookie",
+                    f"{READ_PRIMARY_COOKIE}={time.time() + seconds:.0f}; Max-Age={seconds}; Path=/; HttpOnly; SameSite=Lax"
+                )
+            await send(message)
+        
+        await self.app(scope, receive, send_with_cookie)
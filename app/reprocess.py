@@ -0,0 +1,146 @@
+"""
+Переобработка сохраненных ответов СДЭК
+
+Пересобирает shipment_statuses из raw_payloads без запросов к API, например
+после изменения разбора статусов. Отправления делятся на пачки, пачки
+обрабатываются параллельно в нескольких процессах; каждая пачка
+пересобирается в одной транзакции.
+
+Запуск:
+    python -m app.reprocess --processes 4
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import msgspec
+from sqlalchemy import select, delete
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal, get_engine
+from app.models import Shipment, ShipmentStatus, ShipmentPoll, RawPayload
+from app.cdek_schema import StatusEvent, decode_order
+from app.payloads import load_payload
+from app import services, analytics
+
+logger = logging.getLogger(__name__)
+
+
+def _shipment_ids_with_payloads(db: Session) -> List[int]:
+    stmt = select(ShipmentPoll.shipment_id).distinct().order_by(ShipmentPoll.shipment_id)
+    return list(db.scalars(stmt))
+
+
+def _load_events(db: Session, shipment_ids: List[int]) -> Dict[int, List[StatusEvent]]:
+    """События из всех сохраненных ответов по отправлениям, от старых ответов к новым"""
+    stmt = (
+        select(ShipmentPoll.shipment_id, RawPayload)
+        .join(RawPayload, RawPayload.id == ShipmentPoll.payload_id)
+        .where(ShipmentPoll.shipment_id.in_(shipment_ids))
+        .order_by(ShipmentPoll.shipment_id, ShipmentPoll.last_polled_at)
+    )
+    
+    events: Dict[int, List[StatusEvent]] = defaultdict(list)
+    for shipment_id, payload in db.execute(stmt).tuples():
+        try:
+            order = decode_order(load_payload(payload))
+        except msgspec.ValidationError as e:
+            logger.warning(f"⚠️ Ответ {payload.content_hash[:12]} не разобран: {e}")
+            continue
+        
+        if order is not None:
+            events[shipment_id].extend(order.statuses)
+    
+    return events
+
+
+def rebuild_shipments(db: Session, shipment_ids: List[int]) -> Tuple[int, int]:
+    """Пересобрать статусы пачки отправлений; возвращает (отправлений, статусов)"""
+    events = _load_events(db, shipment_ids)
+    shipments = db.scalars(select(Shipment).where(Shipment.id.in_(shipment_ids))).all()
+    
+    db.execute(delete(ShipmentStatus).where(ShipmentStatus.shipment_id.in_(shipment_ids)))
+    
+    statuses_count = 0
+    for shipment in shipments:
+        new_statuses = services.build_new_statuses(db, shipment, events.get(shipment.id, []), set())
+        db.add_all(new_statuses)
+        statuses_count += len(new_statuses)
+    
+    db.flush()
+    for shipment in shipments:
+        services.refresh_shipment_state(db, shipment)
+        analytics.refresh_shipment_facts(db, shipment)
+    
+    services.bump_data_version(db)
+    db.commit()
+    return len(shipments), statuses_count
+
+
+def _init_process() -> None:
+    # Соединения пула, унаследованные от родительского процесса, не используем
+    get_engine().dispose(close=False)
+
+
+def _rebuild_batch(shipment_ids: List[int]) -> Tuple[int, int]:
+    db = SessionLocal()
+    try:
+        return rebuild_shipments(db, shipment_ids)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"❌ Ошибка переобработки пачки {shipment_ids[0]}..{shipment_ids[-1]}: {e}")
+        return 0, 0
+    finally:
+        db.close()
+
+
+def reprocess_all(processes: Optional[int] = None, batch_size: int = 200) -> Dict[str, int]:
+    db = SessionLocal()
+    try:
+        shipment_ids = _shipment_ids_with_payloads(db)
+    finally:
+        db.close()
+    
+    batches = [shipment_ids[i:i + batch_size] for i in range(0, len(shipment_ids), batch_size)]
+    processes = processes or os.cpu_count() or 1
+    
+    logger.info(
+        f"♻️ Переобработка {len(shipment_ids)} отправлений: "
+        f"пачек={len(batches)}, процессов={processes}"
+    )
+    
+    shipments_done = 0
+    statuses_done = 0
+    
+    if processes == 1:
+        for shipments_count, statuses_count in map(_rebuild_batch, batches):
+            shipments_done += shipments_count
+            statuses_done += statuses_count
+    else:
+        get_engine().dispose()
+        with multiprocessing.Pool(processes, initializer=_init_process) as pool:
+            for shipments_count, statuses_count in pool.imap_unordered(_rebuild_batch, batches):
+                shipments_done += shipments_count
+                statuses_done += statuses_count
+                logger.info(f"   Переобработано отправлений: {shipments_done}/{len(shipment_ids)}")
+    
+    logger.info(f"✅ Переобработка завершена: отправлений {shipments_done}, статусов {statuses_done}")
+    return {"shipments": shipments_done, "statuses": statuses_done}
+
+
+def main():
+    from app.logging_config import setup_logging
+    
+    parser = argparse.ArgumentParser(description="Пересборка статусов из сохраненных ответов СДЭК")
+    parser.add_argument("--processes", type=int, default=None, help="Число процессов (по умолчанию - число CPU)")
+    parser.add_argument("--batch-size", type=int, default=200)
+    args = parser.parse_args()
+    
+    setup_logging(log_level=settings.log_level)
+    reprocess_all(processes=args.processes, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
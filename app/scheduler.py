@@ -0,0 +1,98 @@
+"""
+Периодические фоновые задачи приложения
+"""
+import asyncio
+import logging
+from typing import Any, Callable, List, Optional
+from app.config import settings
+from app.database import SessionLocal
+from app.leader import LeaderElector
+from app import services, analytics, outbox, archive
+
+logger = logging.getLogger(__name__)
+
+# Создается при старте планировщика в каждом процессе
+elector: Optional[LeaderElector] = None
+
+
+def sweep_problematic_job() -> None:
+    db = SessionLocal()
+    try:
+        changed = services.sweep_problematic_shipments(db)
+        if changed:
+            logger.info(f"🚨 Обновлены флаги проблемных отправлений: {changed}")
+    finally:
+        db.close()
+
+
+def refresh_analytics_job() -> None:
+    db = SessionLocal()
+    try:
+        counts = analytics.refresh_analytics(db)
+        logger.info(f"📈 Аналитика сроков доставки пересчитана: {counts}")
+    finally:
+        db.close()
+
+
+def ensure_partitions_job() -> None:
+    db = SessionLocal()
+    try:
+        archive.ensure_status_partitions(db)
+    finally:
+        db.close()
+
+
+async def dispatch_outbox_job() -> None:
+    await outbox.outbox_dispatcher.dispatch()
+
+
+async def run_periodic(name: str, interval: int, job: Callable[[], Any], leader: LeaderElector) -> None:
+    logger.info(f"⏱️ Периодическая задача {name} запущена, интервал {interval}s")
+    
+    while True:
+        # Задачи выполняет только лидер, остальные процессы только обслуживают HTTP
+        if leader.is_leader:
+            try:
+                # Асинхронные задачи (рассылка уведомлений) выполняются в цикле событий
+                if asyncio.iscoroutinefunction(job):
+                    await job()
+                else:
+                    await asyncio.to_thread(job)
+            except Exception as e:
+                logger.error(f"❌ Ошибка в периодической задаче {name}: {e}")
+            
+            await asyncio.sleep(interval)
+        else:
+            await asyncio.sleep(leader.heartbeat_seconds)
+
+
+def start_scheduler() -> List[asyncio.Task]:
+    global elector
+    elector = LeaderElector()
+    
+    tasks = [
+        asyncio.create_task(elector.run()),
+        asyncio.create_task(
+            run_periodic("sweep_problematic", settings.problem_sweep_interval_seconds, sweep_problematic_job, elector)
+        ),
+        asyncio.create_task(
+            run_periodic("analytics", settings.analytics_refresh_interval_seconds, refresh_analytics_job, elector)
+        ),
+        asyncio.create_task(
+            run_periodic("partitions", settings.partition_maintenance_interval_seconds, ensure_partitions_job, elector)
+        ),
+    ]
+    
+    if settings.notification_endpoints:
+        tasks.append(asyncio.create_task(
+            run_periodic("outbox", settings.notification_dispatch_interval_seconds, dispatch_outbox_job, elector)
+        ))
+    
+    return tasks
+
+
+async def stop_scheduler(tasks: List[asyncio.Task]) -> None:
+    for task in tasks:
+        task.cancel()
+    
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,210 @@
+"""
+Поиск отправлений по части трек-номера
+
+В PostgreSQL поиск идет по двум индексам shipments.tracking_code:
+btree text_pattern_ops для префикса (LIKE 'abc%', выдача в порядке индекса)
+и GIN pg_trgm для вхождения и нечеткого совпадения (опечатки).
+
+Без PostgreSQL процесс держит такой же индекс в памяти: отсортированный
+список трек-номеров (префикс - двоичным поиском) и списки позиций по
+триграммам. Сходство считается как similarity() в pg_trgm.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+import numpy as np
+from sqlalchemy import select, func, or_, text
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models import Shipment
+from app import services
+
+# Порог сходства по умолчанию в pg_trgm (pg_trgm.similarity_threshold)
+SIMILARITY_THRESHOLD = 0.3
+
+
+def trigrams(value: str) -> Set[str]:
+    """Триграммы как в pg_trgm: строка в нижнем регистре с пробелами по краям"""
+    padded = f"  {value.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _count_positions(postings: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Позиции из списков триграмм и сколько раз встретилась каждая (число общих триграмм)"""
+    merged = np.sort(np.concatenate(postings))
+    is_start = np.empty(len(merged), dtype=bool)
+    is_start[0] = True
+    np.not_equal(merged[1:], merged[:-1], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    return merged[starts], np.diff(np.append(starts, len(merged)))
+
+
+@dataclass(slots=True)
+class _IndexData:
+    codes: List[str] = field(default_factory=list)
+    ids: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int64))
+    postings: Dict[str, np.ndarray] = field(default_factory=dict)
+    trigram_counts: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=np.int32))
+    signature: Optional[Tuple[int, Optional[int]]] = None
+
+
+class TrackingCodeIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = _IndexData()
+        self._checked_at: Optional[float] = None
+    
+    def _is_stale(self) -> bool:
+        return (
+            self._checked_at is None
+            or time.monotonic() - self._checked_at >= settings.search_index_check_seconds
+        )
+    
+    def ensure_fresh(self, db: Session) -> None:
+        """
+        Раз в search_index_check_seconds сверить число отправлений и последний id
+        и перестроить индекс, если отправления добавлялись или удалялись
+        """
+        if not self._is_stale():
+            return
+        
+        with self._lock:
+            if not self._is_stale():
+                return
+            
+            signature = tuple(db.execute(select(func.count(Shipment.id), func.max(Shipment.id))).one())
+            if signature != self._data.signature:
+                self._data = self._build(db, signature)
+            self._checked_at = time.monotonic()
+    
+    @staticmethod
+    def _build(db: Session, signature: Tuple[int, Optional[int]]) -> _IndexData:
+        rows = db.execute(select(Shipment.id, Shipment.tracking_code).order_by(Shipment.tracking_code)).all()
+        codes = [row.tracking_code for row in rows]
+        
+        postings = defaultdict(list)
+        trigram_counts = np.empty(len(codes), dtype=np.int32)
+        for position, code in enumerate(codes):
+            code_trigrams = trigrams(code)
+            trigram_counts[position] = len(code_trigrams)
+            for trigram in code_trigrams:
+                postings[trigram].append(position)
+        
+        return _IndexData(
+            codes=codes,
+            ids=np.fromiter((row.id for row in rows), dtype=np.int64, count=len(rows)),
+            postings={trigram: np.array(positions, dtype=np.int32) for trigram, positions in postings.items()},
+            trigram_counts=trigram_counts,
+            signature=signature
+        )
+    
+    def search(self, query: str, limit: int) -> List[Tuple[int, str]]:
+        """(id отправления, "prefix" или "fuzzy"), сначала совпадения по префиксу"""
+        data = self._data
+        
+        prefix = []
+        position = bisect_left(data.codes, query)
+        while position < len(data.codes) and len(prefix) < limit and data.codes[position].startswith(query):
+            prefix.append(position)
+            position += 1
+        
+        results = [(int(data.ids[position]), "prefix") for position in prefix]
+        if len(results) < limit:
+            exclude = set(prefix)
+            fuzzy = [position for position in self._fuzzy(data, query, limit + len(prefix)) if position not in exclude]
+            results.extend((int(data.ids[position]), "fuzzy") for position in fuzzy[:limit - len(results)])
+        
+        return results
+    
+    @staticmethod
+    def _fuzzy(data: _IndexData, query: str, limit: int) -> List[int]:
+        """
+        Позиции трек-номеров, содержащих query или похожих на него: сначала
+        вхождения, затем по убыванию сходства
+        """
+        query_trigrams = trigrams(query)
+        postings = [data.postings[trigram] for trigram in query_trigrams if trigram in data.postings]
+        if not postings:
+            return []
+        
+        positions, shared = _count_positions(postings)
+        similarity = shared / (len(query_trigrams) + data.trigram_counts[positions] - shared)
+        
+        # Вхождение: у кандидата должны быть все внутренние триграммы запроса
+        lowered = query.lower()
+        inner = {lowered[i:i + 3] for i in range(len(lowered) - 2)}
+        contains = np.zeros(len(positions), dtype=bool)
+        if inner and all(trigram in data.postings for trigram in inner):
+            inner_positions, inner_shared = _count_positions([data.postings[trigram] for trigram in inner])
+            candidates = inner_positions[inner_shared == len(inner)]
+            matched = [position for position in candidates.tolist() if query in data.codes[position]]
+            contains = np.isin(positions, matched)
+        
+        selected = contains | (similarity >= SIMILARITY_THRESHOLD)
+        positions = positions[selected]
+        # При равном сходстве - по трек-номеру: позиции отсортированы по нему
+        order = np.lexsort((positions, -similarity[selected], ~contains[selected]))[:limit]
+        return positions[order].tolist()
+
+
+tracking_index = TrackingCodeIndex()
+
+
+def _search_postgresql(db: Session, query: str, limit: int) -> List[Tuple[int, str]]:
+    pattern = _escape_like(query)
+    
+    # ORDER BY ... USING ~<~ совпадает с порядком индекса text_pattern_ops,
+    # поэтому чтение индекса останавливается после limit строк
+    prefix = db.scalars(
+        select(Shipment.id)
+        .where(Shipment.tracking_code.like(f"{pattern}%"))
+        .order_by(text("shipments.tracking_code USING ~<~"))
+        .limit(limit)
+    ).all()
+    
+    results = [(shipment_id, "prefix") for shipment_id in prefix]
+    if len(results) < limit:
+        fuzzy = db.scalars(
+            select(Shipment.id)
+            .where(or_(Shipment.tracking_code.op("%")(query), Shipment.tracking_code.like(f"%{pattern}%")))
+            .order_by(
+                Shipment.tracking_code.like(f"%{pattern}%").desc(),
+                func.similarity(Shipment.tracking_code, query).desc(),
+                Shipment.tracking_code
+            )
+            .limit(limit + len(prefix))
+        ).all()
+        exclude = set(prefix)
+        results.extend(
+            (shipment_id, "fuzzy") for shipment_id in fuzzy if shipment_id not in exclude
+        )
+    
+    return results[:limit]
+
+
+def search_shipments(db: Session, query: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Отправления с текущим статусом, у которых трек-номер начинается с query, содержит его или похож"""
+    query = query.strip()
+    limit = limit or settings.search_default_limit
+    if not query:
+        return []
+    
+    if db.get_bind().dialect.name == "postgresql":
+        matches = _search_postgresql(db, query, limit)
+    else:
+        tracking_index.ensure_fresh(db)
+        matches = tracking_index.search(query, limit)
+    
+    details = services.get_shipment_details(db, [shipment_id for shipment_id, _ in matches])
+    return [
+        {**details[shipment_id], "match": match}
+        for shipment_id, match in matches
+        if shipment_id in details
+    ]
@@ -0,0 +1,125 @@
+"""
+Production-запуск веб-приложения
+
+gunicorn управляет процессами (предзагрузка приложения, плавный перезапуск
+по SIGHUP, перезапуск воркера после max_requests запросов), а каждый воркер
+обслуживает запросы через uvicorn с циклом uvloop и парсером httptools.
+
+Запуск:
+    python run.py                 # production, число воркеров из WEB_WORKERS
+    python run.py --reload        # разработка: один процесс с автоперезагрузкой
+"""
+import argparse
+import asyncio
+import multiprocessing
+import signal
+import sys
+from types import FrameType
+from typing import Any, Dict, Optional
+from gunicorn.app.base import BaseApplication
+from gunicorn.arbiter import Arbiter
+from uvicorn.server import Server
+from uvicorn.workers import UvicornWorker
+from app.config import settings
+
+APP_PATH = "app.main:app"
+
+
+class DrainingServer(Server):
+    def handle_exit(self, sig: int, frame: Optional[FrameType]) -> None:
+        # uvicorn ждет завершения начатых запросов, поэтому идущий проход обновления
+        # (POST /update-statuses) останавливается сразу: дописывает начатые запросы
+        # к СДЭК и курсор, а следующий запуск продолжает с него
+        from app.refresh_runs import refresh_runner
+        refresh_runner.stop()
+        super().handle_exit(sig, frame)
+
+
+class ProductionUvicornWorker(UvicornWorker):
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
+    
+    # Остановка прохода не переносится в lifespan: его shutdown uvicorn выполняет
+    # только после завершения начатых запросов, в том числе самого прохода.
+    # Сервер подменяется через открытые Worker.run и uvicorn.Server, без приватных методов UvicornWorker
+    def run(self) -> None:
+        asyncio.run(self.serve_draining())
+    
+    async def serve_draining(self) -> None:
+        self.config.app = self.wsgi
+        server = DrainingServer(config=self.config)
+        # SIGQUIT от мастера gunicorn - быстрая остановка, как в UvicornWorker
+        asyncio.get_running_loop().add_signal_handler(signal.SIGQUIT, self.handle_exit, signal.SIGQUIT, None)
+        await server.serve(sockets=self.sockets)
+        if not server.started:
+            sys.exit(Arbiter.WORKER_BOOT_ERROR)
+
+
+class GunicornApplication(BaseApplication):
+    def __init__(self, options: Dict[str, Any]):
+        self.options = options
+        super().__init__()
+    
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+    
+    def load(self):
+        from app.main import app
+        return app
+
+
+def default_workers() -> int:
+    return settings.web_workers or multiprocessing.cpu_count()
+
+
+def gunicorn_options(
+    host: str,
+    port: int,
+    workers: int,
+    max_requests: Optional[int] = None
+) -> Dict[str, Any]:
+    if max_requests is None:
+        max_requests = settings.web_max_requests
+    
+    return {
+        "bind": f"{host}:{port}",
+        "workers": workers,
+        "worker_class": "app.server.ProductionUvicornWorker",
+        # Приложение импортируется один раз в мастере; импорт ничего не открывает,
+        # поэтому воркеры не наследуют соединения с БД
+        "preload_app": True,
+        "max_requests": max_requests,
+        "max_requests_jitter": settings.web_max_requests_jitter if max_requests else 0,
+        "timeout": settings.web_timeout_seconds,
+        "graceful_timeout": settings.web_graceful_timeout_seconds,
+        "keepalive": settings.web_keepalive_seconds,
+        "accesslog": "-",
+        "errorlog": "-",
+        "loglevel": settings.log_level.lower()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запуск веб-приложения CDEK Delivery Monitoring")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None, help="Число процессов (по умолчанию WEB_WORKERS или число CPU)")
+    parser.add_argument("--max-requests", type=int, default=None, help="Перезапускать воркер после N запросов (0 - никогда)")
+    parser.add_argument("--reload", action="store_true", help="Режим разработки: один процесс с автоперезагрузкой")
+    args = parser.parse_args()
+    
+    host = args.host or settings.web_host
+    port = args.port or settings.web_port
+    
+    if args.reload:
+        import uvicorn
+        uvicorn.run(APP_PATH, host=host, port=port, reload=True)
+        return
+    
+    options = gunicorn_options(host, port, args.workers or default_workers(), args.max_requests)
+    GunicornApplication(options).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,85 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import desc
+from sqlalchemy import desc, func, select, insert, update, and_, case, or_, false, true
+from sqlalchemy.exc import IntegrityError
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
-from app.models import Shipment, ShipmentStatus
-from app.cdek_client import cdek_client
+from typing import List, Dict, Any, Iterator, Optional, Set, Tuple
+import logging
+import random
+from app.models import Shipment, ShipmentStatus, DataVersion
+from app.cdek_client import cdek_client, FetchedOrder, error_category, is_permanent_error
+from app import payloads
+from app.cdek_schema import StatusEvent
+from app.cache import cache
+from app.config import settings
+from app.lookups import lookups
+from app import analytics, outbox, replica
 
+logger = logging.getLogger(__name__)
 
-DELIVERED_STATUS_CODES = ["DELIVERED", "RECEIVED_AT_DELIVERY_OFFICE"]
 
+DATA_VERSION_NAME = "shipments"
 
-def get_all_shipments(db: Session) -> List[Shipment]:
-    return db.query(Shipment).all()
+
+def problem_threshold() -> timedelta:
+    return timedelta(days=settings.problem_threshold_days)
+
+
+def _data_version_shard_name(name: str, shard: int) -> str:
+    # Шард 0 - исходная строка версии, поэтому сумма продолжает прежний счетчик
+    return name if shard == 0 else f"{name}:{shard}"
+
+
+def bump_data_version(db: Session, name: str = DATA_VERSION_NAME) -> None:
+    """
+    Увеличить версию данных; вызывается в той же транзакции, что и изменение.
+    Версия разложена на data_version_shards строк, и транзакция меняет одну
+    случайную: одновременные записи воркеров не выстраиваются в очередь
+    на блокировке одной строки
+    """
+    shard_name = _data_version_shard_name(name, random.randrange(settings.data_version_shards))
+    bump = (
+        update(DataVersion)
+        .where(DataVersion.name == shard_name)
+        .values(version=DataVersion.version + 1, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    
+    if db.execute(bump).rowcount:
+        return
+    
+    try:
+        with db.begin_nested():
+            db.execute(insert(DataVersion).values(name=shard_name, version=1, updated_at=datetime.utcnow()))
+    except IntegrityError:
+        # Строку шарда одновременно создала другая транзакция
+        db.execute(bump)
+
+
+def get_data_version(db: Session, name: str = DATA_VERSION_NAME) -> int:
+    """Версия данных - сумма шардов; каждый шард только растет, поэтому растет и сумма"""
+    version = db.scalar(
+        select(func.sum(DataVersion.version))
+        .where(or_(DataVersion.name == name, DataVersion.name.like(f"{name}:%")))
+    )
+    return version or 0
+
+
+@dataclass(slots=True)
+class ShipmentRow:
+    """Строка списка отправлений: только нужные колонки, без ORM-объектов"""
+    id: int
+    tracking_code: str
+    created_at: datetime
+    status_code_id: Optional[int]
+    city_id: Optional[int]
+    reason_id: Optional[int]
+    status_datetime: Optional[datetime]
+    is_problematic: bool
+
+
+def _shipment_detail_cache_name(tracking_code: str) -> str:
+    return f"shipment:{tracking_code}"
 
 
 def get_shipment_by_tracking_code(db: Session, tracking_code: str) -> Optional[Shipment]:
@@ -20,6 +89,7 @@ def get_shipment_by_tracking_code(db: Session, tracking_code: str) -> Optional[S
 def create_shipment(db: Session, tracking_code: str) -> Shipment:
     shipment = Shipment(tracking_code=tracking_code)
     db.add(shipment)
+    bump_data_version(db)
     db.commit()
     db.refresh(shipment)
     return shipment
@@ -28,13 +98,14 @@ def create_shipment(db: Session, tracking_code: str) -> Shipment:
 def add_status_to_shipment(
     db: Session,
     shipment_id: int,
-    status_code: str,
-    status_text: str,
-    status_datetime: datetime
+    status_code_id: int,
+    status_datetime: datetime,
+    city_id: Optional[int] = None,
+    reason_id: Optional[int] = None
 ) -> ShipmentStatus:
     existing_status = db.query(ShipmentStatus).filter(
         ShipmentStatus.shipment_id == shipment_id,
-        ShipmentStatus.status_code == status_code,
+        ShipmentStatus.status_code_id == status_code_id,
         ShipmentStatus.status_datetime == status_datetime
     ).first()
     
@@ -43,40 +114,465 @@ def add_status_to_shipment(
     
     status = ShipmentStatus(
         shipment_id=shipment_id,
-        status_code=status_code,
-        status_text=status_text,
+        status_code_id=status_code_id,
+        city_id=city_id,
+        reason_id=reason_id,
         status_datetime=status_datetime
     )
     db.add(status)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # Тот же статус уже записан параллельным обновлением (uq_shipment_statuses_dedupe)
+        db.rollback()
+        return db.query(ShipmentStatus).filter(
+            ShipmentStatus.shipment_id == shipment_id,
+            ShipmentStatus.status_code_id == status_code_id,
+            ShipmentStatus.status_datetime == status_datetime
+        ).one()
     db.refresh(status)
     return status
 
 
-def get_latest_status(shipment: Shipment) -> Optional[ShipmentStatus]:
-    if not shipment.statuses:
+def _problem_since(
+    first_status_at: Optional[datetime],
+    is_delivered: bool,
+    now: datetime
+) -> Optional[datetime]:
+    """Момент, с которого отправление считается проблемным, или None"""
+    if first_status_at is None or is_delivered:
         return None
-    return max(shipment.statuses, key=lambda s: s.status_datetime)
+    
+    problem_since = first_status_at + problem_threshold()
+    
+    return problem_since if problem_since < now else None
 
 
-def get_first_status(shipment: Shipment) -> Optional[ShipmentStatus]:
-    if not shipment.statuses:
-        return None
-    return min(shipment.statuses, key=lambda s: s.status_datetime)
+def refresh_shipment_state(db: Session, shipment: Shipment) -> None:
+    """
+    Пересчитать сохраненное состояние отправления (первый/последний статус,
+    доставлено, проблемное) по его статусам. Вызывается при загрузке новых статусов.
+    """
+    refresh_shipments_state(db, [shipment])
+
+
+def refresh_shipments_state(db: Session, shipments: List[Shipment]) -> None:
+    """То же для пачки отправлений: два запроса на всю пачку"""
+    if not shipments:
+        return
+    
+    shipment_ids = [shipment.id for shipment in shipments]
+    bounds = {
+        row.shipment_id: (row.first_status_at, row.last_status_at)
+        for row in db.execute(
+            select(
+                ShipmentStatus.shipment_id,
+                func.min(ShipmentStatus.status_datetime).label("first_status_at"),
+                func.max(ShipmentStatus.status_datetime).label("last_status_at")
+            )
+            .where(ShipmentStatus.shipment_id.in_(shipment_ids))
+            .group_by(ShipmentStatus.shipment_id)
+        )
+    }
+    
+    ranked = (
+        select(
+            ShipmentStatus.shipment_id,
+            ShipmentStatus.status_code_id,
+            func.row_number().over(
+                partition_by=ShipmentStatus.shipment_id,
+                order_by=desc(ShipmentStatus.status_datetime)
+            ).label("rn")
+        )
+        .where(ShipmentStatus.shipment_id.in_(shipment_ids))
+        .subquery()
+    )
+    latest_code_ids = {
+        shipment_id: status_code_id
+        for shipment_id, status_code_id in db.execute(
+            select(ranked.c.shipment_id, ranked.c.status_code_id).where(ranked.c.rn == 1)
+        )
+    }
+    
+    now = datetime.utcnow()
+    for shipment in shipments:
+        first_status_at, last_status_at = bounds.get(shipment.id, (None, None))
+        latest_code_id = latest_code_ids.get(shipment.id)
+        
+        shipment.first_status_at = first_status_at
+        shipment.last_status_at = last_status_at
+        shipment.is_delivered = (
+            latest_code_id is not None and lookups.code(db, latest_code_id) in settings.delivered_status_codes
+        )
+        
+        problem_since = _problem_since(first_status_at, shipment.is_delivered, now)
+        shipment.is_problematic = problem_since is not None
+        shipment.problem_since = problem_since
+        # История статусов изменилась, даже если поля выше остались прежними
+        shipment.updated_at = now
+
+
+def sweep_problematic_shipments(db: Session) -> int:
+    """
+    Периодическая проверка: отметить отправления, у которых с первого статуса
+    прошло больше порога и которые еще не доставлены. Выборка идет
+    по частичному индексу ix_shipments_problem_sweep.
+    """
+    now = datetime.utcnow()
+    threshold = problem_threshold()
+    cutoff = now - threshold
+    
+    new_problems = db.execute(
+        select(Shipment.id, Shipment.tracking_code, Shipment.first_status_at).where(
+            Shipment.is_delivered == false(),
+            Shipment.is_problematic == false(),
+            Shipment.first_status_at < cutoff
+        )
+    ).all()
+    
+    if new_problems:
+        db.execute(update(Shipment), [
+            {"id": shipment_id, "is_problematic": True, "problem_since": first_status_at + threshold}
+            for shipment_id, _, first_status_at in new_problems
+        ])
+    
+    # Флаг снимается, если порог увеличили или отправление доставлено
+    cleared = db.scalars(
+        update(Shipment)
+        .where(
+            Shipment.is_problematic == true(),
+            or_(Shipment.is_delivered == true(), Shipment.first_status_at >= cutoff)
+        )
+        .values(is_problematic=False, problem_since=None)
+        .returning(Shipment.tracking_code)
+        .execution_options(synchronize_session=False)
+    ).all()
+    
+    changed = len(new_problems) + len(cleared)
+    if changed:
+        bump_data_version(db)
+    
+    db.commit()
+    
+    return changed
+
+
+def _shipment_rows_stmt(shipment_ids: Optional[List[int]] = None):
+    ranked = select(
+        ShipmentStatus.shipment_id,
+        ShipmentStatus.status_code_id,
+        ShipmentStatus.city_id,
+        ShipmentStatus.reason_id,
+        ShipmentStatus.status_datetime,
+        func.row_number().over(
+            partition_by=ShipmentStatus.shipment_id,
+            order_by=desc(ShipmentStatus.status_datetime)
+        ).label("rn")
+    )
+    if shipment_ids is not None:
+        # Фильтр внутри подзапроса, чтобы окно не считалось по всем статусам
+        ranked = ranked.where(ShipmentStatus.shipment_id.in_(shipment_ids))
+    ranked = ranked.subquery()
+    
+    stmt = (
+        select(
+            Shipment.id,
+            Shipment.tracking_code,
+            Shipment.created_at,
+            ranked.c.status_code_id,
+            ranked.c.city_id,
+            ranked.c.reason_id,
+            ranked.c.status_datetime,
+            Shipment.is_problematic
+        )
+        .outerjoin(ranked, and_(ranked.c.shipment_id == Shipment.id, ranked.c.rn == 1))
+        .order_by(Shipment.id)
+    )
+    if shipment_ids is not None:
+        stmt = stmt.where(Shipment.id.in_(shipment_ids))
+    return stmt
+
+
+def get_shipment_rows(db: Session) -> List[ShipmentRow]:
+    """
+    Список отправлений с последним статусом одним запросом.
+    
+    Последний статус выбирается оконной функцией row_number() по shipment_id,
+    поэтому статусы не подгружаются лениво для каждого отправления (N+1).
+    """
+    return [ShipmentRow(*row) for row in db.execute(_shipment_rows_stmt())]
+
+
+def iter_shipment_rows(db: Session, chunk_size: int = 500) -> Iterator[ShipmentRow]:
+    """Тот же список, но строки читаются из БД порциями по chunk_size"""
+    result = db.execute(_shipment_rows_stmt().execution_options(yield_per=chunk_size))
+    for row in result:
+        yield ShipmentRow(*row)
+
+
+def build_new_statuses(
+    db: Session,
+    shipment: Shipment,
+    events: List[StatusEvent],
+    existing: Set[Tuple[int, datetime]]
+) -> List[ShipmentStatus]:
+    """Строки shipment_statuses для событий, которых нет в existing (ключ - (status_code_id, status_datetime))"""
+    new_statuses = []
+    for event in events:
+        status_datetime = event.timestamp
+        if status_datetime is None:
+            logger.warning(
+                f"⚠️ {shipment.tracking_code}: пропущен статус {event.code} "
+                f"с некорректным временем {event.date_time!r}"
+            )
+            continue
+        
+        status_code_id = lookups.status_code_id(db, event.code, event.name)
+        
+        key = (status_code_id, status_datetime)
+        if key in existing:
+            continue
+        existing.add(key)
+        
+        new_statuses.append(ShipmentStatus(
+            shipment_id=shipment.id,
+            status_code_id=status_code_id,
+            city_id=lookups.city_id(db, event.city),
+            reason_id=lookups.reason_id(db, event.reason_code, event.reason),
+            status_datetime=status_datetime
+        ))
+    
+    return new_statuses
+
+
+def ingest_status_events(db: Session, shipment: Shipment, events: List[StatusEvent]) -> int:
+    """
+    Записать новые статусы отправления. Уже сохраненные статусы определяются
+    одним запросом по (status_code_id, status_datetime), новые записываются одной транзакцией.
+    """
+    existing = set(db.execute(
+        select(ShipmentStatus.status_code_id, ShipmentStatus.status_datetime)
+        .where(ShipmentStatus.shipment_id == shipment.id)
+    ).tuples())
+    
+    new_statuses = build_new_statuses(db, shipment, events, existing)
+    
+    if not new_statuses:
+        return 0
+    
+    db.add_all(new_statuses)
+    try:
+        db.flush()
+    except IntegrityError:
+        # Часть статусов уже записало параллельное обновление - записываем по одному
+        db.rollback()
+        shipment = db.get(Shipment, shipment.id)
+        for status in new_statuses:
+            add_status_to_shipment(
+                db,
+                shipment.id,
+                status.status_code_id,
+                status.status_datetime,
+                city_id=status.city_id,
+                reason_id=status.reason_id
+            )
+    
+    refresh_shipment_state(db, shipment)
+    analytics.refresh_shipment_facts(db, shipment)
+    outbox.record_statuses_added(db, shipment, new_statuses)
+    bump_data_version(db)
+    db.commit()
+    
+    return len(new_statuses)
+
+
+def failure_backoff(failure_count: int) -> timedelta:
+    seconds = settings.failure_backoff_base_seconds * 2 ** (failure_count - 1)
+    return timedelta(seconds=min(seconds, settings.failure_backoff_max_seconds))
 
 
-def is_problematic_shipment(shipment: Shipment) -> bool:
-    latest_status = get_latest_status(shipment)
-    first_status = get_first_status(shipment)
+def record_poll_failure(db: Session, shipment_id: int, error: Exception) -> Dict[str, Any]:
+    """
+    Учесть ошибку опроса: следующий опрос откладывается на failure_backoff,
+    а после quarantine_after_failures ошибок подряд с постоянной ошибкой
+    последней отправление уходит на карантин
+    """
+    # Ошибка могла прервать транзакцию загрузки статусов
+    db.rollback()
     
-    if not latest_status or not first_status:
-        return False
+    shipment = db.get(Shipment, shipment_id)
+    tracking_code = shipment.tracking_code
+    failure = _apply_poll_failure(shipment, error, datetime.utcnow())
+    db.commit()
     
-    is_delivered = latest_status.status_code in DELIVERED_STATUS_CODES
+    _log_quarantine(tracking_code, failure)
+    return failure
+
+
+def _apply_poll_failure(shipment: Shipment, error: Exception, now: datetime) -> Dict[str, Any]:
+    category = error_category(error)
     
-    days_since_first_status = (datetime.utcnow() - first_status.status_datetime).days
+    shipment.failure_count += 1
+    shipment.last_error = category
+    shipment.last_error_at = now
+    shipment.next_poll_at = now + failure_backoff(shipment.failure_count)
     
-    return not is_delivered and days_since_first_status > 3
+    quarantined = is_permanent_error(error) and shipment.failure_count >= settings.quarantine_after_failures
+    if quarantined:
+        shipment.quarantined_at = now
+    
+    return {
+        "error_category": category,
+        "failure_count": shipment.failure_count,
+        "quarantined": quarantined
+    }
+
+
+def _log_quarantine(tracking_code: str, failure: Dict[str, Any]) -> None:
+    if failure["quarantined"]:
+        logger.warning(
+            f"🚫 {tracking_code}: на карантине после {failure['failure_count']} ошибок ({failure['error_category']})"
+        )
+
+
+def _assign_account(db: Session, shipment_id: int, tracking_code: str, account_name: str) -> None:
+    """Запомнить аккаунт СДЭК отправления: следующие опросы идут только через него"""
+    db.execute(
+        update(Shipment)
+        .where(Shipment.id == shipment_id)
+        .values(cdek_account=account_name)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    logger.info(f"🔑 {tracking_code}: аккаунт СДЭК {account_name}")
+
+
+def _clear_failures(db: Session, shipment_id: int) -> None:
+    db.execute(
+        update(Shipment)
+        .where(Shipment.id == shipment_id)
+        .values(failure_count=0, last_error=None, last_error_at=None)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+@dataclass(slots=True)
+class PolledShipment:
+    """Отправление пачки и результат запроса к СДЭК: ответ (fetched) или ошибка (error)"""
+    id: int
+    tracking_code: str
+    cdek_account: Optional[str]
+    failure_count: int
+    fetched: Optional[FetchedOrder] = None
+    error: Optional[Exception] = None
+
+
+def store_polled_batch(db: Session, polled: List[PolledShipment]) -> List[Dict[str, Any]]:
+    """
+    Записать результаты опроса пачки одной транзакцией: аккаунты, сырые ответы,
+    статусы, состояние и ошибки пишутся общими запросами на пачку, а версия
+    данных увеличивается один раз. Результаты - в порядке polled, как у
+    update_shipment_statuses
+    """
+    if not polled:
+        return []
+    
+    now = datetime.utcnow()
+    shipments = {
+        shipment.id: shipment
+        for shipment in db.scalars(select(Shipment).where(Shipment.id.in_([item.id for item in polled])))
+    }
+    fetched = [item for item in polled if item.fetched is not None]
+    
+    moved = [item for item in fetched if item.fetched.account != item.cdek_account]
+    if moved:
+        db.execute(update(Shipment), [{"id": item.id, "cdek_account": item.fetched.account} for item in moved])
+        for item in moved:
+            logger.info(f"🔑 {item.tracking_code}: аккаунт СДЭК {item.fetched.account}")
+    
+    if settings.store_raw_payloads:
+        payloads.record_polls(db, [(item.id, item.fetched.payload) for item in fetched])
+    
+    events: Dict[int, List[StatusEvent]] = {}
+    for item in fetched:
+        try:
+            order = cdek_client.parse_order(item.tracking_code, item.fetched.payload)
+            events[item.id] = cdek_client.order_statuses(item.tracking_code, order)
+        except Exception as e:
+            item.error = e
+    
+    existing: Dict[int, Set[Tuple[int, datetime]]] = {shipment_id: set() for shipment_id in events}
+    if events:
+        for shipment_id, status_code_id, status_datetime in db.execute(
+            select(ShipmentStatus.shipment_id, ShipmentStatus.status_code_id, ShipmentStatus.status_datetime)
+            .where(ShipmentStatus.shipment_id.in_(list(events)))
+        ):
+            existing[shipment_id].add((status_code_id, status_datetime))
+    
+    new_statuses = {
+        shipment_id: build_new_statuses(db, shipments[shipment_id], shipment_events, existing[shipment_id])
+        for shipment_id, shipment_events in events.items()
+    }
+    _add_batch_statuses(db, new_statuses)
+    
+    changed = [shipments[shipment_id] for shipment_id, statuses in new_statuses.items() if statuses]
+    refresh_shipments_state(db, changed)
+    for shipment in changed:
+        analytics.refresh_shipment_facts(db, shipment)
+        outbox.record_statuses_added(db, shipment, new_statuses[shipment.id])
+    if changed:
+        bump_data_version(db)
+    
+    results = []
+    quarantined = []
+    for item in polled:
+        shipment = shipments[item.id]
+        if item.error is not None:
+            failure = _apply_poll_failure(shipment, item.error, now)
+            if failure["quarantined"]:
+                quarantined.append((item.tracking_code, failure))
+            results.append({"success": False, "tracking_code": item.tracking_code, "error": str(item.error), **failure})
+            continue
+        
+        if shipment.failure_count:
+            shipment.failure_count = 0
+            shipment.last_error = None
+            shipment.last_error_at = None
+        results.append({
+            "success": True,
+            "tracking_code": item.tracking_code,
+            "new_statuses": len(new_statuses[item.id]),
+            "total_statuses": len(events[item.id])
+        })
+    
+    db.commit()
+    
+    for tracking_code, failure in quarantined:
+        _log_quarantine(tracking_code, failure)
+    return results
+
+
+def _add_batch_statuses(db: Session, new_statuses: Dict[int, List[ShipmentStatus]]) -> None:
+    """Записать новые статусы пачки; при конфликте с параллельной загрузкой - по отправлению"""
+    try:
+        with db.begin_nested():
+            for statuses in new_statuses.values():
+                db.add_all(statuses)
+        return
+    except IntegrityError:
+        pass
+    
+    for shipment_id, statuses in new_statuses.items():
+        if not statuses:
+            continue
+        try:
+            with db.begin_nested():
+                db.add_all(statuses)
+        except IntegrityError:
+            # Эти статусы уже записала другая загрузка; состояние пересчитается по БД
+            logger.warning(f"⚠️ Статусы отправления {shipment_id} уже записаны параллельной загрузкой")
+            statuses.clear()
 
 
 async def update_shipment_statuses(db: Session, tracking_code: str) -> Dict[str, Any]:
@@ -85,116 +581,263 @@ async def update_shipment_statuses(db: Session, tracking_code: str) -> Dict[str,
     if not shipment:
         shipment = create_shipment(db, tracking_code)
     
+    # Коды на карантине не опрашиваются, пока оператор не снимет карантин
+    if shipment.quarantined_at is not None:
+        return {
+            "success": False,
+            "tracking_code": tracking_code,
+            "error": "quarantined",
+            "error_category": shipment.last_error,
+            "quarantined": True
+        }
+    
+    shipment_id = shipment.id
+    had_failures = shipment.failure_count > 0
+    account_name = shipment.cdek_account
+    # Транзакция чтения завершается до запроса к СДЭК, чтобы соединение
+    # вернулось в пул на время ожидания ответа
+    db.commit()
+    
     try:
-        statuses = await cdek_client.get_order_statuses(tracking_code)
+        fetched = await cdek_client.fetch_order(tracking_code, account_name)
+        payload = fetched.payload
+        
+        if fetched.account != account_name:
+            _assign_account(db, shipment_id, tracking_code, fetched.account)
+        
+        if settings.store_raw_payloads:
+            payloads.record_poll(db, shipment_id, payload)
+        order = cdek_client.parse_order(tracking_code, payload)
+        
+        events = cdek_client.order_statuses(tracking_code, order)
+        
+        new_statuses_count = ingest_status_events(db, shipment, events)
         
-        new_statuses_count = 0
-        for status_data in statuses:
-            status_datetime_str = status_data.get("datetime", "")
-            if status_datetime_str:
-                try:
-                    status_datetime = datetime.fromisoformat(status_datetime_str.replace("Z", "+00:00"))
-                except:
-                    status_datetime = datetime.utcnow()
-            else:
-                status_datetime = datetime.utcnow()
-            
-            status_text = status_data.get("name", "")
-            if status_data.get("city"):
-                status_text += f" ({status_data['city']})"
-            if status_data.get("reason"):
-                status_text += f" - {status_data['reason']}"
-            
-            existing = db.query(ShipmentStatus).filter(
-                ShipmentStatus.shipment_id == shipment.id,
-                ShipmentStatus.status_code == status_data["code"],
-                ShipmentStatus.status_datetime == status_datetime
-            ).first()
-            
-            if not existing:
-                add_status_to_shipment(
-                    db,
-                    shipment.id,
-                    status_data["code"],
-                    status_text,
-                    status_datetime
-                )
-                new_statuses_count += 1
+        if had_failures:
+            _clear_failures(db, shipment_id)
         
         return {
             "success": True,
             "tracking_code": tracking_code,
             "new_statuses": new_statuses_count,
-            "total_statuses": len(statuses)
+            "total_statuses": len(events)
         }
     
     except Exception as e:
         return {
             "success": False,
             "tracking_code": tracking_code,
-            "error": str(e)
+            "error": str(e),
+            **record_poll_failure(db, shipment_id, e)
         }
 
 
-async def update_all_shipments_statuses(db: Session) -> List[Dict[str, Any]]:
-    shipments = get_all_shipments(db)
-    results = []
-    
-    for shipment in shipments:
-        result = await update_shipment_statuses(db, shipment.tracking_code)
-        results.append(result)
+def get_quarantined_shipments(db: Session) -> List[Dict[str, Any]]:
+    shipments = db.scalars(
+        select(Shipment).where(Shipment.quarantined_at.is_not(None)).order_by(desc(Shipment.quarantined_at))
+    ).all()
     
-    return results
+    return [
+        {
+            "tracking_code": shipment.tracking_code,
+            "last_error": shipment.last_error,
+            "last_error_at": shipment.last_error_at.isoformat() if shipment.last_error_at else None,
+            "failure_count": shipment.failure_count,
+            "quarantined_at": shipment.quarantined_at.isoformat()
+        }
+        for shipment in shipments
+    ]
 
 
-def get_shipments_statistics(db: Session) -> Dict[str, int]:
-    shipments = get_all_shipments(db)
+def release_quarantine(db: Session, tracking_code: str) -> bool:
+    """Снять карантин: отправление опрашивается с ближайшим проходом воркеров"""
+    released = db.execute(
+        update(Shipment)
+        .where(Shipment.tracking_code == tracking_code, Shipment.quarantined_at.is_not(None))
+        .values(quarantined_at=None, failure_count=0, next_poll_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.commit()
     
-    total = len(shipments)
-    in_transit = 0
-    delivered = 0
-    problematic = 0
+    if released:
+        logger.info(f"✅ {tracking_code}: карантин снят")
     
-    for shipment in shipments:
-        latest_status = get_latest_status(shipment)
-        
-        if latest_status:
-            if latest_status.status_code in DELIVERED_STATUS_CODES:
-                delivered += 1
-            else:
-                in_transit += 1
-        
-        if is_problematic_shipment(shipment):
-            problematic += 1
+    return bool(released)
+
+
+def get_shipments_statistics(db: Session, version: Optional[int] = None) -> Dict[str, int]:
+    return cache.get_or_set(
+        "statistics",
+        lambda: _compute_shipments_statistics(db),
+        get_data_version(db) if version is None else version,
+        store=lambda: replica.cacheable(db)
+    )
+
+
+def _compute_shipments_statistics(db: Session) -> Dict[str, int]:
+    total, in_transit, delivered, problematic = db.execute(
+        select(
+            func.count(Shipment.id),
+            func.sum(case(
+                (and_(Shipment.first_status_at.is_not(None), Shipment.is_delivered == false()), 1),
+                else_=0
+            )),
+            func.sum(case((Shipment.is_delivered == true(), 1), else_=0)),
+            func.sum(case((Shipment.is_problematic == true(), 1), else_=0))
+        )
+    ).one()
     
     return {
         "total": total,
-        "in_transit": in_transit,
-        "delivered": delivered,
-        "problematic": problematic
+        "in_transit": in_transit or 0,
+        "delivered": delivered or 0,
+        "problematic": problematic or 0
     }
 
 
-def get_shipments_with_details(db: Session) -> List[Dict[str, Any]]:
-    shipments = get_all_shipments(db)
-    result = []
+def get_shipments_with_details(db: Session, version: Optional[int] = None) -> List[Dict[str, Any]]:
+    return cache.get_or_set(
+        "shipments",
+        lambda: _compute_shipments_with_details(db),
+        get_data_version(db) if version is None else version,
+        store=lambda: replica.cacheable(db)
+    )
+
+
+def _shipment_details(db: Session, row: ShipmentRow) -> Dict[str, Any]:
+    shipment_data = {
+        "id": row.id,
+        "tracking_code": row.tracking_code,
+        "created_at": row.created_at.isoformat(),
+        "current_status": None,
+        "current_status_datetime": None,
+        "problem": row.is_problematic
+    }
     
-    for shipment in shipments:
-        latest_status = get_latest_status(shipment)
-        
-        shipment_data = {
+    if row.status_datetime is not None:
+        shipment_data["current_status"] = lookups.status_text(db, row.status_code_id, row.city_id, row.reason_id)
+        shipment_data["current_status_datetime"] = row.status_datetime.isoformat()
+    
+    return shipment_data
+
+
+def get_shipment_details(db: Session, shipment_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+    """Данные для списка (как в get_shipments_with_details) только по указанным отправлениям"""
+    if not shipment_ids:
+        return {}
+    rows = db.execute(_shipment_rows_stmt(shipment_ids))
+    return {row.id: _shipment_details(db, ShipmentRow(*row)) for row in rows}
+
+
+def _shipment_timeline(db: Session, shipment_id: int) -> List[Dict[str, Any]]:
+    # Порядок индекса (shipment_id, status_datetime DESC): статусы читаются без сортировки
+    rows = db.execute(
+        select(
+            ShipmentStatus.status_code_id,
+            ShipmentStatus.city_id,
+            ShipmentStatus.reason_id,
+            ShipmentStatus.status_datetime
+        )
+        .where(ShipmentStatus.shipment_id == shipment_id)
+        .order_by(desc(ShipmentStatus.status_datetime))
+    ).all()
+    
+    return [
+        {
+            "status_code": lookups.code(db, row.status_code_id),
+            "status_text": lookups.status_text(db, row.status_code_id, row.city_id, row.reason_id),
+            "city": lookups.city_name(db, row.city_id),
+            "status_datetime": row.status_datetime.isoformat()
+        }
+        for row in reversed(rows)
+    ]
+
+
+def _compute_shipment_detail(db: Session, tracking_code: str) -> Optional[Dict[str, Any]]:
+    shipment = get_shipment_by_tracking_code(db, tracking_code)
+    if shipment is None:
+        return None
+    
+    return {
+        "id": shipment.id,
+        "tracking_code": shipment.tracking_code,
+        "created_at": shipment.created_at.isoformat(),
+        "first_status_at": shipment.first_status_at.isoformat() if shipment.first_status_at else None,
+        "last_status_at": shipment.last_status_at.isoformat() if shipment.last_status_at else None,
+        "delivered": shipment.is_delivered,
+        "problem": shipment.is_problematic,
+        "problem_since": shipment.problem_since.isoformat() if shipment.problem_since else None,
+        "cdek_account": shipment.cdek_account,
+        "failure_count": shipment.failure_count,
+        "last_error": shipment.last_error,
+        "quarantined_at": shipment.quarantined_at.isoformat() if shipment.quarantined_at else None,
+        "statuses": _shipment_timeline(db, shipment.id)
+    }
+
+
+def get_shipment_detail(db: Session, tracking_code: str) -> Optional[Dict[str, Any]]:
+    """
+    Карточка отправления с историей статусов от первого к последнему.
+    Кэшируется отдельно для каждого отправления с привязкой к его updated_at:
+    значение перестает находиться при изменении этого отправления в любом
+    процессе, а не при любой загрузке статусов.
+    """
+    updated_at = db.scalar(select(Shipment.updated_at).where(Shipment.tracking_code == tracking_code))
+    if updated_at is None:
+        # Отправления нет (или оно в архиве)
+        return _compute_shipment_detail(db, tracking_code)
+    
+    return cache.get_or_set_item(
+        _shipment_detail_cache_name(tracking_code),
+        updated_at.isoformat(),
+        lambda: _compute_shipment_detail(db, tracking_code),
+        store=lambda: replica.cacheable(db)
+    )
+
+
+def _compute_shipments_with_details(db: Session) -> List[Dict[str, Any]]:
+    return [_shipment_details(db, row) for row in get_shipment_rows(db)]
+
+
+def iter_shipments_with_details(db: Session, version: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Список отправлений для потоковой отдачи: готовый список из кэша,
+    а при его отсутствии - строки прямо из БД, без сборки всего списка в памяти
+    
+    version - версия данных, уже прочитанная для ETag: тело ответа берется из
+    кэша той же версии, что и заголовок
+    """
+    cached = cache.get("shipments", get_data_version(db) if version is None else version)
+    if cached is not None:
+        yield from cached
+        return
+    
+    for row in iter_shipment_rows(db):
+        yield _shipment_details(db, row)
+
+
+def get_problematic_shipments(db: Session, version: Optional[int] = None) -> List[Dict[str, Any]]:
+    return cache.get_or_set(
+        "problematic",
+        lambda: _compute_problematic_shipments(db),
+        get_data_version(db) if version is None else version,
+        store=lambda: replica.cacheable(db)
+    )
+
+
+def _compute_problematic_shipments(db: Session) -> List[Dict[str, Any]]:
+    shipments = db.execute(
+        select(Shipment.id, Shipment.tracking_code, Shipment.first_status_at, Shipment.problem_since)
+        .where(Shipment.is_problematic == true())
+        .order_by(Shipment.problem_since)
+    ).all()
+    
+    return [
+        {
             "id": shipment.id,
             "tracking_code": shipment.tracking_code,
-            "created_at": shipment.created_at.isoformat(),
-            "current_status": None,
-            "current_status_datetime": None,
-            "problem": is_problematic_shipment(shipment)
+            "first_status_at": shipment.first_status_at.isoformat(),
+            "problem_since": shipment.problem_since.isoformat()
         }
-        
-        if latest_status:
-            shipment_data["current_status"] = latest_status.status_text
-            shipment_data["current_status_datetime"] = latest_status.status_datetime.isoformat()
-        
-        result.append(shipment_data)
-    
-    return result
+        for shipment in shipments
+    ]
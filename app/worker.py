@@ -0,0 +1,231 @@
+"""
+Воркер обновления статусов
+
+Воркер забирает пачку отправлений, которые пора опрашивать, через
+SELECT ... FOR UPDATE SKIP LOCKED и ставит на них аренду (lease_owner,
+lease_expires_at). Несколько воркеров на разных узлах не пересекаются,
+а аренда упавшего воркера истекает, и его отправления забирают другие.
+
+Запуск (можно в нескольких процессах):
+    python -m app.worker
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+import socket
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+from sqlalchemy import select, update, or_, false
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.database import SessionLocal
+from app.models import Shipment
+from app import services
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class ClaimedShipment:
+    id: int
+    tracking_code: str
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_batch(
+    db: Session,
+    worker_id: str,
+    batch_size: int,
+    lease_seconds: int
+) -> List[ClaimedShipment]:
+    """Забрать до batch_size отправлений, которые пора опрашивать и которые никто не держит"""
+    now = datetime.utcnow()
+    
+    stmt = (
+        select(Shipment.id, Shipment.tracking_code)
+        .where(
+            Shipment.is_delivered == false(),
+            Shipment.quarantined_at.is_(None),
+            or_(Shipment.next_poll_at.is_(None), Shipment.next_poll_at <= now),
+            or_(Shipment.lease_expires_at.is_(None), Shipment.lease_expires_at < now)
+        )
+        .order_by(Shipment.next_poll_at.nulls_first(), Shipment.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    candidates = [ClaimedShipment(*row) for row in db.execute(stmt)]
+    leased = take_leases(db, worker_id, [item.id for item in candidates], now, lease_seconds)
+    
+    db.commit()
+    return [item for item in candidates if item.id in leased]
+
+
+def take_leases(
+    db: Session,
+    owner: str,
+    shipment_ids: List[int],
+    now: datetime,
+    lease_seconds: int
+) -> Set[int]:
+    """
+    Взять аренду отобранных отправлений и вернуть id тех, что достались owner.
+    Условие аренды проверяется повторно в самом UPDATE: без FOR UPDATE SKIP LOCKED
+    (SQLite) другой процесс мог забрать строку между SELECT и UPDATE
+    """
+    if not shipment_ids:
+        return set()
+    
+    return set(db.scalars(
+        update(Shipment)
+        .where(
+            Shipment.id.in_(shipment_ids),
+            or_(Shipment.lease_expires_at.is_(None), Shipment.lease_expires_at < now)
+        )
+        .values(lease_owner=owner, lease_expires_at=now + timedelta(seconds=lease_seconds))
+        .returning(Shipment.id)
+        .execution_options(synchronize_session=False)
+    ))
+
+
+def extend_leases(db: Session, worker_id: str, shipment_ids: List[int], lease_seconds: int) -> None:
+    if not shipment_ids:
+        return
+    
+    db.execute(
+        update(Shipment)
+        .where(Shipment.id.in_(shipment_ids), Shipment.lease_owner == worker_id)
+        .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_seconds))
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def release(
+    db: Session,
+    worker_id: str,
+    shipment_ids: List[int],
+    next_poll_at: Optional[datetime]
+) -> None:
+    """Снять аренду; next_poll_at=None оставляет время следующего опроса без изменений"""
+    if not shipment_ids:
+        return
+    
+    values = {"lease_owner": None, "lease_expires_at": None}
+    if next_poll_at is not None:
+        values["next_poll_at"] = next_poll_at
+    
+    db.execute(
+        update(Shipment)
+        .where(Shipment.id.in_(shipment_ids), Shipment.lease_owner == worker_id)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+class RefreshWorker:
+    def __init__(
+        self,
+        worker_id: Optional[str] = None,
+        batch_size: Optional[int] = None,
+        lease_seconds: Optional[int] = None
+    ):
+        self.worker_id = worker_id or default_worker_id()
+        self.batch_size = batch_size or settings.worker_batch_size
+        self.lease_seconds = lease_seconds or settings.worker_lease_seconds
+        self._stopping = asyncio.Event()
+    
+    def stop(self) -> None:
+        logger.info(f"🛑 Воркер {self.worker_id} завершает работу после текущего отправления")
+        self._stopping.set()
+    
+    async def process_batch(self, db: Session, claimed: List[ClaimedShipment]) -> int:
+        pending = [item.id for item in claimed]
+        lease_renew_at = datetime.utcnow() + timedelta(seconds=self.lease_seconds / 2)
+        processed = 0
+        
+        try:
+            for item in claimed:
+                if self._stopping.is_set():
+                    break
+                
+                if datetime.utcnow() >= lease_renew_at:
+                    extend_leases(db, self.worker_id, pending, self.lease_seconds)
+                    lease_renew_at = datetime.utcnow() + timedelta(seconds=self.lease_seconds / 2)
+                
+                result = await services.update_shipment_statuses(db, item.tracking_code)
+                if result["success"]:
+                    next_poll_at = datetime.utcnow() + timedelta(seconds=settings.refresh_interval_seconds)
+                else:
+                    # Время следующего опроса после ошибки уже назначил record_poll_failure
+                    logger.warning(f"⚠️ {item.tracking_code}: {result.get('error')}")
+                    next_poll_at = None
+                release(db, self.worker_id, [item.id], next_poll_at)
+                pending.remove(item.id)
+                processed += 1
+        finally:
+            # Необработанные отправления сразу возвращаются в очередь
+            release(db, self.worker_id, pending, None)
+        
+        return processed
+    
+    async def run(self, once: bool = False) -> None:
+        logger.info(
+            f"🚜 Воркер {self.worker_id} запущен: пачка={self.batch_size}, аренда={self.lease_seconds}s"
+        )
+        
+        while not self._stopping.is_set():
+            db = SessionLocal()
+            try:
+                claimed = claim_batch(db, self.worker_id, self.batch_size, self.lease_seconds)
+                if claimed:
+                    processed = await self.process_batch(db, claimed)
+                    logger.info(f"✅ Воркер {self.worker_id}: обработано {processed} из {len(claimed)}")
+            except Exception as e:
+                logger.error(f"❌ Ошибка воркера {self.worker_id}: {e}")
+                claimed = []
+            finally:
+                db.close()
+            
+            if once:
+                break
+            
+            if not claimed:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=settings.worker_idle_sleep_seconds)
+                except asyncio.TimeoutError:
+                    pass
+        
+        logger.info(f"👋 Воркер {self.worker_id} остановлен")
+
+
+def main():
+    from app.logging_config import setup_logging
+    
+    parser = argparse.ArgumentParser(description="Воркер обновления статусов отправлений")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--lease-seconds", type=int, default=None)
+    parser.add_argument("--once", action="store_true", help="Обработать одну пачку и выйти")
+    args = parser.parse_args()
+    
+    setup_logging(log_level=settings.log_level)
+    
+    worker = RefreshWorker(batch_size=args.batch_size, lease_seconds=args.lease_seconds)
+    
+    async def run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, worker.stop)
+        await worker.run(once=args.once)
+    
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Сравнение JSON-кодеков на типичных данных сервиса
+
+    python benchmarks/json_codec.py [--shipments 10000]
+
+1. Декодирование ответа СДЭК GET /orders: json.loads + обход словарей
+   против типизированного декодера msgspec (только используемые поля).
+2. Сериализация списка /api/shipments: jsonable_encoder + json.dumps
+   (путь FastAPI по умолчанию) против orjson.dumps (ORJSONResponse).
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from app.cdek_schema import order_response_decoder
+
+
+def make_cdek_response(statuses_count: int = 12) -> bytes:
+    now = datetime(2026, 1, 15, 10, 30)
+    order = {
+        "uuid": "72753031-4d8c-4d5f-9b33-6c8e1a3c2f11",
+        "type": 1,
+        "cdek_number": "1106698104",
+        "number": "SHOP-100500",
+        "tariff_code": 136,
+        "comment": "Тестовый заказ",
+        "sender": {"name": "Отправитель", "phones": [{"number": "+79000000001"}]},
+        "recipient": {"name": "Получатель", "phones": [{"number": "+79000000002"}]},
+        "from_location": {"code": 44, "city": "Москва", "address": "ул. Тестовая, д. 1"},
+        "to_location": {"code": 137, "city": "Санкт-Петербург", "address": "ул. Тестовая, д. 2"},
+        "packages": [{"number": "1", "weight": 1000, "length": 20, "width": 15, "height": 10}],
+        "statuses": [
+            {
+                "code": f"STATUS_{i}",
+                "name": f"Статус заказа {i}",
+                "date_time": (now + timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M:%S+0000"),
+                "city": "Москва",
+                "reason_code": None,
+                "reason": None
+            }
+            for i in range(statuses_count)
+        ]
+    }
+    return json.dumps({"entity": [order], "requests": []}, ensure_ascii=False).encode()
+
+
+def decode_with_json(raw: bytes):
+    data = json.loads(raw)
+    order = data["entity"][0]
+    return [
+        {
+            "code": status.get("code", ""),
+            "name": status.get("name", ""),
+            "datetime": status.get("date_time", ""),
+            "city": status.get("city", ""),
+            "reason_code": status.get("reason_code"),
+            "reason": status.get("reason")
+        }
+        for status in order.get("statuses", [])
+    ]
+
+
+def decode_with_msgspec(raw: bytes):
+    return order_response_decoder.decode(raw).entity[0].statuses
+
+
+def make_shipments(count: int):
+    now = datetime(2026, 1, 15, 10, 30)
+    return [
+        {
+            "id": i,
+            "tracking_code": f"{1106698104 + i}",
+            "created_at": (now - timedelta(days=i % 30)).isoformat(),
+            "current_status": "Принят на склад транзита (Москва)",
+            "current_status_datetime": (now - timedelta(hours=i % 48)).isoformat(),
+            "problem": i % 7 == 0
+        }
+        for i in range(count)
+    ]
+
+
+def encode_default(shipments):
+    return json.dumps(jsonable_encoder(shipments), ensure_ascii=False).encode()
+
+
+def encode_orjson(shipments):
+    return orjson.dumps(shipments)
+
+
+def bench(func, arg, number: int) -> float:
+    return min(timeit.repeat(lambda: func(arg), number=number, repeat=5)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shipments", type=int, default=10000)
+    args = parser.parse_args()
+    
+    raw = make_cdek_response()
+    decode_json = bench(decode_with_json, raw, 2000)
+    decode_msgspec = bench(decode_with_msgspec, raw, 2000)
+    
+    shipments = make_shipments(args.shipments)
+    encode_json = bench(encode_default, shipments, 5)
+    encode_fast = bench(encode_orjson, shipments, 5)
+    
+    print(f"Ответ СДЭК ({len(raw)} байт), на один ответ:")
+    print(f"  json + dict:       {decode_json * 1e6:8.1f} мкс")
+    print(f"  msgspec typed:     {decode_msgspec * 1e6:8.1f} мкс  (x{decode_json / decode_msgspec:.1f})")
+    print(f"/api/shipments, {args.shipments} отправлений:")
+    print(f"  jsonable_encoder:  {encode_json * 1e3:8.1f} мс")
+    print(f"  orjson:            {encode_fast * 1e3:8.1f} мс  (x{encode_json / encode_fast:.1f})")
+
+
+if __name__ == "__main__":
+    main()
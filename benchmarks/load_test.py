@@ -0,0 +1,433 @@
+"""
+Нагрузочный тест веб-приложения без внешних зависимостей
+
+    python benchmarks/load_test.py --shipments 2000 --workers 2 --concurrency 32 --duration 60 \
+        --mix "/=2,/shipments=1,/api/shipments=6,/update-statuses=0.1" --output load_report.json
+
+1. Схема БД создается миграциями (по умолчанию - SQLite во временном каталоге,
+   --database-url - своя БД), пустая БД заполняется отправлениями с историей
+   статусов через обычную загрузку статусов.
+2. Поднимается имитация API СДЭК (токен и GET /orders) с задержкой ответа,
+   долей ошибок 500 и появлением новых статусов при повторных опросах.
+3. Приложение запускается как в production (python run.py, gunicorn) с --workers
+   процессами, --concurrency клиентов шлют запросы в пропорциях --mix.
+4. Запросы за первые --warmup секунд не учитываются. Отчет - JSON на stdout
+   (и в --output): пропускная способность, p50/p95/p99 задержки, доля ошибок и
+   коды ответов - всего и по эндпоинтам.
+
+Ошибки - ответы 5xx и 4xx, кроме 409 (обновление всех отправлений уже идет),
+и сбои соединения. Переменные окружения приложения (CACHE_BACKEND,
+CDEK_RATE_LIMIT_PER_SECOND и т.п.) передаются запущенному серверу.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import httpx
+import numpy as np
+import orjson
+
+DEFAULT_MIX = "/=2,/shipments=1,/api/shipments=6,/update-statuses=0.1"
+POST_PATHS = {"/update-statuses"}
+# Ответ не ошибка: проход обновления уже выполняет другой запрос
+BUSY_STATUS = 409
+
+# Трек-номера нагрузочного теста: 9 и номер отправления
+TRACKING_CODE_BASE = 9_000_000_000
+
+STAGES = [
+    ("CREATED", "Создан"),
+    ("RECEIVED_AT_SHIPMENT_WAREHOUSE", "Принят на склад отправителя"),
+    ("SENT_TO_TRANSIT_CITY", "Отправлен в г. транзит"),
+    ("ACCEPTED_AT_TRANSIT_WAREHOUSE", "Принят на склад транзита"),
+    ("SENT_TO_RECIPIENT_CITY", "Отправлен в г. получатель"),
+    ("ACCEPTED_AT_PICK_UP_POINT", "Принят на склад доставки"),
+    ("DELIVERED", "Вручен")
+]
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Краснодар"]
+
+
+def tracking_code(index: int) -> str:
+    return str(TRACKING_CODE_BASE + index)
+
+
+def initial_statuses_count(index: int) -> int:
+    # Часть отправлений еще в пути, часть доставлена
+    return 1 + index % len(STAGES)
+
+
+def order_statuses(index: int, count: int, started_at: datetime) -> List[Dict[str, Any]]:
+    """Первые count статусов заказа; одинаковы при заполнении БД и в ответах имитации СДЭК"""
+    created_at = started_at - timedelta(days=4 + index % 10, minutes=index % 1440)
+    return [
+        {
+            "code": code,
+            "name": name,
+            "date_time": (created_at + timedelta(hours=12 * i)).strftime("%Y-%m-%dT%H:%M:%S+0000"),
+            "city": CITIES[(index + i) % len(CITIES)]
+        }
+        for i, (code, name) in enumerate(STAGES[:count])
+    ]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        path, _, weight = item.strip().partition("=")
+        if not path.startswith("/") or not weight:
+            raise argparse.ArgumentTypeError(f"Ожидается путь=вес через запятую, получено: {item!r}")
+        mix[path] = float(weight)
+    
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("Хотя бы один эндпоинт должен иметь вес больше 0")
+    return mix
+
+
+def serve_cdek(port: int, started_at: datetime, latency_ms: float, error_rate: float, new_status_rate: float) -> None:
+    """Имитация API СДЭК; запускается в отдельном процессе, чтобы не делить GIL с клиентами"""
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.requests import Request
+    from starlette.responses import Response
+    from starlette.routing import Route
+    
+    rng = random.Random(port)
+    # Статусы, появившиеся у заказа после заполнения БД
+    added: Counter = Counter()
+    
+    def json_response(content: Any, status_code: int = 200) -> Response:
+        return Response(orjson.dumps(content), status_code=status_code, media_type="application/json")
+    
+    async def token(request: Request) -> Response:
+        return json_response({"access_token": "load-test", "token_type": "bearer", "expires_in": 3600})
+    
+    async def orders(request: Request) -> Response:
+        # Задержка сети и API: экспоненциальное распределение со средним latency_ms
+        await asyncio.sleep(rng.expovariate(1000 / latency_ms) if latency_ms > 0 else 0)
+        
+        if rng.random() < error_rate:
+            return json_response({"requests": [{"state": "INVALID", "errors": [{"code": "internal"}]}]}, 500)
+        
+        code = request.query_params.get("cdek_number", "")
+        if not code.isdigit() or int(code) < TRACKING_CODE_BASE:
+            return json_response({"requests": [{"state": "INVALID", "errors": [{"code": "v2_entity_not_found"}]}]}, 404)
+        
+        index = int(code) - TRACKING_CODE_BASE
+        if rng.random() < new_status_rate:
+            added[index] += 1
+        count = min(initial_statuses_count(index) + added[index], len(STAGES))
+        
+        return json_response({
+            "entity": [{
+                "uuid": f"00000000-0000-4000-8000-{index:012d}",
+                "cdek_number": code,
+                "number": f"LOAD-{index}",
+                "statuses": order_statuses(index, count, started_at)
+            }],
+            "requests": []
+        })
+    
+    app = Starlette(routes=[
+        Route("/oauth/token", token, methods=["POST"]),
+        Route("/orders", orders, methods=["GET"])
+    ])
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning", access_log=False)
+
+
+def prepare_database(shipments: int, started_at: datetime) -> int:
+    """Миграции и заполнение пустой БД; возвращает число отправлений в БД"""
+    from alembic import command
+    from alembic.config import Config
+    
+    # alembic/env.py берет адрес БД из настроек приложения (DATABASE_URL)
+    config = Config()
+    config.set_main_option("script_location", os.path.join(ROOT, "alembic"))
+    command.upgrade(config, "head")
+    
+    from app.cdek_schema import StatusEvent
+    from app.database import SessionLocal
+    from app.models import Shipment
+    from app import services
+    
+    db = SessionLocal()
+    try:
+        existing = db.query(Shipment).count()
+        if existing:
+            print(f"БД уже содержит {existing} отправлений, заполнение пропущено", file=sys.stderr)
+            return existing
+        
+        for index in range(shipments):
+            shipment = services.create_shipment(db, tracking_code(index))
+            statuses = order_statuses(index, initial_statuses_count(index), started_at)
+            services.ingest_status_events(db, shipment, [StatusEvent(**status) for status in statuses])
+            if (index + 1) % 500 == 0:
+                print(f"  Заполнено отправлений: {index + 1}/{shipments}", file=sys.stderr)
+        return shipments
+    finally:
+        db.close()
+
+
+def start_server(port: int, workers: int, env: Dict[str, str], log_path: str) -> subprocess.Popen:
+    log = open(log_path, "wb")
+    process = subprocess.Popen(
+        [sys.executable, "run.py", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers)],
+        cwd=ROOT,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT
+    )
+    log.close()
+    return process
+
+
+def wait_ready(url: str, process: Optional[subprocess.Popen] = None, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Процесс завершился с кодом {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} не ответил за {timeout:.0f}s")
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.status_codes: Counter = Counter()
+        self.errors = 0
+    
+    def add(self, status: str, latency: float, error: bool) -> None:
+        self.latencies.append(latency)
+        self.status_codes[status] += 1
+        self.errors += error
+    
+    def merge(self, other: "EndpointStats") -> None:
+        self.latencies.extend(other.latencies)
+        self.status_codes.update(other.status_codes)
+        self.errors += other.errors
+    
+    def summary(self, duration: float) -> Dict[str, Any]:
+        requests = len(self.latencies)
+        latency_ms = {}
+        if requests:
+            latencies = np.array(self.latencies) * 1000
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+            latency_ms = {
+                "mean": round(float(latencies.mean()), 2),
+                "p50": round(float(p50), 2),
+                "p95": round(float(p95), 2),
+                "p99": round(float(p99), 2),
+                "max": round(float(latencies.max()), 2)
+            }
+        
+        return {
+            "requests": requests,
+            "throughput_rps": round(requests / duration, 2) if duration else 0.0,
+            "errors": self.errors,
+            "error_rate": round(self.errors / requests, 4) if requests else 0.0,
+            "status_codes": dict(sorted(self.status_codes.items())),
+            "latency_ms": latency_ms
+        }
+
+
+async def run_load(
+    base_url: str,
+    mix: Dict[str, float],
+    concurrency: int,
+    duration: float,
+    warmup: float,
+    timeout: float,
+    seed: int
+) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    paths = list(mix)
+    weights = [mix[path] for path in paths]
+    stats = {path: EndpointStats() for path in paths}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        loop = asyncio.get_running_loop()
+        measure_from = loop.time() + warmup
+        stop_at = measure_from + duration
+        
+        # Начало запроса, который сейчас ждет клиент
+        inflight: Dict[int, float] = {}
+        
+        async def user(number: int) -> None:
+            while loop.time() < stop_at:
+                path = rng.choices(paths, weights)[0]
+                method = "POST" if path in POST_PATHS else "GET"
+                started_at = loop.time()
+                inflight[number] = started_at
+                
+                try:
+                    response = await client.request(method, path)
+                    status = str(response.status_code)
+                    error = response.status_code >= 400 and response.status_code != BUSY_STATUS
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                    error = True
+                finally:
+                    inflight.pop(number, None)
+                
+                if started_at >= measure_from:
+                    stats[path].add(status, loop.time() - started_at, error)
+        
+        users = [asyncio.ensure_future(user(number)) for number in range(concurrency)]
+        await asyncio.sleep(stop_at - loop.time())
+        # Запросы, начатые в замере, дожидаются ответа и входят в него; начатые
+        # при прогреве (например, долгий проход обновления) не ждем
+        for number, task in enumerate(users):
+            if inflight.get(number, stop_at) < measure_from:
+                task.cancel()
+        await asyncio.gather(*users, return_exceptions=True)
+        elapsed = loop.time() - measure_from
+    
+    total = EndpointStats()
+    for endpoint_stats in stats.values():
+        total.merge(endpoint_stats)
+    
+    return {
+        # Пропускная способность - по окну замера, elapsed - вместе с ожиданием последних ответов
+        "elapsed_seconds": round(elapsed, 2),
+        "total": total.summary(duration),
+        "endpoints": {path: endpoint_stats.summary(duration) for path, endpoint_stats in stats.items()}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест с заполненной БД и имитацией API СДЭК")
+    parser.add_argument("--shipments", type=int, default=1000, help="Сколько отправлений создать в пустой БД")
+    parser.add_argument("--database-url", default=None, help="По умолчанию - SQLite во временном каталоге")
+    parser.add_argument("--workers", type=int, default=2, help="Процессов веб-сервера")
+    parser.add_argument("--concurrency", type=int, default=16, help="Одновременных клиентов")
+    parser.add_argument("--duration", type=float, default=30, help="Длительность замера, секунд")
+    parser.add_argument("--warmup", type=float, default=5, help="Не учитывать первые N секунд")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f"Пропорции запросов (по умолчанию {DEFAULT_MIX})")
+    parser.add_argument("--timeout", type=float, default=300, help="Таймаут запроса, секунд")
+    parser.add_argument("--cdek-latency-ms", type=float, default=100, help="Средняя задержка ответа СДЭК")
+    parser.add_argument("--cdek-error-rate", type=float, default=0.0, help="Доля ответов СДЭК 500")
+    parser.add_argument("--cdek-new-status-rate", type=float, default=0.1, help="Доля опросов, в ответе которых новый статус")
+    parser.add_argument("--log-level", default="WARNING", help="LOG_LEVEL сервера")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="Сохранить отчет в файл")
+    args = parser.parse_args()
+    
+    workdir = tempfile.mkdtemp(prefix="load_test_")
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'load_test.db')}"
+    cdek_port = free_port()
+    app_port = free_port()
+    started_at = datetime.utcnow()
+    
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "CDEK_API_URL": f"http://127.0.0.1:{cdek_port}",
+        "CDEK_CLIENT_ID": "load-test",
+        "CDEK_CLIENT_SECRET": "load-test",
+        "CDEK_ACCOUNTS": "[]",
+        "NOTIFICATION_ENDPOINTS": "[]",
+        "LOG_LEVEL": args.log_level,
+        "TEMPLATE_CACHE_DIR": os.path.join(workdir, "jinja")
+    }
+    # Настройки приложения в этом процессе (заполнение БД) - те же, что у сервера
+    os.environ.update(env)
+    
+    print(f"Рабочий каталог: {workdir}", file=sys.stderr)
+    shipments = prepare_database(args.shipments, started_at)
+    
+    cdek = multiprocessing.Process(
+        target=serve_cdek,
+        args=(cdek_port, started_at, args.cdek_latency_ms, args.cdek_error_rate, args.cdek_new_status_rate),
+        daemon=True
+    )
+    cdek.start()
+    server = start_server(app_port, args.workers, env, os.path.join(workdir, "server.log"))
+    
+    try:
+        # Имитация СДЭК отвечает 405 на GET /oauth/token - значит, уже слушает порт
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(f"http://127.0.0.1:{cdek_port}/oauth/token", timeout=1)
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        wait_ready(f"http://127.0.0.1:{app_port}/health", server)
+        
+        print(
+            f"Нагрузка: {args.concurrency} клиентов, {args.duration:.0f}s (+{args.warmup:.0f}s прогрев), "
+            f"{args.workers} процессов сервера, {shipments} отправлений",
+            file=sys.stderr
+        )
+        result = asyncio.run(run_load(
+            f"http://127.0.0.1:{app_port}",
+            args.mix,
+            args.concurrency,
+            args.duration,
+            args.warmup,
+            args.timeout,
+            args.seed
+        ))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        cdek.terminate()
+        cdek.join()
+    
+    report = {
+        "started_at": started_at.isoformat(),
+        "config": {
+            "database": database_url.split(":", 1)[0],
+            "shipments": shipments,
+            "workers": args.workers,
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "warmup_seconds": args.warmup,
+            "mix": args.mix,
+            "cdek_latency_ms": args.cdek_latency_ms,
+            "cdek_error_rate": args.cdek_error_rate,
+            "cdek_new_status_rate": args.cdek_new_status_rate
+        },
+        **result
+    }
+    
+    output = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(output)
+    print(output.decode())
+    print(f"Лог сервера: {os.path.join(workdir, 'server.log')}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
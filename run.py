@@ -1,9 +1,4 @@
-import uvicorn
+from app.server import main
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True
-    )
+    main()